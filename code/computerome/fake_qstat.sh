@@ -0,0 +1,5 @@
+#! /usr/bin/env bash
+# stand-in for qstat printing recorded output, for trying the monitor without a scheduler, e.g.
+# ICOPE_QSTAT=$apps/computerome/fake_qstat.sh ICOPE_QSTAT_CACHE=/tmp/qstat.xml monitor.py jobs -all
+# prints the file in QSTAT_SAMPLE if it is set, otherwise qstat_sample.xml next to this script
+cat "${QSTAT_SAMPLE:-$(dirname "$0")/qstat_sample.xml}"
@@ -0,0 +1,268 @@
+#! /usr/bin/env python3
+import os
+import re
+import sys
+import time
+import getpass
+import argparse
+import subprocess
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from utils_py.version import print_modules, imports
+from utils_py.files import atomic_write, SHARED_FILE_MODE
+
+# the qstat command can be replaced with a stand-in that prints recorded output, e.g. ICOPE_QSTAT=fake_qstat.sh which
+# prints qstat_sample.xml (or the file in QSTAT_SAMPLE)
+QSTAT = os.environ.get('ICOPE_QSTAT', 'qstat')
+# full status of all jobs as XML, with array jobs expanded to one record pr. sub-job
+QSTAT_ARGUMENTS = ['-f', '-x', '-t']
+# the output of the last query is kept here, so monitors started within the TTL share one qstat call
+CACHE_FILE = os.environ.get('ICOPE_QSTAT_CACHE',
+                            os.path.join(os.path.expanduser('~'), '.cache', 'icope_ngs', 'qstat.xml'))
+CACHE_TTL = 30
+# seconds between polls in watch mode, the wait doubles while nothing changes
+WATCH_INTERVAL = 30
+WATCH_MAX_INTERVAL = 600
+# C: completed, jobs in other states are still in the scheduler
+DONE_STATES = ['C']
+MEMORY_UNITS = {'b': 1, 'kb': 1 << 10, 'mb': 1 << 20, 'gb': 1 << 30, 'tb': 1 << 40}
+COLUMNS = ['id', 'name', 'state', 'array_index', 'walltime_used', 'walltime', 'memory_used', 'memory', 'exit_status',
+           'host', 'comment']
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Monitor PBS jobs from one bulk qstat query ({} {}) instead of calling checkjob or showstart pr. "
+                    "job. 'jobs' prints a table with state, walltime and memory used and requested, exit status and "
+                    "array index of each job. 'watch' polls until the jobs are done and prints the changes, waiting "
+                    "longer between polls while nothing changes. The qstat output is cached for a number of seconds "
+                    "in {} so repeated calls do not query the scheduler again.".format(
+                        QSTAT, ' '.join(QSTAT_ARGUMENTS), CACHE_FILE))
+    parser.add_argument('function', choices=['jobs', 'watch'])
+    parser.add_argument('-user', '--user', dest='user', default=getpass.getuser(),
+                        help="Owner of the jobs (Default: {})".format(getpass.getuser()))
+    parser.add_argument('-all', '--all-users', dest='user', action='store_const', const=None,
+                        help="Jobs of all users")
+    parser.add_argument('-state', '--state', dest='states', nargs='+',
+                        help="Only jobs in these states, e.g. R for running or Q for queued (Default: all)")
+    parser.add_argument('-name', '--name', dest='name', help="Only jobs with names matching this regular expression")
+    parser.add_argument('-ttl', '--ttl', dest='ttl', type=float, default=CACHE_TTL,
+                        help="Seconds the qstat output is reused, 0 to always query (Default: {})".format(CACHE_TTL))
+    parser.add_argument('-interval', '--interval', dest='interval', type=float, default=WATCH_INTERVAL,
+                        help="Seconds between polls (watch, Default: {})".format(WATCH_INTERVAL))
+    parser.add_argument('-max-interval', '--max-interval', dest='max_interval', type=float,
+                        default=WATCH_MAX_INTERVAL,
+                        help="Longest wait between polls while nothing changes (watch, Default: {})".format(
+                            WATCH_MAX_INTERVAL))
+    return parser
+
+
+def get_args(args=None):
+    parser = get_parser()
+    args = parser.parse_args(args)
+    if args.interval <= 0 or args.max_interval < args.interval:
+        parser.error("-interval has to be positive and at most -max-interval")
+    return args
+
+
+def parse_seconds(walltime):
+    """
+    Seconds of a walltime written as [[HH:]MM:]SS.
+    """
+    if not walltime: return None
+    seconds = 0
+    for part in walltime.split(':'):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def format_seconds(seconds):
+    if seconds is None: return ''
+    return "{}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def parse_memory(memory):
+    """
+    Bytes of a PBS memory size, e.g. 1234kb or 100gb.
+    """
+    if not memory: return None
+    match = re.fullmatch(r'(\d+)([kmgt]?b)?', memory.strip().lower())
+    if not match: return None
+    return int(match.group(1)) * MEMORY_UNITS[match.group(2) or 'b']
+
+
+def format_memory(memory):
+    if memory is None: return ''
+    return "{:.1f}gb".format(memory / MEMORY_UNITS['gb'])
+
+
+def parse_job(element):
+    """
+    Record of a Job element from qstat -f -x.
+    :param element: xml.etree Element
+    :return: dict with the keys of COLUMNS and owner, queue, queue_time and start_time (seconds since epoch), with
+    walltime in seconds and memory in bytes. Values not given by qstat (e.g. exit status of a running job) are None.
+    """
+    def text(path):
+        value = element.findtext(path)
+        return value.strip() if value else None
+
+    job_id = text('Job_Id')
+    array_index = text('job_array_id')
+    if array_index is None:
+        # sub-jobs are named <id>[<index>].<server>
+        match = re.search(r'\[(\d+)\]', job_id)
+        array_index = match.group(1) if match else None
+    exit_status = text('exit_status')
+    queue_time, start_time = text('qtime'), text('start_time')
+    return {'id': job_id, 'name': text('Job_Name'), 'owner': (text('Job_Owner') or '').split('@')[0],
+            'state': text('job_state'), 'queue': text('queue'),
+            'array_index': int(array_index) if array_index is not None else None,
+            'walltime_used': parse_seconds(text('resources_used/walltime')),
+            'walltime': parse_seconds(text('Resource_List/walltime')),
+            'memory_used': parse_memory(text('resources_used/mem')),
+            'memory': parse_memory(text('Resource_List/mem')),
+            'exit_status': int(exit_status) if exit_status is not None else None,
+            'host': (text('exec_host') or '').split('/')[0] or None, 'comment': text('comment'),
+            'queue_time': int(queue_time) if queue_time else None,
+            'start_time': int(start_time) if start_time else None}
+
+
+def parse_qstat(xml):
+    """
+    Records of all jobs in the XML output of qstat -f -x. qstat prints nothing when there are no jobs.
+    :return: list of dicts, see parse_job
+    """
+    if not xml.strip(): return []
+    return [parse_job(element) for element in ET.fromstring(xml).iter('Job')]
+
+
+def run_qstat(qstat=QSTAT):
+    """
+    :return: XML with the full status of all jobs
+    """
+    process = subprocess.run([qstat] + QSTAT_ARGUMENTS, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True)
+    if process.returncode != 0:
+        raise RuntimeError("{} failed: {}".format(qstat, process.stderr.strip()))
+    return process.stdout
+
+
+def read_cache(cache_file=CACHE_FILE, ttl=CACHE_TTL):
+    """
+    :return: cached qstat output if it is younger than ttl seconds, otherwise None
+    """
+    try:
+        if time.time() - os.path.getmtime(cache_file) > ttl: return None
+        with open(cache_file) as infile:
+            return infile.read()
+    except OSError:
+        return None
+
+
+def write_cache(xml, cache_file=CACHE_FILE):
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    # monitors of other users may share the cache file through ICOPE_QSTAT_CACHE
+    atomic_write(cache_file, lambda outfile: outfile.write(xml), SHARED_FILE_MODE, binary=False)
+
+
+def query_jobs(user=None, states=None, name=None, ttl=CACHE_TTL, cache_file=CACHE_FILE, qstat=QSTAT):
+    """
+    Records of jobs from one qstat call, or from the cache if it was queried less than ttl seconds ago. If qstat fails,
+    the last cached output is used no matter its age.
+    :param user: only jobs owned by this user, None for all
+    :param states: only jobs in these states, None for all
+    :param name: only jobs with names matching this regular expression
+    :return: list of dicts, see parse_job
+    """
+    xml = read_cache(cache_file, ttl) if ttl > 0 else None
+    if xml is None:
+        try:
+            xml = run_qstat(qstat)
+        except (OSError, RuntimeError) as e:
+            xml = read_cache(cache_file, float('inf'))
+            if xml is None: raise
+            print("# {}, using qstat output from {}".format(e, datetime.fromtimestamp(os.path.getmtime(cache_file))),
+                  file=sys.stderr)
+        else:
+            write_cache(xml, cache_file)
+    jobs = parse_qstat(xml)
+    if user: jobs = [job for job in jobs if job['owner'] == user]
+    if states: jobs = [job for job in jobs if job['state'] in states]
+    if name: jobs = [job for job in jobs if re.search(name, job['name'] or '')]
+    return jobs
+
+
+def format_job(job):
+    job = dict(job, walltime_used=format_seconds(job['walltime_used']), walltime=format_seconds(job['walltime']),
+               memory_used=format_memory(job['memory_used']), memory=format_memory(job['memory']))
+    return '\t'.join('' if job[column] is None else str(job[column]) for column in COLUMNS)
+
+
+def print_jobs(jobs):
+    print('# ' + '\t'.join(COLUMNS))
+    for job in jobs:
+        print(format_job(job))
+
+
+def state_counts(jobs):
+    counts = {}
+    for job in jobs:
+        counts[job['state']] = counts.get(job['state'], 0) + 1
+    return ' '.join("{}:{}".format(state, counts[state]) for state in sorted(counts))
+
+
+def watch(user=None, states=None, name=None, interval=WATCH_INTERVAL, max_interval=WATCH_MAX_INTERVAL,
+          cache_file=CACHE_FILE, qstat=QSTAT):
+    """
+    Poll the jobs until none of them are left in the scheduler or all are completed, printing the jobs that change
+    state. The wait between polls starts at interval and doubles after each poll without changes, up to max_interval.
+    :param states: only watch the jobs in these states at the first poll, they are then followed through all states
+    :return: list of the last records of all jobs seen, jobs that left the scheduler get the state None
+    """
+    last = {}
+    wait = interval
+    watched = None
+    while True:
+        # the cache is only reused within one poll interval, so other monitors can share the query
+        jobs = query_jobs(user, states if watched is None else None, name, interval, cache_file, qstat)
+        if states:
+            # filtering on the state of later polls would drop the jobs as they complete, before their exit status
+            if watched is None:
+                watched = set(job['id'] for job in jobs)
+            jobs = [job for job in jobs if job['id'] in watched]
+        current = {job['id']: job for job in jobs}
+        changed = False
+        for job_id, job in current.items():
+            previous = last.get(job_id, {}).get('state')
+            if previous != job['state']:
+                changed = True
+                print("{}\t{}\t{} -> {}".format(job_id, job['name'], previous or 'new', job['state']) +
+                      ("\texit status {}".format(job['exit_status']) if job['exit_status'] is not None else ''))
+        for job_id, job in last.items():
+            if job_id not in current and job['state'] is not None:
+                changed = True
+                print("{}\t{}\t{} -> gone".format(job_id, job['name'], job['state']))
+                last[job_id] = dict(job, state=None)
+        last.update(current)
+        wait = interval if changed else min(wait * 2, max_interval)
+        print("# {} {}".format(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), state_counts(jobs) or 'no jobs'))
+        if all(job['state'] in DONE_STATES for job in jobs):
+            return list(last.values())
+        sys.stdout.flush()
+        time.sleep(wait)
+
+
+if __name__ == '__main__':
+    args = get_args()
+    print_modules(imports(globals()))
+    if args.function == 'jobs':
+        print_jobs(query_jobs(args.user, args.states, args.name, args.ttl))
+    else:
+        try:
+            watched = watch(args.user, args.states, args.name, args.interval, args.max_interval)
+        except KeyboardInterrupt:
+            sys.exit(130)
+        failed = [job for job in watched if job['exit_status']]
+        print("# Done, {} job(s) with a nonzero exit status".format(len(failed)))
+        sys.exit(1 if failed else 0)
@@ -0,0 +1,6 @@
+#! /usr/bin/env bash
+# queued jobs with requested resources and the scheduler comment on why they are not running, from one qstat query.
+# qstat has no estimated start times, use showstart <job id> for a single job
+module load anaconda3/4.4.0
+apps="/home/projects/HT2_leukngs/apps/github/code"
+PYTHONPATH=$apps:$PYTHONPATH $apps/computerome/monitor.py jobs -state Q "$@"
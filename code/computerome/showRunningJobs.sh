@@ -1,9 +1,5 @@
 #!/bin/bash
-IDs=($(qstat -r | grep -oP '.*?(?=\.risoe)' | tr '\n' ' '))
-numberOfJobs=${#IDs[@]}
-
-for (( i=0; i<${numberOfJobs}; i++ ));
-do 
-  echo ${IDs[$i]}
-  checkjob ${IDs[$i] }
-done 
+# state, walltime and memory of the running jobs from one qstat query (see monitor.py -h, e.g. watch to follow them)
+module load anaconda3/4.4.0
+apps="/home/projects/HT2_leukngs/apps/github/code"
+PYTHONPATH=$apps:$PYTHONPATH $apps/computerome/monitor.py jobs -state R "$@"
@@ -1,11 +1,9 @@
 #! /usr/bin/env python3
-import pdb
 import os
 import sys
-import time
 import argparse
-import subprocess
 from utils_py.version import print_modules, imports
+from computerome.submit import submit_jobs
 from datetime import datetime
 
 
@@ -80,22 +78,26 @@ def find_pairs(samples, germline_pipeline, tumor_pipeline, paired_pipeline):
 
 
 
-def submit_pair(tumor, germline, dest):
-    # write qsub with paired
+def pair_job(tumor, germline, dest):
+    """
+    Job of the paired pipeline for a tumor and germline bam-file, as arguments for computerome.submit.write_job
+    """
     print("# Defining destination for somatic variants:", dest)
     apps='/home/projects/HT2_leukngs/apps/github/code'
-    jobname = dest
-    submit_string = "{a}/computerome/submit.py".format(a=apps)
-    submit_string += " 'germline={g}\ntumor={t}\ndestination={d}\n".format(g=germline, t=tumor, d=dest)
-    submit_string += "{a}/pipeline/sentieon_paired.sh $germline $tumor $destination' " \
-                     "--hours 24 -n {j} -np 28 --move-outfiles --tunnel -no-nr".format(a=apps, j=jobname)
-    subprocess.run(submit_string, shell=True, check=True)
-    time.sleep(1)
+    script = "germline={g}\ntumor={t}\ndestination={d}\n".format(g=germline, t=tumor, d=dest)
+    script += "{a}/pipeline/sentieon_paired.sh $germline $tumor $destination".format(a=apps)
+    return {'script': script, 'name': dest, 'numbering': False, 'hours': 24, 'nproc': 28, 'move_outfiles': True,
+            'tunnel': True}
+
+
+def submit_pair(tumor, germline, dest):
+    return submit_jobs([pair_job(tumor, germline, dest)])[0]
 
 
 def main(samples, psg, pst, psp):
-    for pair in find_pairs(samples, psg, pst, psp):
-        submit_pair(*pair)
+    # all pairs are submitted from this process, with the qsub calls rate limited by submit_jobs
+    job_ids = submit_jobs([pair_job(*pair) for pair in find_pairs(samples, psg, pst, psp)])
+    print("# Submitted {} pairs".format(len(job_ids)))
 
 
 if __name__ == "__main__":
@@ -103,9 +105,8 @@ if __name__ == "__main__":
     parsed_args = get_args()
     print("# args:", parsed_args)
     print("# Submitting paired jobs")
-    global_modules = globals()
-    modules = imports(global_modules)
-    print_modules(list(modules))
+    # module versions are only collected when printed, see utils_py.version
+    print_modules(imports(globals()))
     main(parsed_args.samples, parsed_args.PSG_version, parsed_args.PST_version, parsed_args.PSP_version)
     end_time = datetime.now()
     print("# Done!")
@@ -4,8 +4,20 @@ import os
 import time
 import argparse
 import re
+import subprocess
 from pathlib import Path
 
+# minimum seconds between qsub calls, so a batch does not flood the scheduler
+QSUB_INTERVAL = 0.2
+QSUB_RETRIES = 3
+# qsub errors worth retrying, other errors are raised right away as the job may have been submitted. A timeout is not
+# retried, the server may have queued the job before the reply was lost and a retry would submit it twice
+TRANSIENT_QSUB_ERRORS = ['cannot connect to server', 'connection refused', 'temporarily unavailable', 'server is busy',
+                         'pbs_iff', 'try again']
+_last_qsub = 0.0
+# marks where the number goes in a filename, it can not be part of a real filename
+NUMBER_MARKER = '\0'
+
 
 def get_args(args=None):
     """
@@ -92,24 +104,55 @@ def path_split_extension(fname):
     return root + extra_extension, extension
 
 
-def number_files(filenames, max_number=99):
+def used_numbers(filenames):
+    """
+    Numbers already appended to any of the filenames (as by filename_suffix), found by listing each folder once
+    instead of checking every possible name.
+    :param filenames: list of filenames without numbers
+    :return: set of ints
+    """
+    patterns = {}
+    for name in filenames:
+        # the name with a marker where the number goes, split in the part before and after the number
+        before, after = filename_suffix(name, NUMBER_MARKER).split(NUMBER_MARKER)
+        patterns.setdefault(os.path.dirname(before) or '.', []).append(
+            re.compile(re.escape(os.path.basename(before)) + r'(\d+)' + re.escape(after) + '$'))
+    used = set()
+    for directory, folder_patterns in patterns.items():
+        if not os.path.isdir(directory): continue
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                for pattern in folder_patterns:
+                    match = pattern.match(entry.name)
+                    if match: used.add(int(match.group(1)))
+    return used
+
+
+def number_files(filenames, width=2, reserve=False):
     """
-    Get filenames for each given that has a number appended. The number increases to avoid file conflict,
-    so we don't overwrite existing files.
+    Get filenames for each given that has a number appended. The lowest number not used by any of the files is taken,
+    so we don't overwrite existing files. Numbers are padded to the width and grow past it when needed (e.g. 99, 100).
     :param filenames: single filename or list of filenames to give a number (the same number for all)
-    :param max_number: maximum number to give. If this is reached it will be used even if it overwrites.
+    :param width: numbers are padded with zeros to this many digits
+    :param reserve: create the first file exclusively, so concurrent callers never get the same number
     :return: filename(s) to use as single string or list of strings
     """
     is_single = isinstance(filenames, str)
     if is_single: filenames = [filenames]
 
-    for i in range(max_number + 1):
-        names = [filename_suffix(name, str(i).rjust(len(str(max_number)), '0')) for name in filenames]
-        exists = [os.path.isfile(name) for name in names]
-        if any(exists): continue
-        # non exists if we get to this point
-        if is_single: return names[0]
-        return names
+    used = used_numbers(filenames)
+    i = 0
+    while True:
+        if i not in used:
+            names = [filename_suffix(name, str(i).rjust(width, '0')) for name in filenames]
+            try:
+                if reserve: os.close(os.open(names[0], os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                if is_single: return names[0]
+                return names
+            except FileExistsError:
+                # taken by another submission after the folder was listed
+                pass
+        i += 1
 
 
 def filename_suffix(fname, suffix):
@@ -145,8 +188,8 @@ def get_job_name(workdir, name, numbering=False):
     root = workdir + "/" + name
     # find out what the outfiles are gonna be named to look for file conflict
     outfnames = [root + ext for ext in ['.qsub', '.out', '.err']]
-    # append incremental numbers to avoid conflict
-    if numbering: outfnames = number_files(outfnames)
+    # append incremental numbers to avoid conflict, the qsub file is created to reserve the number
+    if numbering: outfnames = number_files(outfnames, reserve=True)
     elif any([os.path.isfile(f) for f in outfnames]): print("# submission files will be overwritten")
     # get the name part of one of the resulting filename
     return os.path.splitext(os.path.basename(outfnames[0]))[0]
@@ -285,34 +328,95 @@ def write_qsub(name, script, out_base, nproc=1, memory=20, walltime='1:00:00', w
     return qsub_filename
 
 
-def submit(fname):
-    start_dir = os.getcwd()
-    os.chdir(os.path.dirname(fname))
-    time.sleep(1)
-    os.system('qsub %s' % os.path.abspath(fname))
-    time.sleep(1)
-    os.chdir(start_dir)
+def submit(fname, wait_for=None, retries=QSUB_RETRIES, interval=QSUB_INTERVAL):
+    """
+    Submit a qsub file. qsub is run from the folder of the file, as $PBS_O_WORKDIR is where qsub was called.
+    :param fname: qsub file
+    :param wait_for: job id or list of job ids that have to finish successfully first
+    :param retries: number of retries on transient errors, with doubling waits
+    :param interval: minimum seconds since the last qsub call of this process
+    :return: job id
+    """
+    global _last_qsub
+    command = ['qsub']
+    if wait_for:
+        wait_for = [wait_for] if isinstance(wait_for, str) else wait_for
+        command += ['-W', 'depend=afterok:' + ':'.join(wait_for)]
+    command.append(os.path.abspath(fname))
+    delay = 1
+    for attempt in range(retries + 1):
+        time.sleep(max(0.0, _last_qsub + interval - time.time()))
+        _last_qsub = time.time()
+        process = subprocess.run(command, cwd=os.path.dirname(os.path.abspath(fname)), stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE, universal_newlines=True)
+        if process.returncode == 0:
+            return process.stdout.strip()
+        error = process.stderr.strip()
+        if attempt == retries or 'timed out' in error.lower() or \
+                not any(e in error.lower() for e in TRANSIENT_QSUB_ERRORS):
+            raise RuntimeError("qsub of {} failed: {}".format(fname, error))
+        print("# qsub failed ({}), retrying in {} seconds".format(error, delay))
+        time.sleep(delay)
+        delay *= 2
+
+
+def write_job(script, name="icope", numbering=True, hours=10, minutes=0, memory=100, nproc=28, workdir=None,
+              python=3, wait_for=None, tunnel=False, reserve=False, array=None, max_jobs=48, verbose=False,
+              move_outfiles=False):
+    """
+    Write the qsub file of a job, the arguments are as for the command line.
+    :param numbering: append a number to the name so no files are overwritten, None to use the name as it is
+    :return: tuple (job name, qsub filename)
+    """
+    workdir = os.path.abspath(workdir) if workdir else os.getcwd()
+    if numbering is not None:
+        name = get_job_name(workdir, name, numbering)
+    if not minutes and not hours:
+        minutes = 30
+    extra_string = get_array_PBS(array, max_jobs)
+    if tunnel:
+        home = str(Path.home())
+        print("# Configuring tunnel with scripts in", home)
+        extra_string += write_tunnel(home)
+    out_base = configure_outfiles(workdir, script, name, move_outfiles)
+    fname = write_qsub(name, script, out_base, nproc, memory, get_walltime(hours, minutes), workdir, python, wait_for,
+                       extra_string, reserve, verbose, tunnel, move_outfiles)
+    return name, fname
+
+
+def submit_jobs(jobs, dry_run=False, retries=QSUB_RETRIES, interval=QSUB_INTERVAL):
+    """
+    Write and submit many jobs from one process, without a new interpreter or fixed sleeps pr. job.
+    :param jobs: list of dicts with the arguments of write_job. A job can depend on earlier jobs of the batch with
+    'after': index or list of indices in jobs, its job is only started when they finished successfully
+    :param dry_run: only write the qsub files
+    :return: list of job ids (None for dry runs)
+    """
+    job_ids = []
+    for job in jobs:
+        job = dict(job)
+        after = job.pop('after', None)
+        after = [after] if isinstance(after, int) else (after or [])
+        name, fname = write_job(**job)
+        if dry_run:
+            job_ids.append(None)
+            continue
+        job_id = submit(fname, [job_ids[i] for i in after if job_ids[i]], retries, interval)
+        print("# submitted {} as {}".format(name, job_id))
+        job_ids.append(job_id)
+    return job_ids
 
 
 def main(args):
-    walltime = get_walltime(args.hours, args.minutes)
     python = 2 if args.python2 else 3
-
-    extra_string = get_array_PBS(args.array, args.max_jobs)
-    if args.tunnel:
-        home = str(Path.home())
-        print("# Configuring tunnel with scripts in", home) 
-        extra_string += write_tunnel(home)
     if args.verbose: print("write qsub")
-
-    workdir = os.path.abspath(args.workdir) if args.workdir else os.getcwd()
-    out_base = configure_outfiles(workdir, args.script, args.name, args.move_outfiles)
-
-    fname = write_qsub(args.name, args.script, out_base, args.nproc, args.memory, walltime, args.workdir, python,
-                       args.wait_for, extra_string, args.reserve, args.verbose, args.tunnel, args.move_outfiles)
+    # the name was already numbered by get_args
+    name, fname = write_job(args.script, args.name, None, args.hours, args.minutes, args.memory, args.nproc,
+                            args.workdir, python, args.wait_for, args.tunnel, args.reserve, args.array, args.max_jobs,
+                            args.verbose, args.move_outfiles)
     if args.verbose: print("submit qsub")
-    if not args.dry_run: 
-        submit(fname)
+    if not args.dry_run:
+        print(submit(fname))
         print("# submitted")
 
 
@@ -0,0 +1,118 @@
+#! /usr/bin/env python3
+
+import os
+import sys
+import time
+import runpy
+import argparse
+import subprocess
+
+# this file only imports the standard library, the libraries of a command are loaded when the command is run
+START_TIME = time.perf_counter()
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+# command name: script relative to the code folder, the rest of the arguments are passed on to the script
+COMMANDS = {
+    'coverage': 'quality/combined_coverage.py',
+    'chr-coverage': 'quality/chr_coverage.py',
+    'exon-coverage': 'quality/exon_coverage.py',
+    'gene-coverage': 'quality/gene_coverage.py',
+    'collect-coverage': 'ngs-tools/collect_coverage.py',
+    'vcf-stats': 'quality/vcf_stats.py',
+    'visualize-vcf-stats': 'quality/visualize_vcf_stats.py',
+    'visualize-stats': 'quality/visualize_stats.py',
+    'summarize-vep': 'ngs-tools/summarize_vep_variants.py',
+    'subset-vcf': 'ngs-tools/subset_vcf.py',
+    'qc-service': 'quality/qc_service.py',
+    'somatic-setup': 'computerome/somatic_setup.py',
+    'job-monitor': 'computerome/monitor.py',
+}
+# seconds from interpreter start until a command has parsed its arguments (measured with <command> --help)
+STARTUP_BUDGET = 2.0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="One entry point for the quality and ngs-tools scripts: icope_ngs.py <command> <arguments of the "
+                    "script>, e.g. icope_ngs.py vcf-stats count -in sample.vcf.gz. Only the libraries needed by the "
+                    "command are imported. Commands: " + ', '.join(
+                        f"{name} ({script})" for name, script in COMMANDS.items()))
+    parser.add_argument('command', nargs='?', choices=list(COMMANDS))
+    parser.add_argument('arguments', nargs=argparse.REMAINDER, help="Arguments of the command")
+    parser.add_argument('--print-modules', dest='print_modules', action='store_true',
+                        help="Print the versions of all modules loaded by the command when it is done")
+    parser.add_argument('--check-startup', dest='check_startup', action='store_true',
+                        help="Time the startup of all commands against the budget of {} seconds".format(
+                            STARTUP_BUDGET))
+    return parser
+
+
+def get_args(args=None):
+    parser = get_parser()
+    args = parser.parse_args(args)
+    if args.command is None and not args.check_startup:
+        parser.error("give a command or --check-startup")
+    return args
+
+
+def run_command(command, arguments):
+    """
+    Run the script of a command as if called directly, in this process.
+    :return: exit code of the script
+    """
+    script = os.path.join(CODE_DIR, COMMANDS[command])
+    # the scripts import from the code folder and read their arguments from sys.argv
+    if CODE_DIR not in sys.path:
+        sys.path.insert(0, CODE_DIR)
+    sys.argv = [script] + list(arguments)
+    try:
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    return 0
+
+
+def startup_time(command):
+    """
+    Seconds for a new interpreter to start a command and parse its arguments.
+    :return: tuple (seconds, exit code of <command> --help)
+    """
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, os.path.abspath(__file__), command, '--help'],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start, process.returncode
+
+
+def check_startup(commands, budget=STARTUP_BUDGET):
+    """
+    Print the startup time of each command. A command whose --help fails is not timed as a startup and fails the
+    check too.
+    :return: list of commands over the budget or failing
+    """
+    print("# Command\tStartup (s)")
+    over = []
+    for command in commands:
+        seconds, returncode = startup_time(command)
+        if returncode != 0:
+            print(f"{command}\t{seconds:.2f}\tfailed with exit code {returncode}")
+        else:
+            print(f"{command}\t{seconds:.2f}" + ("\tover budget" if seconds > budget else ''))
+        if returncode != 0 or seconds > budget:
+            over.append(command)
+    return over
+
+
+if __name__ == '__main__':
+    args = get_args()
+    if args.check_startup:
+        slow = check_startup([args.command] if args.command else list(COMMANDS))
+        print(f"# {len(slow)} command(s) failed or over the budget of {STARTUP_BUDGET} seconds")
+        sys.exit(1 if slow else 0)
+    exit_code = 1
+    try:
+        exit_code = run_command(args.command, args.arguments)
+    finally:
+        if args.print_modules:
+            from utils_py.version import print_modules, loaded_modules
+            print_modules(loaded_modules(), force=True)
+            print(f"# Startup and run time: {time.perf_counter() - START_TIME:.2f} seconds")
+    sys.exit(exit_code)
@@ -22,6 +22,26 @@ intronbed=/home/projects/HT2_leukngs/data/references/hg37/UCSC_introns_hg37.bed
 genepanel=/home/projects/HT2_leukngs/data/references/general/315_genes_of_interest.txt
 repair_genes=/home/projects/HT2_leukngs/data/references/general/DNA_repair_genes_core.txt
 
+# number of processes for collecting coverage, NPROC is set in the qsub-script from submit.py
+nproc=${NPROC:-1}
+
+# with QC_SPOOL set, the reports are made by a running QC service (quality/qc_service.py serve) that has the bed-files
+# and gene panels loaded already, started e.g. with:
+# qc_service.py serve -spool $QC_SPOOL -bed $bed -intronbed $intronbed -panel $genepanel $repair_genes -panel-suffix repair
+# the service runs samtools bedcov and bedtools genomecov like below
+# if no service is running (exit code 3), the reports are made here instead
+if [[ -n $QC_SPOOL ]]; then
+    echo "# Submitting QC of $sample to the service on $QC_SPOOL"
+    $apps/quality/qc_service.py submit -spool $QC_SPOOL -in ../$bam -out . -np $nproc -wait
+    status=$?
+    if [ $status -ne 3 ]; then
+        end=`date +%s`
+        echo "# Runtime in seconds:" $((end-start))
+        exit $status
+    fi
+    echo "# No QC service on $QC_SPOOL, making the reports here"
+fi
+
 echo "# Summarizing exon and gene coverage"
 start_bedcov=`date +%s`
 samtools bedcov $bed ../$bam > cov.canonical.exons.bed
@@ -29,19 +49,20 @@ end_bedcov=`date +%s`
 runtime=$((end_bedcov-start_bedcov))
 echo "Finished bedov in $runtime seconds"
 
-$apps/quality/combined_coverage.py -in cov.canonical.exons.bed -panel $genepanel -out $sample
-$apps/quality/combined_coverage.py -in cov.canonical.exons.bed -panel $repair_genes -out "$sample".repair
+# all gene panels are summarized in one pass over the exon coverage
+$apps/quality/combined_coverage.py -in cov.canonical.exons.bed -panel $genepanel $repair_genes -out $sample "$sample".repair
 
 # $apps/quality/exon_coverage.py $destination/cov.canonical.exons.bed $genepanel
 # $apps/quality/gene_coverage.py $destination/cov.canonical.exons.bed $genepanel
 
 # samtools bedcov $intronbed $bam > $destination/cov.introns.bed
-$apps/quality/combined_coverage.py -in ../$bam -bed $intronbed -intron -out "$sample".intronic
+# with more than one process, samtools bedcov runs on shards of the intron bed-file at the same time
+$apps/quality/combined_coverage.py -in ../$bam -bed $intronbed -intron -out "$sample".intronic -np $nproc
 
 
 echo "# Getting coverage pr. chromosome"
 #bedtools genomecov -ibam $bam -max 150 >  $destination/genome.cov
-$apps/quality/chr_coverage.py -in ../$bam -limit 150 -out "$sample".coverage
+$apps/quality/chr_coverage.py -in ../$bam -limit 150 -out "$sample".coverage -np $nproc
 
 end=`date +%s`
 runtime=$((end-start))
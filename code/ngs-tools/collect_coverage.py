@@ -1,18 +1,15 @@
 #! /usr/bin/env python3
 
-import pandas as pd
-import numpy as np
 import argparse
 from datetime import datetime
-import pdb
-import sys
-import subprocess
 import os
-from io import StringIO
+import threading
+from concurrent.futures import ThreadPoolExecutor
 # imports from own repo's
 from utils_py.version import print_modules, imports
 from computerome.somatic_setup import find_pairs
-from quality.gene_coverage import calculate_statistics
+from quality.combined_coverage import get_bam_coverage, calculate_coverage_stats
+from quality import coverage_cache
 
 
 def get_parser():
@@ -39,6 +36,20 @@ def get_parser():
                         help="Bed-file with intervals to look at. "
                              "(Default: /home/projects/HT2_leukngs/data/references/hg37/USCS.hg37.canonical.exons.bed)")
     parser.add_argument('-destination', dest='destination')
+    parser.add_argument('-np', '--processes', dest='processes', type=int, default=1,
+                        help="Number of concurrent samtools processes pr. bam-file, each running on a shard of the "
+                             "bed-file (Default: 1)")
+    parser.add_argument('-cache', '--cache-dir', dest='cache_dir', default=coverage_cache.CACHE_DIR,
+                        help="Folder for caching coverage of bam-files (Default: $ICOPE_BEDCOV_CACHE, no caching if "
+                             "it is not set)")
+    parser.add_argument('-no-cache', '--no-cache', dest='cache_dir', action='store_const', const=None,
+                        help="Do not use the coverage cache")
+    parser.add_argument('-workers', '--workers', dest='workers', type=int, default=1,
+                        help="Number of bam-files processed at the same time, both bam-files of a pair and several "
+                             "pairs are run concurrently (Default: 1)")
+    parser.add_argument('-max-reads', '--max-concurrent-reads', dest='max_reads', type=int,
+                        help="Maximum number of samtools processes reading bam-files at the same time (-np pr. "
+                             "bam-file), to keep I/O in check (Default: -workers times -np)")
     return parser
 
 
@@ -53,51 +64,69 @@ def get_args(args=None):
     return args
 
 
-def run_samtools(bam, bed):
-    print("# Running samtools for collecting coverage stats")
-    assert os.path.exists(bam), "does not exist"
-    assert os.path.exists(bed), "does not exist"
+class ReadLimit:
+    """
+    Limit on the number of processes reading bam-files, shared between threads. Reading a bam-file with n processes
+    takes n permits.
+    """
+
+    def __init__(self, processes):
+        self.processes = processes
+        self.available = processes
+        self.condition = threading.Condition()
+
+    def acquire(self, n):
+        """
+        Wait for n permits, at most all of them.
+        :return: number of permits taken
+        """
+        n = min(n, self.processes)
+        with self.condition:
+            self.condition.wait_for(lambda: self.available >= n)
+            self.available -= n
+        return n
+
+    def release(self, n):
+        with self.condition:
+            self.available += n
+            self.condition.notify_all()
+
+
+def process_bam(bam, bed, panel, processes=1, cache_dir=None, read_limit=None):
+    """
+    Coverage stats for one bam-file.
+    :param read_limit: ReadLimit shared between threads that limits the number of processes reading bam-files
+    :return: gene coverage, low coverage exons and chromosome coverage
+    """
+    import pandas as pd
+    print(f"# Processing {bam} ... ")
+    if read_limit is None:
+        return calculate_coverage_stats(get_bam_coverage(bam, bed, processes, cache_dir=cache_dir), panel)
+    permits = read_limit.acquire(processes)
     try:
-        input = subprocess.Popen(["samtools", "bedcov", bed, bam], stdout=subprocess.PIPE)
-    except OSError as e:
-        print("# Could not run samtools, try to use: module load samtools/1.9 and/or check path")
-    print("# Decoding bedcov output ... ") 
-    decoding = StringIO(input.communicate()[0].decode('utf-8'))
-    data = pd.read_csv(decoding, sep='\t', header=None)
-    data.columns = ['chromosome', 'start', 'end', 'gene', 'exon', 'strand', 'coverage']
-    data.drop(columns=['strand'], inplace=True)
-    return data
-
-
-def calculate_coverage_stats(data, panel):
-    print("# Calculating coverage stats ... ") 
-    data['mean_cov'] = data['coverage'] / (data['end'] - data['start'])
-    data['exons_above20x_frac'] = data['mean_cov'].apply(lambda x: int(x > 20.0))
-    coverage_chromosomes = data.groupby('chromosome').mean()
-    # filter gene coverage data
-    data_interest = data[data['gene'].isin(panel)]
-    coverage_genes = data_interest.groupby('gene').mean()
-    low_coverage_exons = data_interest[data_interest['mean_cov'] < 20.0]
-    return coverage_genes.loc[:, ['mean_cov', 'exons_above20x_frac']], \
-           low_coverage_exons.loc[:, ['chromosome', 'gene', 'exon', 'mean_cov']], \
-           coverage_chromosomes.loc[:, ['mean_cov', 'exons_above20x_frac']]
-
-
-def process_pair(germline, tumor, bed, destination, panel):
-    print(f"# Processing {germline} ... ")
-    germline_coverage_genes, germline_low_cov_exons, germline_coverage_chrom =\
-        calculate_coverage_stats(run_samtools(germline, bed), panel)
-    print(f"# Processing {tumor} ... ")
-    tumor_coverage_genes, tumor_low_cov_exons, tumor_coverage_chrom = \
-        calculate_coverage_stats(run_samtools(tumor, bed), panel)
-    # sample_name = germline.split('.bam')[0]
+        data = get_bam_coverage(bam, bed, processes, cache_dir=cache_dir)
+        if isinstance(data, pd.DataFrame):
+            # the bam-file has been read, so the statistics are made without the permits. The output of a single
+            # samtools process is streamed instead, so that process runs until the statistics are done
+            read_limit.release(permits)
+            permits = 0
+        return calculate_coverage_stats(data, panel)
+    finally:
+        read_limit.release(permits)
+
+
+def write_pair(germline, tumor, germline_stats, tumor_stats, destination, pair_name):
+    import pandas as pd
+    germline_coverage_genes, germline_low_cov_exons, germline_coverage_chrom = germline_stats
+    tumor_coverage_genes, tumor_low_cov_exons, tumor_coverage_chrom = tumor_stats
 
     print("# Merging results ")
     merge = pd.merge(tumor_coverage_genes, germline_coverage_genes,
-                     left_index=True, right_index=True, suffixes=('_germline', '_tumor'))
+                     left_index=True, right_index=True, suffixes=('_tumor', '_germline'))
     sample_t = os.path.basename(tumor)
     sample_g = os.path.basename(germline)
-    output = destination + 'merged' + '.tsv'
+    # one merged file pr. pair, so pairs of a cohort do not overwrite each other
+    output = os.path.join(destination, os.path.basename(pair_name) + '_merged' + '.tsv')
     print(f"# Writing output to in {output}")
     merge.to_csv(output, sep='\t')
 
@@ -113,21 +142,53 @@ def process_pair(germline, tumor, bed, destination, panel):
     germline_low_cov_exons.to_csv(path_g + '/' + sample_g + '_low_cov_exons', sep='\t', index=False)
 
 
-def main(samples, psg, pst, psp, destination, bed, panel_file):
+def process_pair(germline, tumor, pair_name, bed, destination, panel, processes=1, cache_dir=None):
+    germline_stats = process_bam(germline, bed, panel, processes, cache_dir)
+    tumor_stats = process_bam(tumor, bed, panel, processes, cache_dir)
+    write_pair(germline, tumor, germline_stats, tumor_stats, destination, pair_name)
+
+
+def process_pairs(pairs, bed, destination, panel, processes=1, cache_dir=None, workers=2, max_reads=None):
+    """
+    Process many pairs with a pool of threads. The work is done in samtools processes, the threads keep both bam-files
+    of a pair and several pairs in flight.
+    :param pairs: iterable of (tumor, germline, pair name) as yielded by find_pairs
+    :param workers: number of bam-files processed at the same time
+    :param max_reads: maximum number of processes reading bam-files at the same time (Default: workers * processes)
+    """
+    read_limit = ReadLimit(max_reads or workers * processes)
+    with ThreadPoolExecutor(workers) as executor:
+        submitted = []
+        for tumor, germline, pair_name in pairs:
+            submitted.append((germline, tumor, pair_name,
+                              executor.submit(process_bam, germline, bed, panel, processes, cache_dir, read_limit),
+                              executor.submit(process_bam, tumor, bed, panel, processes, cache_dir, read_limit)))
+        for germline, tumor, pair_name, germline_stats, tumor_stats in submitted:
+            write_pair(germline, tumor, germline_stats.result(), tumor_stats.result(), destination, pair_name)
+
+
+def main(samples, psg, pst, psp, destination, bed, panel_file, processes=1, cache_dir=None, workers=1,
+         max_reads=None):
+    import pandas as pd
     gene_panel = list(pd.read_csv(panel_file).values.flatten())
-    for germline, tumor, _ in find_pairs(samples, psg, pst, psp):
-        process_pair(germline, tumor, destination, bed, gene_panel)
+    pairs = find_pairs(samples, psg, pst, psp)
+    if workers > 1:
+        process_pairs(pairs, bed, destination, gene_panel, processes, cache_dir, workers, max_reads)
+        return
+    # find_pairs yields the tumor bam first
+    for tumor, germline, pair_name in pairs:
+        process_pair(germline, tumor, pair_name, bed, destination, gene_panel, processes, cache_dir)
 
 
 if __name__ == "__main__":
     start_time = datetime.now()
     args = get_args()
     print("# args:", args)
-    global_modules = globals()
-    modules = imports(global_modules)
-    print_modules(list(modules))
+    # module versions are only collected when printed, see utils_py.version
+    print_modules(imports(globals()))
     main(args.samples, args.PSG_version, args.PST_version, args.PSP_version,
-         args.destination, args.bed, args.panel)
+         args.destination, args.bed, args.panel, args.processes, args.cache_dir, args.workers,
+         args.max_reads)
     end_time = datetime.now()
     print("# Done!")
     print('# Duration: {}'.format(end_time - start_time))
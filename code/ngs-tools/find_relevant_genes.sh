@@ -9,7 +9,7 @@
 # bedfile with interesting genes in ALL
 bedfile=/home/projects/HT2_leukngs/data/references/hg37/collected_hg37_ALL_genes.bed
 # bedfile with pathways genes:
-# bedfile_pathways
+bedfile_pathways=/home/projects/HT2_leukngs/data/references/hg37/hg37_pathways.bed
 
 input=$1
 sample=$(basename $input | sed 's/.vcf.*//')
@@ -20,83 +20,45 @@ echo -e "$input \t $sample"
 mkdir -p "$sample".analysis_of_relevant_genes
 cd "$sample".analysis_of_relevant_genes
 
-# subset list of variants with our gene list (bed-file)
-module load perl/5.24.0
-module load vcftools/0.1.16
-echo "Loaded vcftools/0.1.16"
-vcftools --gzvcf ../$sample".vcf.gz" --bed $bedfile --recode
-nvariants=$(grep -v ^# -c out.recode.vcf)
-echo "We get $nvariants variants in the genes of interest (all ALL genes)"
-
-# compress for VEP
-echo "Compressing for VEP"
-module load bcftools/1.9
-echo "Loaded bcftools/1.9"
-bcftools view out.recode.vcf -Oz -o out.recode.vcf.gz
-bcftools index out.recode.vcf.gz
-
-# annotate
-echo "Running VEP"
-module purge    # pearl interference issues so it is easier to just remove everything ... 
 # some people use apps alias in other settings so it is overwritten again
 apps="/home/projects/HT2_leukngs/apps/github/code"
-$apps/ngs-tools/vep.sh out.recode.vcf.gz
-$apps/ngs-tools/filter_vep.sh out.recode.vep.vcf.gz
-
-module load tools
-module load bcftools/1.9
-echo "Loaded bcftools/1.9"
-echo "Output stored as $sample.filter.vep.vcf.gz"
-bcftools view out.recode.vep.filter.vcf -Oz -o out.recode.vep.filter.vcf.gz
-mv out.recode.vep.filter.vcf.gz  $sample.filter.vep.vcf.gz
-echo "Creating index ..." 
-bcftools index $sample.filter.vep.vcf.gz 
 
+# subset list of variants with the union of our gene lists (bed-files), so overlapping variants are only annotated once
 module load anaconda3/4.4.0
-$apps/ngs-tools/summarize_vep_variants.py -samples $sample.filter.vep.vcf.gz -outfile $sample
-
-
-# Cleaning up 
-set -x 
-rm out*
-echo "## FINISHED FIRST PART, NOW LOOKING ONLY AT PATHWAY GENES ## "
-set +x 
-
-bedfile=/home/projects/HT2_leukngs/data/references/hg37/hg37_pathways.bed
-# subset list of variants with our gene list (bed-file)
-module load perl/5.24.0
-module load vcftools/0.1.16
-echo "Loaded perl/5.24.0 + vcftools/0.1.16"
-vcftools --gzvcf ../$sample".vcf.gz" --bed $bedfile --recode
+$apps/ngs-tools/subset_vcf.py subset -in ../$sample".vcf.gz" -bed $bedfile $bedfile_pathways -out out.recode.vcf
 nvariants=$(grep -v ^# -c out.recode.vcf)
-echo "We get $nvariants variants in the genes of interest (all pathways ALL genes)"
+echo "We get $nvariants variants in the genes of interest (all ALL genes and pathway genes)"
 
 # compress for VEP
 echo "Compressing for VEP"
-module purge 
-module load tools bcftools/1.9
+module load bcftools/1.9
 echo "Loaded bcftools/1.9"
 bcftools view out.recode.vcf -Oz -o out.recode.vcf.gz
 bcftools index out.recode.vcf.gz
 
 # annotate
 echo "Running VEP"
-module purge    # pearl interference issues
-# some people use apps alias in other settings so it is overwritten again
-apps="/home/projects/HT2_leukngs/apps/github/code"
+module purge    # pearl interference issues so it is easier to just remove everything ... 
 $apps/ngs-tools/vep.sh out.recode.vcf.gz
 $apps/ngs-tools/filter_vep.sh out.recode.vep.vcf.gz
 
+# split the annotated variants in the ALL genes and the pathway genes
 module load tools
+module load anaconda3/4.4.0
+$apps/ngs-tools/subset_vcf.py split -in out.recode.vep.filter.vcf -bed $bedfile $bedfile_pathways \
+    -out $sample.filter.vep.vcf $sample.pathways.filter.vep.vcf
+
 module load bcftools/1.9
 echo "Loaded bcftools/1.9"
-echo "Output stored as $sample.pathways.filter.vep.vcf.gz"
-bcftools view out.recode.vep.filter.vcf -Oz -o out.recode.vep.filter.vcf.gz
-mv out.recode.vep.filter.vcf.gz  $sample.pathways.filter.vep.vcf.gz
-echo "Creating index ..."
-bcftools index $sample.pathways.filter.vep.vcf.gz
+for name in $sample $sample.pathways; do
+    echo "Output stored as $name.filter.vep.vcf.gz"
+    bcftools view $name.filter.vep.vcf -Oz -o $name.filter.vep.vcf.gz
+    rm $name.filter.vep.vcf
+    echo "Creating index ..." 
+    bcftools index $name.filter.vep.vcf.gz 
+    $apps/ngs-tools/summarize_vep_variants.py -samples $name.filter.vep.vcf.gz -outfile $name
+done
 
-module load anaconda3/4.4.0
-$apps/ngs-tools/summarize_vep_variants.py -samples $sample.pathways.filter.vep.vcf.gz -outfile $sample.pathways
+# Cleaning up 
 set -x 
 rm out*
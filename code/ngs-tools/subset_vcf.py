@@ -0,0 +1,106 @@
+#! /usr/bin/env python3
+
+import argparse
+from datetime import datetime
+from itertools import islice
+
+# imports from own repo's
+from utils_py.vcf import open_vcf, read_header, BATCH_SIZE
+from utils_py.intervals import IntervalIndex, CACHE_DIR
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Subset a vcf-file to the union of several bed-files in one pass (subset), or split a vcf-file in "
+                    "one output pr. bed-file (split). Like vcftools --bed, a record is in a bed-file if its position "
+                    "is inside one of the intervals. With this the variants of several gene lists only have to be "
+                    "annotated once.")
+    parser.add_argument('function', choices=['subset', 'split'])
+    parser.add_argument('-in', dest='infile', required=True, help="vcf-file (plain, gzip or bgzip compressed)")
+    parser.add_argument('-bed', dest='beds', nargs='+', required=True, help="One or more bed-files")
+    parser.add_argument('-out', dest='outfiles', nargs='+', required=True,
+                        help="Output vcf-file (subset) or one output vcf-file pr. bed-file (split)")
+    parser.add_argument('-cache', '--cache-dir', dest='cache_dir', default=CACHE_DIR,
+                        help="Folder with interval indexes of bed-files, built once pr. bed-file "
+                             "(Default: $ICOPE_INTERVAL_CACHE, no caching if it is not set)")
+    parser.add_argument('-no-cache', '--no-cache', dest='cache_dir', action='store_const', const=None,
+                        help="Do not cache the interval indexes")
+    return parser
+
+
+def get_args(args=None):
+    parser = get_parser()
+    args = parser.parse_args(args)
+    n_outfiles = 1 if args.function == 'subset' else len(args.beds)
+    if len(args.outfiles) != n_outfiles:
+        parser.error(f"{args.function} needs {n_outfiles} output file(s) given with -out")
+    return args
+
+
+def write_header(header, out):
+    for line in header['meta']:
+        out.write(line + '\n')
+    out.write('#' + '\t'.join(header['columns']) + '\n')
+
+
+def write_records(infile, intervals, outfiles, batch_size=BATCH_SIZE):
+    """
+    Write the records of a vcf-file to one output pr. set of intervals, each record to all outputs with intervals
+    holding it. The input is read once.
+    :param intervals: list with an IntervalIndex pr. output
+    :return: list with the number of records written pr. output
+    """
+    import numpy as np
+    counts = [0] * len(outfiles)
+    with open_vcf(infile) as handle:
+        header = read_header(handle)
+        outs = [open(outfile, 'w') for outfile in outfiles]
+        try:
+            for out in outs:
+                write_header(header, out)
+            while True:
+                batch = list(islice(handle, batch_size))
+                if not batch:
+                    break
+                lines = [line for line in batch if line.strip()]
+                fields = [line.split(b'\t', 2) for line in lines]
+                chroms = np.array([f[0].decode('utf-8') for f in fields])
+                positions = np.array([int(f[1]) - 1 for f in fields], dtype=np.int64)
+                for i, out in enumerate(outs):
+                    keep = np.flatnonzero(intervals[i].contains(chroms, positions))
+                    out.write(b''.join(lines[k] for k in keep).decode('utf-8'))
+                    counts[i] += len(keep)
+        finally:
+            for out in outs:
+                out.close()
+    return counts
+
+
+def subset_vcf(infile, beds, outfile, cache_dir=None, batch_size=BATCH_SIZE):
+    """
+    Write the records of a vcf-file in the union of the bed-files.
+    :return: number of records written
+    """
+    union = IntervalIndex.union([IntervalIndex.from_bed(bed, cache_dir) for bed in beds])
+    return write_records(infile, [union], [outfile], batch_size)[0]
+
+
+def split_vcf(infile, beds, outfiles, cache_dir=None, batch_size=BATCH_SIZE):
+    """
+    Write the records of a vcf-file to one output pr. bed-file.
+    :return: list with the number of records written pr. output
+    """
+    return write_records(infile, [IntervalIndex.from_bed(bed, cache_dir) for bed in beds], outfiles, batch_size)
+
+
+if __name__ == '__main__':
+    start_time = datetime.now()
+    args = get_args()
+    print("# args:", args)
+    if args.function == 'subset':
+        n_records = subset_vcf(args.infile, args.beds, args.outfiles[0], args.cache_dir)
+        print(f"# Wrote {n_records} records in the union of the bed-files to {args.outfiles[0]}")
+    else:
+        for outfile, n_records in zip(args.outfiles, split_vcf(args.infile, args.beds, args.outfiles, args.cache_dir)):
+            print(f"# Wrote {n_records} records to {outfile}")
+    print('# Duration: {}'.format(datetime.now() - start_time))
@@ -1,15 +1,27 @@
 #! /usr/bin/env python3
 
-import pandas as pd
-import numpy as np
 import argparse
 from datetime import datetime
-import pdb
-import sys
-import subprocess
 import os
-from io import StringIO
+from functools import partial
+from multiprocessing import Pool
 from utils_py.version import print_modules, imports
+from utils_py.vcf import read_vcf, info_subfields, BATCH_SIZE
+
+# CSQ fields of the VEP version used in vep.sh, used if the vcf header does not describe the CSQ field
+CSQ_FIELDS = ["Allele", "Consequence", "IMPACT", "SYMBOL", "Gene", "Feature_type", "Feature", "BIOTYPE", "EXON",
+              "INTRON", "HGVSc", "HGVSp", "cDNA_position", "CDS_position", "Protein_position", "Amino_acids",
+              "Codons", "Existing_variation", "DISTANCE", "STRAND", "FLAGS", "SYMBOL_SOURCE", "HGNC_ID", "SIFT",
+              "PolyPhen"]
+# fields with few distinct values, stored as categoricals. SIFT and PolyPhen include the score, e.g.
+# deleterious(0.01), and are kept as strings
+CATEGORICAL_CSQ_FIELDS = ["Allele", "Consequence", "IMPACT", "SYMBOL", "Gene", "Feature_type", "BIOTYPE", "STRAND",
+                          "FLAGS", "SYMBOL_SOURCE", "HGNC_ID"]
+# number of annotations written at a time
+CHUNKSIZE = 100000
+# bed-file with gene names in the 4th column, used to find the regions of the genes in a gene panel
+GENE_BED = "/home/projects/HT2_leukngs/data/references/hg37/USCS.hg37.canonical.exons.bed"
+
 
 def get_parser():
     parser = argparse.ArgumentParser(
@@ -18,6 +30,20 @@ def get_parser():
     parser.add_argument('-samples', dest="samples", nargs='+', help="Sample numbers", type=str)
     parser.add_argument('-outfile', dest="outfile", help="Name of output. (Default: variant_collection.tsv)",
                         default='variant_collection.tsv', type=str)
+    parser.add_argument('-jobs', '--jobs', dest="jobs", type=int, default=1,
+                        help="Number of vcf-files parsed at the same time (Default: 1)")
+    parser.add_argument('-skip-full-output', '--skip-full-output', dest="skip_full_output", action='store_true',
+                        help="Only write the filtered table with selected fields (<outfile>_selected_fields.tsv). "
+                             "Annotations are filtered and columns selected while reading, which saves time and "
+                             "memory")
+    parser.add_argument('-regions', '--regions', dest="regions", type=str,
+                        help="Bed-file with regions, only variants in these regions are read using the csi/tbi index "
+                             "of the vcf-files (made by bcftools index)")
+    parser.add_argument('-panel', '--gene-panel', dest="panel", type=str,
+                        help="Gene panel, only variants in these genes are read using the index of the vcf-files")
+    parser.add_argument('-gene-bed', '--gene-bed', dest="gene_bed", type=str, default=GENE_BED,
+                        help="Bed-file with gene names in the 4th column, used for finding the genes of -panel "
+                             "(Default: {})".format(GENE_BED))
     return parser
 
 
@@ -29,37 +55,224 @@ def get_args(args=None):
     return args
 
 
-def parse_format_rowwise(row, TNScope=False):
-    fields = row['FORMAT'].split(':')
-    if TNScope:
-        for field, normal, tumor in zip(fields, row['FORMAT_NORMAL'].split(':'), row['FORMAT_TUMOR'].split(':')):
-            row[field + '_NORMAL'], row[field + '_TUMOR'] = normal, tumor
+def concat_rows(frames, **kwargs):
+    """
+    Concatenate DataFrames row-wise with the columns in order of appearance. pandas before 0.23 has no sort argument
+    and sorts the columns if the frames have different ones.
+    """
+    import pandas as pd
+    frames = list(frames)
+    columns = list(dict.fromkeys(column for f in frames for column in f.columns))
+    return pd.concat(frames, **kwargs).reindex(columns=columns)
+
+
+def split_format(fields, values, n_values, suffix=''):
+    """
+    Split the sample column of rows sharing one FORMAT key in a single vectorized operation.
+    :param fields: list of FORMAT keys, e.g. ['GT', 'AD', 'AF']
+    :param values: Series with the sample column, e.g. '0/1:10,5:0.33'
+    :param n_values: array with the number of values to keep pr. row, the remaining keys are set to NaN
+    :param suffix: added to the column names, e.g. '_TUMOR'
+    :return: DataFrame with one column pr. FORMAT key
+    """
+    import numpy as np
+    split = values.str.split(':', expand=True).reindex(columns=range(len(fields)))
+    split = split.where(np.arange(len(fields)) < n_values[:, None])
+    split.columns = [field + suffix for field in fields]
+    return split
+
+
+def parse_format(data, TNScope=False):
+    """
+    Add a column pr. FORMAT key with the values of the sample(s). Rows are grouped by their FORMAT string so each
+    group is split column-wise. In TNScope mode the columns get the suffixes _NORMAL and _TUMOR, and like pairing
+    the keys with both samples a key is only filled if both samples have a value for it.
+    """
+    import pandas as pd
+    import numpy as np
+    samples = [('FORMAT_NORMAL', '_NORMAL'), ('FORMAT_TUMOR', '_TUMOR')] if TNScope else [('FORMAT_NORMAL', '')]
+    parsed = []
+    for key, group in data.groupby('FORMAT', sort=False):
+        fields = key.split(':')
+        n_values = np.min([np.asarray(group[column].str.count(':')) + 1 for column, _ in samples], axis=0)
+        parsed.append(pd.concat([split_format(fields, group[column], n_values, suffix) for column, suffix in samples],
+                                axis=1))
+    if not parsed:
+        return data
+    parsed = concat_rows(parsed)
+    return pd.concat([data, parsed.reindex(data.index)], axis=1)
+
+
+# CSQ fields used by is_relevant
+RELEVANT_FIELDS = ['IMPACT', 'Consequence', 'SIFT', 'PolyPhen']
+
+
+def is_relevant(annotations):
+    """
+    Annotations kept in the selected output: not LOW impact, not synonymous and not predicted tolerated/benign.
+    :return: boolean Series
+    """
+    return ~(annotations['IMPACT'].isin(['LOW']) | annotations['Consequence'].isin(['synonymous_variant']) |
+             annotations['SIFT'].str.startswith('tolerated') | annotations['PolyPhen'].str.startswith('benign'))
+
+
+def extract_fields(csq, fields, selected):
+    """
+    Extract some of the '|'-separated CSQ fields of the annotations with one regular expression, without splitting
+    the annotations into all their fields.
+    :param csq: Series with an annotation string pr. row
+    :param fields: CSQ subfields as given in the vcf header
+    :param selected: the fields to extract, fields missing from the header are NaN
+    :return: DataFrame with a column pr. selected field
+    """
+    import pandas as pd
+    import numpy as np
+    positions = sorted(set(fields.index(field) for field in selected if field in fields))
+    if not positions:
+        return pd.DataFrame(np.nan, index=csq.index, columns=list(selected), dtype=object)
+    # the fields after the first are optional, so short annotations give NaN as with str.split
+    pattern = ''
+    for previous, position in reversed(list(zip(positions, positions[1:]))):
+        pattern = r'(?:\|(?:[^|]*\|){%d}([^|]*)%s)?' % (position - previous - 1, pattern)
+    pattern = r'^(?:[^|]*\|){%d}([^|]*)' % positions[0] + pattern
+    values = csq.str.extract(pattern, expand=True)
+    values.columns = [fields[position] for position in positions]
+    return values.reindex(columns=list(selected))
+
+
+def parse_info(data, fields=CSQ_FIELDS, columns=None, predicate=None, predicate_fields=None):
+    """
+    Explode the VEP annotations (CSQ) of the variants to one row pr. annotation.
+    :param data: DataFrame with an INFO column
+    :param fields: CSQ subfields as given in the vcf header
+    :param columns: only keep these CSQ fields (Default: all)
+    :param predicate: function returning a boolean Series of the annotations to keep. It is evaluated on the
+    predicate_fields only, and the rows of the discarded annotations are never built
+    :param predicate_fields: CSQ fields used by predicate (Default: all)
+    :return: DataFrame with the row number of the variant in data ('variant') and a column pr. CSQ field. Fields with
+    few distinct values are categorical
+    """
+    import pandas as pd
+    import numpy as np
+    csq = data['INFO'].str.extract(r'(?:^|;)CSQ=([^;]*)', expand=False).str.split(',')
+    # a row pr. annotation, variants without annotations get one empty row
+    csq = [annotations if isinstance(annotations, list) else [np.nan] for annotations in csq]
+    variant = np.repeat(np.arange(len(data)), [len(annotations) for annotations in csq])
+    csq = pd.Series([annotation for annotations in csq for annotation in annotations], dtype=object)
+    if predicate is not None:
+        narrow = extract_fields(csq, fields, predicate_fields if predicate_fields is not None else fields)
+        keep = np.asarray(predicate(narrow).fillna(False), dtype=bool)
+        csq, variant = csq[keep].reset_index(drop=True), variant[keep]
+    if columns is None:
+        values = csq.str.split('|', expand=True).reindex(columns=range(len(fields)))
+        values.columns = fields
     else:
-        for field, value in zip(fields, row['FORMAT_NORMAL'].split(':')):
-            row[field] = value
-    return row
+        values = extract_fields(csq, fields, [field for field in fields if field in columns])
+    values.insert(0, 'variant', variant.astype(np.int64))
+    for field in CATEGORICAL_CSQ_FIELDS:
+        if field in values:
+            values[field] = values[field].astype('category')
+    return values.reset_index(drop=True)
 
 
-def parse_info(data):
-    fields = ["Allele", "Consequence", "IMPACT", "SYMBOL", "Gene", "Feature_type", "Feature", "BIOTYPE", "EXON",
-              "INTRON", "HGVSc", "HGVSp", "cDNA_position", "CDS_position", "Protein_position", "Amino_acids",
-              "Codons", "Existing_variation", "DISTANCE", "STRAND", "FLAGS", "SYMBOL_SOURCE", "HGNC_ID", "SIFT",
-              "PolyPhen"]
-    data['INFO'] = data['INFO'].str.replace('CSQ=', '').str.split(',')
-    data = data.explode('INFO')
-    data[fields] = data['INFO'].str.split('|', expand=True)
+def concat_annotations(frames):
+    """
+    Concatenate annotation tables, keeping the categorical fields categorical by unifying their categories.
+    """
+    from pandas.api.types import union_categoricals
+    frames = list(frames)
+    columns = set(column for f in frames for column in f.columns)
+    for column in columns:
+        if all(f[column].dtype.name == 'category' for f in frames if column in f):
+            categories = union_categoricals([f[column] for f in frames if column in f]).categories
+            for f in frames:
+                if column in f:
+                    f[column] = f[column].cat.set_categories(categories)
+    return concat_rows(frames, ignore_index=True)
+
+
+def read_regions(bed):
+    """
+    Regions of a bed-file.
+    :return: DataFrame with columns chrom, start and end
+    """
+    import pandas as pd
+    return pd.read_csv(bed, sep='\t', header=None, usecols=[0, 1, 2], names=['chrom', 'start', 'end'],
+                       dtype={'chrom': str}, comment='#')
+
+
+def gene_regions(panel_file, gene_bed=GENE_BED):
+    """
+    Regions spanned by the genes of a gene panel, from the first start to the last end of each gene in the bed-file.
+    :return: DataFrame with columns chrom, start and end
+    """
+    import pandas as pd
+    panel = set(pd.read_csv(panel_file).values.flatten())
+    genes = pd.read_csv(gene_bed, sep='\t', header=None, usecols=[0, 1, 2, 3],
+                        names=['chrom', 'start', 'end', 'gene'], dtype={'chrom': str, 'gene': str})
+    genes = genes[genes['gene'].isin(panel)]
+    regions = genes.groupby(['gene', 'chrom']).agg({'start': 'min', 'end': 'max'}).reset_index()
+    print("# Found", regions['gene'].nunique(), "out of", len(panel), "genes in", gene_bed)
+    if regions['gene'].nunique() < len(panel):
+        print("# Following genes were not found:", panel - set(regions['gene']))
+    return regions[['chrom', 'start', 'end']]
 
-    return data
 
+def get_regions(bed=None, panel_file=None, gene_bed=GENE_BED):
+    """
+    Regions to read from the vcf-files, from a bed-file and/or a gene panel.
+    :return: list of (chromosome, 0-based start, end) or None to read everything
+    """
+    import pandas as pd
+    regions = []
+    if bed:
+        regions.append(read_regions(bed))
+    if panel_file:
+        regions.append(gene_regions(panel_file, gene_bed))
+    if not regions:
+        return None
+    regions = pd.concat(regions)
+    print("# Reading variants in", len(regions), "regions")
+    return list(regions.itertuples(index=False, name=None))
 
-def parse_vcf(sample):
+
+def empty_tables(header_cols, drop_cols, csq_fields, columns=None):
+    """
+    Variant and annotation tables of a vcf-file without records, with the columns and types of a parsed file so the
+    columns of other samples keep their types when they are combined (e.g. POS stays int64).
+    """
+    import pandas as pd
+    import numpy as np
+    kept = [c for c in header_cols + ['Sample'] if c not in drop_cols and (columns is None or c in columns)]
+    variants = pd.DataFrame({c: pd.Series(dtype=np.int64 if c == 'POS' else object) for c in kept}, columns=kept)
+    annotations = pd.DataFrame({'variant': np.zeros(0, dtype=np.int64)})
+    for field in csq_fields:
+        if columns is None or field in columns:
+            annotations[field] = pd.Series(dtype='category' if field in CATEGORICAL_CSQ_FIELDS else object)
+    return variants, annotations
+
+
+def parse_vcf(sample, batch_size=BATCH_SIZE, columns=None, predicate=None, predicate_fields=None, regions=None):
+    """
+    Parse a VEP annotated vcf-file. With columns and/or a predicate, only the relevant annotations and the requested
+    columns are kept while reading the batches.
+    :param columns: output columns to keep (Default: all)
+    :param predicate: function selecting the annotations to keep (e.g. is_relevant), variants without any kept
+    annotations are dropped
+    :param predicate_fields: CSQ fields used by predicate (Default: all)
+    :param regions: only read the records in these regions, using the index of the vcf-file. The records are then
+    numbered by their order among the records read
+    :return: tuple (variants, annotations) where variants has a row pr. record indexed by record number and
+    annotations has a row pr. VEP annotation, referring to the variant by its row number in variants
+    """
+    import pandas as pd
+    import numpy as np
     assert os.path.exists(sample), sample + "does not exist"
     sample_name = sample.split('.filter')[0]
-    input = subprocess.Popen(["zgrep", "-v", "#"], stdin=open(sample), stdout=subprocess.PIPE)
-    decoding = StringIO(input.communicate()[0].decode('utf-8'))
-    data = pd.read_csv(decoding, sep='\t', header=None)
+    header, batches = read_vcf(sample, batch_size, regions=regions)
+    csq_fields = info_subfields(header, 'CSQ') or CSQ_FIELDS
     # detect format:
-    TNScope = len(data.columns) > 10
+    TNScope = len(header['columns']) > 10
     header_cols = ['CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO',
                    'FORMAT', 'FORMAT_NORMAL']
     drop_cols = ['INFO', 'FORMAT', 'FORMAT_NORMAL']
@@ -67,38 +280,124 @@ def parse_vcf(sample):
         print("# Assuming TNSCope VCF-file")
         header_cols.append('FORMAT_TUMOR')
         drop_cols.append('FORMAT_TUMOR')    # for later filtering
-    data.columns = header_cols
-    data['Sample'] = sample_name
-    data = data.apply(parse_format_rowwise, TNScope=TNScope, axis=1)
-    data = parse_info(data)
-    data.drop(columns=drop_cols, inplace=True)
-    selected_fields = ['Sample', 'CHROM', 'POS', 'REF', 'ALT', 'QUAL', 'FILTER', 'ID', 'IMPACT', 'Consequence',
-                       'Feature_type', 'SYMBOL', 'Feature', 'Gene', 'SIFT', 'PolyPhen']
-    return data
+    # FORMAT values are only split if any of them are requested
+    with_format = columns is None or not set(columns) <= set(header_cols + csq_fields + ['Sample'])
+    variants, annotations = [], []
+    n_records, n_variants, n_annotations = 0, 0, 0
+    # each batch is parsed and exploded on its own, the index numbers the records of the whole file
+    for data in batches:
+        data.columns = header_cols
+        data.index = pd.RangeIndex(n_records, n_records + len(data))
+        n_records += len(data)
+        data['Sample'] = sample_name
+        if with_format:
+            data = parse_format(data, TNScope=TNScope)
+        batch_annotations = parse_info(data, csq_fields, columns, predicate, predicate_fields)
+        if predicate is not None:
+            # keep the variants with annotations left and renumber the annotations to refer to them
+            kept = np.unique(np.asarray(batch_annotations['variant']))
+            batch_annotations['variant'] = np.searchsorted(kept, np.asarray(batch_annotations['variant']))
+            data = data.iloc[kept]
+        batch_annotations['variant'] += n_variants
+        n_variants += len(data)
+        n_annotations += len(batch_annotations)
+        data = data.drop(drop_cols, axis=1)
+        if columns is not None:
+            data = data[[c for c in data.columns if c in columns]]
+        variants.append(data)
+        annotations.append(batch_annotations)
+    if not variants:
+        print(f"# No variants found in {sample}")
+        return empty_tables(header_cols, drop_cols, csq_fields, columns)
+    if predicate is not None:
+        print(f"# {sample_name}: kept {n_annotations} annotations of {n_variants} out of {n_records} variants")
+    return concat_rows(variants), concat_annotations(annotations)
+
 
+def parse_vcfs(samples, jobs=1, columns=None, predicate=None, predicate_fields=None, regions=None):
+    """
+    Parse the vcf-files, in parallel worker processes if jobs > 1.
+    :return: list of (variants, annotations) in the order of samples
+    """
+    parse = partial(parse_vcf, batch_size=BATCH_SIZE, columns=columns, predicate=predicate,
+                    predicate_fields=predicate_fields, regions=regions)
+    if jobs > 1 and len(samples) > 1:
+        with Pool(min(jobs, len(samples))) as pool:
+            return pool.map(parse, samples, chunksize=1)
+    return [parse(s) for s in samples]
 
-def main(samples, outfile):
-    all_data = pd.DataFrame()
-    for s in samples:
-        sample_variants = parse_vcf(s)
-        all_data = pd.concat([sample_variants, all_data], sort=True)
 
-    all_data.index.name = 'Unique variant index'
-    all_data.to_csv(outfile, sep='\t')
+def combine_samples(parsed):
+    """
+    Combine the variants and annotations of many samples, the variant numbers of the annotations are shifted to
+    refer to the rows of the combined variant table.
+    """
+    variants, annotations = [], []
+    offset = 0
+    for sample_variants, sample_annotations in parsed:
+        sample_annotations['variant'] += offset
+        offset += len(sample_variants)
+        variants.append(sample_variants)
+        annotations.append(sample_annotations)
+    return concat_rows(variants), concat_annotations(annotations)
+
+
+def join_variants(variants, annotations, columns=None):
+    """
+    Table with a row pr. annotation and the columns of its variant, indexed by the record number of the variant.
+    :param columns: columns of the output (Default: all columns sorted by name)
+    """
+    import pandas as pd
+    import numpy as np
+    rows = np.asarray(annotations['variant'])
+    data = pd.concat([variants.iloc[rows], annotations.drop('variant', axis=1).set_index(variants.index[rows])],
+                     axis=1)
+    data.index.name = 'Unique variant index'
+    return data.reindex(columns=columns if columns is not None else sorted(data.columns))
+
+
+def write_joined(variants, annotations, outfile, chunksize=CHUNKSIZE):
+    """
+    Write the annotations joined with their variants in chunks, so the full table is never built in memory.
+    """
+    columns = sorted(set(variants.columns) | set(annotations.columns) - {'variant'})
+    for start in range(0, max(len(annotations), 1), chunksize):
+        join_variants(variants, annotations.iloc[start:start + chunksize], columns).\
+            to_csv(outfile, sep='\t', mode='w' if start == 0 else 'a', header=start == 0)
+
+
+def print_counts(variant_index, stage):
+    import numpy as np
+    n_sites = len(np.unique(variant_index))
+    print(f"# Number of annotations {stage} filtering:\t", len(variant_index))
+    # with no variant sites (e.g. no records in the regions of -panel) there is no average
+    print("# Number of variant sites before filtering:\t", n_sites,
+          "\t Approximately {} annotations pr. variant:\t".format(round(len(variant_index)/n_sites, 5) if n_sites
+                                                                    else 0))
+
+
+def main(samples, outfile, jobs=1, skip_full_output=False, regions=None):
+    import numpy as np
     selected_fields = ['Sample', 'CHROM', 'POS', 'REF', 'ALT', 'QUAL', 'FILTER', 'ID', 'IMPACT', 'Consequence',
                        'SYMBOL', 'Feature_type', 'Feature', 'Gene', 'SIFT', 'PolyPhen']
-    print("# Number of annotations before filtering:\t", len(all_data))
-    print("# Number of variant sites before filtering:\t", len(all_data.index.unique()),
-          "\t Approximately {} annotations pr. variant:\t".
-          format(round(len(all_data.index)/len(all_data.index.unique()), 5)))
-    all_data = all_data[~(all_data['IMPACT'].isin(['LOW']) | all_data['Consequence'].isin(['synonymous_variant']) |
-                          all_data['SIFT'].str.startswith('tolerated') | all_data['PolyPhen'].str.startswith('benign'))]
-    print("# Number of annotations after filtering:\t", len(all_data))
-    print("# Number of variant sites before filtering:\t", len(all_data.index.unique()),
-          "\t Approximately {} annotations pr. variant:\t".
-          format(round(len(all_data.index)/len(all_data.index.unique()), 5)))
-    all_data.reindex(columns=selected_fields).to_csv(outfile.replace('.tsv', '_selected_fields.tsv'), sep='\t')
+    if skip_full_output:
+        # the predicate is evaluated on the fields it uses and only the selected fields of the kept annotations
+        # are extracted, the discarded annotations are never split into rows
+        parsed = parse_vcfs(samples, jobs, selected_fields, is_relevant, RELEVANT_FIELDS, regions)
+    else:
+        parsed = parse_vcfs(samples, jobs, regions=regions)
+    # concatenated once, the last sample first as in the output of earlier versions
+    variants, annotations = combine_samples(parsed[::-1])
+    # the record numbers are the index of the output tables
+    record = np.asarray(variants.index)
 
+    if not skip_full_output:
+        write_joined(variants, annotations, outfile)
+        print_counts(record[np.asarray(annotations['variant'])], 'before')
+        annotations = annotations[np.asarray(is_relevant(annotations).fillna(False), dtype=bool)]
+    print_counts(record[np.asarray(annotations['variant'])], 'after')
+    join_variants(variants, annotations, selected_fields).to_csv(outfile.replace('.tsv', '_selected_fields.tsv'),
+                                                                 sep='\t')
 
 
 if __name__ == "__main__":
@@ -106,10 +405,10 @@ if __name__ == "__main__":
     parsed_args = get_args()
     print("# args:", parsed_args)
     print("# Summarizing variants")
-    global_modules = globals()
-    modules = imports(global_modules)
-    print_modules(list(modules))
-    main(parsed_args.samples, parsed_args.outfile)
+    # module versions are only collected when printed, see utils_py.version
+    print_modules(imports(globals()))
+    regions = get_regions(parsed_args.regions, parsed_args.panel, parsed_args.gene_bed)
+    main(parsed_args.samples, parsed_args.outfile, parsed_args.jobs, parsed_args.skip_full_output, regions)
     end_time = datetime.now()
     print("# Done!")
     print('# Duration: {}'.format(end_time - start_time))
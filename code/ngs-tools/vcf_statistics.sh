@@ -1,11 +1,10 @@
 #!/usr/bin/env bash
 
 module load anaconda3/4.4.0
-module load bcftools/1.9
 
 # this script collects some stats on the vcf-files AND moves all quality reports to the designated folder 
 
-echo "Using computerome module bcfools/1.9 and python3 modules documented below"
+echo "Using computerome module anaconda3/4.4.0 and python3 modules documented below"
 
 vcf=$1
 sample=$(basename $vcf | sed 's/.vcf.*//')
@@ -18,29 +17,31 @@ else
     opt=$2"_";
 fi
 
-variant_threshold=1
-nr_variants=$(zgrep -v  '#' $vcf | wc -l)
-echo Checking number of variants: $nr_variants input variants
-if [ $nr_variants -lt $variant_threshold ]; then
-    echo "Not enough variants (less than $variant_threshold) were called!"
-    echo "Assuming an error happened, exiting ... "
-    exit
-fi
-echo "Continuing with vcf statistics!"
+apps="/home/projects/HT2_leukngs/apps/github/code"
 
+variant_threshold=1
 start=`date +%s`
 
 destination="$sample".quality_reports
 mkdir -p $destination
 echo "# Creating folder $destination if it does not already exist"
 
-
-apps="/home/projects/HT2_leukngs/apps/github/code"
-
-# VCF statistics
-echo "# Collecting VCF stats for" $1 
-bcftools stats $vcf > $destination/"$opt"vcf_summary.txt
-$apps/quality/visualize_vcf_stats.py $destination/"$opt"vcf_summary.txt
+# VCF statistics, the stats file (in the layout of bcftools stats), excel sheet and plots in one pass over the vcf.
+# The number of variants is checked in the same pass, nothing is written if there are too few
+echo "# Collecting VCF stats for" $1
+$apps/quality/vcf_stats.py stats -in $vcf -out $destination/"$opt"vcf_summary.txt -min-records $variant_threshold
+status=$?
+if [ $status -eq 3 ]; then
+    echo "Not enough variants (less than $variant_threshold) were called!"
+    echo "Assuming an error happened, exiting ... "
+    rmdir --ignore-fail-on-non-empty $destination
+    exit
+elif [ $status -ne 0 ]; then
+    # a partial summary is not moved on as if the stats were complete
+    echo "Collecting VCF stats for $vcf failed with exit code $status, exiting ... "
+    rm -f $destination/"$opt"vcf_summary.txt
+    exit $status
+fi
 
 # clean up
 echo "# Moving files to <sample>.quality_reports dir"
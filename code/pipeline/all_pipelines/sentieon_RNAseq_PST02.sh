@@ -266,7 +266,8 @@ $apps/computerome/submit.py "$apps/ngs-tools/bam_statistics.sh "$sample".bam" --
 $SENTIEON_INSTALL_DIR/bin/sentieon driver -r $fasta -t $nt -i realigned.bam -q recal_data.table --algo Haplotyper --trim_soft_clip --call_conf 20 --emit_conf 20 -d $dbsnp output.vcf.gz
 
 hc_variant_threshold=-1
-nr_variants=$(zgrep -v  '#' output.vcf.gz | wc -l)
+# the module is loaded in a subshell, so it does not change the environment of the later steps
+nr_variants=$( (module load anaconda3/4.4.0; $apps/quality/vcf_stats.py count -in output.vcf.gz) )
 echo $nr_variants were called with Haplotyper ...
 if [ $total_reads -lt $hc_variant_threshold ]; then
     echo "Not enough variants (less than $hc_variant_threshold) were called!"
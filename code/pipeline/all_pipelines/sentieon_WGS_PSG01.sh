@@ -176,7 +176,8 @@ $SENTIEON_INSTALL_DIR/bin/sentieon driver -r $fasta -t $nt -i realigned.bam -q r
 
 
 hc_variant_threshold=-1
-nr_variants=$(zgrep -v  '#' output.vcf.gz | wc -l)
+# the module is loaded in a subshell, so it does not change the environment of the later steps
+nr_variants=$( (module load anaconda3/4.4.0; $apps/quality/vcf_stats.py count -in output.vcf.gz) )
 echo $nr_variants were called with Haplotyper ...
 if [ $total_reads -lt $hc_variant_threshold ]; then
     echo "Not enough variants (less than $hc_variant_threshold) were called!"
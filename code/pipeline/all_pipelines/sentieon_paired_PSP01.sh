@@ -77,7 +77,8 @@ $SENTIEON_INSTALL_DIR/bin/sentieon driver -t $nt -r $fasta \
 echo -e "Finished the somatic variant calling" 
 
 variant_threshold=0
-nr_variants=$(zgrep -v  '#' $destination/$output_name.vcf.gz | wc -l)
+# the module is loaded in a subshell, so it does not change the environment of the later steps
+nr_variants=$( (module load anaconda3/4.4.0; $apps/quality/vcf_stats.py count -in $destination/$output_name.vcf.gz) )
 echo Checking number of variants: $nr_variants input variants
 if [ "$nr_variants" -lt $variant_threshold ]; then
     echo "Not enough variants (less than $variant_threshold) were called!"
@@ -1,29 +1,28 @@
 #! /usr/bin/env python3
 
-import pandas as pd 
-import seaborn as sns 
-import sys 
-import numpy as np 
-import pdb
-import matplotlib
 import subprocess
 import os
-from io import StringIO
 import argparse
 
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt 
 from utils_py.version import print_modules, imports
 from utils_py.pprinting import print_overwrite
+from quality.coverage_histogram import parse_genomecov, histogram_table, save_histogram, load_histogram, \
+    HISTOGRAM_SUFFIX
 
 
 def get_parser():
     parser = argparse.ArgumentParser(
         description="Run coverage stats for all")
-    parser.add_argument('-in', dest="infile", help="Coverage file from samtools or bam-file", type=str)
+    parser.add_argument('-in', dest="infile", type=str,
+                        help="Bam-file, coverage file from bedtools genomecov (.cov) or a saved coverage histogram "
+                             "(" + HISTOGRAM_SUFFIX + ")")
     parser.add_argument('-out', dest='out', help="Name of outfile. Will be placed in current working directory if "
                                                  "there is no path.")
-    parser.add_argument('-limit', dest='limit', help="Limit for plotting coverage. Default: 150", default=150)
+    parser.add_argument('-limit', dest='limit', help="Limit for plotting coverage. Default: 150", default=150, type=int)
+    parser.add_argument('-no-plot', '--no-plot', dest='plot', action='store_false',
+                        help="Only write the mean coverage summary, skip the coverage distribution plot")
+    parser.add_argument('-np', '--processes', dest='processes', type=int, default=1,
+                        help="Number of processes for drawing the plot (Default: 1)")
     return parser
 
 
@@ -35,86 +34,133 @@ def get_args(args=None):
 
 
 def run_genome_cov(bam):
+    """
+    Depth histogram pr. contig for a bam-file.
+    :return: tuple (list of contigs, array of contig lengths, count matrix with a row pr. contig and column pr. depth)
+    """
     print("# Input is a bam-file, we have to run genomecov ... ")
     try:
         input = subprocess.Popen(["bedtools", "genomecov", "-ibam", bam, "-max", "150"], stdout=subprocess.PIPE)
     except OSError as e:
         print("# Could not run bedtools or find bam, try to use: module load bedtools/2.28.0 and check path")
-    decoding = StringIO(input.communicate()[0].decode('utf-8'))
-    cov = pd.read_csv(decoding, sep='\t', header=None)
-    cov.columns = ['chr', 'cov', 'obs_bases', 'total', 'frac']
-    return cov
+        raise
+    # lines are parsed into the histogram as they arrive instead of buffering all output
+    with input.stdout:
+        histogram = parse_genomecov(input.stdout, max_depth=150)
+    if input.wait() != 0:
+        raise subprocess.CalledProcessError(input.returncode, input.args)
+    return histogram
 
 
 def read_coverage_file(covfile):
-    cov = pd.read_csv(covfile, sep='\t')
-    print("Succesfully read ", filename)
-    cov.columns = ['chr', 'cov', 'obs_bases', 'total', 'frac']
+    if covfile.endswith('.npz'):
+        cov = histogram_table(*load_histogram(covfile))
+    else:
+        with open(covfile) as lines:
+            cov = histogram_table(*parse_genomecov(lines))
+    print("Succesfully read ", covfile)
     return cov
 
 
-def plot_collect_coverage(cov, outname, input_upper_limit):
-    upper_limit = 50
-    plots = cov['chr'].unique()
+def select_contigs(cov):
+    contigs = cov['chr'].unique()
     # only plot chr 1-22, X, Y and genome
-    plots = [x for x in plots if (x[0].isdigit() or x.startswith('X') or
-                                  x.startswith('Y') or x.startswith('g'))]
-    plots = [x for x in plots if (x[0].isdigit() or x[0] in ['X', 'Y', 'g', 'M'])]
+    contigs = [x for x in contigs if (x[0].isdigit() or x.startswith('X') or
+                                      x.startswith('Y') or x.startswith('g'))]
+    contigs = [x for x in contigs if (x[0].isdigit() or x[0] in ['X', 'Y', 'g', 'M'])]
+    return contigs
+
+
+def mean_coverage(contig):
+    return (contig['obs_bases'] * contig['cov']).sum() / contig['total'].iloc[0]
+
+
+def find_upper_limit(frac, upper_limit, input_upper_limit, fraction=0.90):
+    """
+    Find the number of coverage bins to plot, so that they cover at least the given fraction of the bases. Gives the
+    same result as increasing the limit by one until enough is covered, but with a search in the cumulative sum.
+    :param frac: fraction of bases pr. coverage bin for one contig
+    :param upper_limit: current limit, it is never lowered
+    :param input_upper_limit: the limit is at most one above this
+    :param fraction: fraction of bases to cover
+    :return: new upper limit
+    """
+    import numpy as np
+    cumulative = np.cumsum(np.asarray(frac, dtype=float))
+    needed = int(np.searchsorted(cumulative, fraction)) + 1
+    if needed > len(cumulative):
+        needed = input_upper_limit + 1
+    return max(upper_limit, min(needed, input_upper_limit + 1))
+
+
+def summarize_coverage(cov):
+    import pandas as pd
+    contigs = dict(tuple(cov.groupby('chr', sort=False)))
+    summary = {frag: mean_coverage(contigs[frag]) for frag in select_contigs(cov)}
+    return pd.DataFrame(summary, index=[0]).transpose().rename(columns={0: 'Coverage'})
+
+
+def plot_collect_coverage(cov, outname, input_upper_limit, processes=1):
+    import pandas as pd
+    import numpy as np
+    # matplotlib is only loaded when plotting
+    from quality.plotting import render_panel_figure
+    upper_limit = 50
+    plots = select_contigs(cov)
+    # each contig is selected once instead of filtering the whole table for every step
+    contigs = dict(tuple(cov.groupby('chr', sort=False)))
     summary = dict()
-    fig, axes = plt.subplots(int(np.ceil(len(plots) / 3)), 3, figsize=(30, len(plots)))
-    for frag, ax in zip(plots, fig.axes):
+    panels = []
+    for frag in plots:
         print_overwrite("# Now plotting region: ", frag)
-        covered_fraction = cov[cov['chr'] == frag][0:upper_limit]['frac'].sum()
+        contig = contigs[frag]
         skip = 5
-        while covered_fraction < 0.90 and upper_limit <= input_upper_limit:
-            upper_limit += 1
-            covered_fraction = cov[cov['chr'] == frag][0:upper_limit]['frac'].sum()
-            # print("# Recomputed upper limit to:", upper_limit, "covered fraction", covered_fraction)
+        # the limit carries over from the previous contig
+        upper_limit = find_upper_limit(contig['frac'], upper_limit, input_upper_limit)
         if upper_limit > 100:
             skip = 10
-        sns.barplot(x='cov', ax=ax, y='frac', data=cov[cov['chr'] == frag][0:upper_limit])
-        total = cov[cov['chr'] == frag].iloc[0, 3]
-        mean_cov = (cov[cov['chr'] == frag].loc[:, 'obs_bases'] * cov[cov['chr'] == frag].loc[:, 'cov']).sum() / total
+        mean_cov = mean_coverage(contig)
         summary[frag] = mean_cov
-        ax.set_title(
-            "Coverage distribution for chromosome / contig " + frag + ". Mean coverage=" + str(round(mean_cov, 3)))
-        # set xticks
-        ax.set_xticklabels(ax.get_xticklabels(), visible=False)
-
-        for label in ax.xaxis.get_ticklabels()[::skip]:
-            label.set_visible(True)
-    print("\n# Done plotting ...")
-    fig.tight_layout()
+        # only the arrays to draw are passed on to the plotting processes
+        panels.append({'title': "Coverage distribution for chromosome / contig " + frag + ". Mean coverage=" +
+                                str(round(mean_cov, 3)),
+                       'bins': np.asarray(contig['cov'])[:upper_limit],
+                       'heights': np.asarray(contig['frac'])[:upper_limit], 'label_step': skip})
     outname = outname + '_coverage_pr_chromosome.png'
-    print("# saving coverage pr. chromosome plot to", outname)
-    plt.savefig(outname, format='png')
+    print("\n# saving coverage pr. chromosome plot to", outname)
+    render_panel_figure(panels, outname, columns=3, processes=processes)
+    print("# Done plotting ...")
     summary_df = pd.DataFrame(summary, index=[0]).transpose().rename(columns={0: 'Coverage'})
     return summary_df
 
 
-def main(filename, input_upper_limit, outname=None):
+def main(filename, input_upper_limit, outname=None, processes=1, plot=True):
     split = os.path.splitext(filename)
     if outname:
         outname = os.path.join(os.getcwd(), outname)
     else:
         outname = split[0]
     if split[1] == '.bam':
-        cov = run_genome_cov(filename)
-    elif split[1] == '.cov':
+        histogram = run_genome_cov(filename)
+        save_histogram(outname + HISTOGRAM_SUFFIX, *histogram)
+        cov = histogram_table(*histogram)
+    elif split[1] in ['.cov', '.npz']:
         cov = read_coverage_file(filename)
     print(f"# Saving to {outname}")
-    mean_coverage = plot_collect_coverage(cov, outname, input_upper_limit)
-    mean_coverage.to_csv(outname + '.tsv', sep='\t')
+    if plot:
+        summary = plot_collect_coverage(cov, outname, input_upper_limit, processes)
+    else:
+        summary = summarize_coverage(cov)
+    summary.to_csv(outname + '.tsv', sep='\t')
 
 
 if __name__ == '__main__':
     print("# Running coverage pr. chromosome function") 
-    global_modules = globals()
-    modules = imports(global_modules)
-    print_modules(list(modules))
+    # module versions are only collected when printed, see utils_py.version
+    print_modules(imports(globals()))
     args = get_args()
     print(f"# Input: {args.infile} \t  Upper limit: {args.limit}")
-    main(args.infile, args.limit, args.out)
+    main(args.infile, args.limit, args.out, args.processes, args.plot)
     print("# Done!")
 
 
@@ -1,48 +1,86 @@
 #! /usr/bin/env python3
 
-import pandas as pd
-import numpy as np
 import argparse
 from datetime import datetime
-import pdb
-import sys
 import subprocess
 import os
-from io import StringIO
-import matplotlib.pyplot as plt
-import seaborn as sns
-from natsort import natsorted
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 # imports from own repo's
 from utils_py.version import print_modules, imports
-from computerome.somatic_setup import find_pairs
-from quality.gene_coverage import calculate_statistics
+from quality.coverage_stats import exon_statistics, group_sums, add_group_sums
+from quality import coverage_cache
+
+# bedcov output is the bed-file with the summed read depth appended as the last column
+BEDCOV_COLUMNS = ['chromosome', 'start', 'end', 'gene', 'exon', 'strand', 'coverage']
+BEDCOV_DTYPES = {'chromosome': 'category', 'start': 'int32', 'end': 'int32', 'gene': 'category',
+                 'exon': 'category', 'coverage': 'int64'}
+CHUNKSIZE = 100000
+
 
 # Set up command line parser
 def get_parser():
     parser = argparse.ArgumentParser(
         description="Run coverage stats for all")
     parser.add_argument('-in', dest="infile", help="Coverage file from samtools or bam-file", type=str)
-    parser.add_argument('-panel', '--gene-panel', dest='panel',
-                        default='/home/projects/HT2_leukngs/data/references/general/315_genes_of_interest.txt',
-                        help="(Default: /home/projects/HT2_leukngs/data/references/general/315_genes_of_interest.txt)")
+    parser.add_argument('-panel', '--gene-panel', dest='panel', nargs='+',
+                        default=['/home/projects/HT2_leukngs/data/references/general/315_genes_of_interest.txt'],
+                        help="One or more gene panels, the coverage is only calculated once for all of them. "
+                             "(Default: /home/projects/HT2_leukngs/data/references/general/315_genes_of_interest.txt)")
     parser.add_argument('-bed', '--bedfile', type=str, dest='bed',
                         default="/home/projects/HT2_leukngs/data/references/hg37/USCS.hg37.canonical.exons.bed",
                         help="Bed-file with intervals to look at. "
                              "(Default: /home/projects/HT2_leukngs/data/references/hg37/USCS.hg37.canonical.exons.bed)")
-    parser.add_argument('-out', dest='out')
+    parser.add_argument('-out', dest='out', nargs='+',
+                        help="Output prefix pr. gene panel (Default: sample name, with panel name added for all but "
+                             "the first panel)")
     parser.add_argument('-intron', '--intronmode', dest='intron', action="store_true", help="Only output coverage for chromosomes "
                                                                        "for intronic regions")
+    parser.add_argument('-chunksize', '--chunksize', dest='chunksize', type=int, default=CHUNKSIZE,
+                        help="Number of bedcov lines parsed at a time (Default: {})".format(CHUNKSIZE))
+    parser.add_argument('-np', '--processes', dest='processes', type=int, default=1,
+                        help="Number of concurrent samtools processes each running on a shard of the bed-file, also "
+                             "the number of plots drawn at the same time (Default: 1)")
+    parser.add_argument('-cache', '--cache-dir', dest='cache_dir', default=coverage_cache.CACHE_DIR,
+                        help="Folder for caching coverage of bam-files, so re-running a bam with the same bed-file "
+                             "does not read the bam again (Default: $ICOPE_BEDCOV_CACHE, no caching if it is not set)")
+    parser.add_argument('-cache-size', '--cache-size', dest='cache_size', type=float,
+                        default=coverage_cache.CACHE_SIZE_GB,
+                        help="Maximum size of the cache in gb, least recently used entries are removed "
+                             "(Default: {})".format(coverage_cache.CACHE_SIZE_GB))
+    parser.add_argument('-no-cache', '--no-cache', dest='cache_dir', action='store_const', const=None,
+                        help="Do not use the coverage cache")
     return parser
 
 
 def get_args(args=None):
     parser = get_parser()
     args = parser.parse_args(args)
+    if args.out and len(args.out) != len(args.panel):
+        parser.error("Give one output prefix with -out pr. gene panel given with -panel")
     return args
 
 
-def run_samtools(bam, bed):
+def read_bedcov(source, chunksize=CHUNKSIZE):
+    """
+    Parse bedcov output in chunks with compact dtypes, so memory use does not grow with the size of the bed-file.
+    :param source: filename or file handle (e.g. stdout of a samtools process)
+    :param chunksize: number of rows parsed at a time
+    :return: generator of DataFrames with columns chromosome, start, end, gene, exon and coverage, nothing for empty
+    output
+    """
+    import pandas as pd
+    try:
+        reader = pd.read_csv(source, sep='\t', header=None, names=BEDCOV_COLUMNS, dtype=BEDCOV_DTYPES,
+                             usecols=[c for c in BEDCOV_COLUMNS if c != 'strand'], chunksize=chunksize)
+    except pd.errors.EmptyDataError:
+        return
+    for chunk in reader:
+        yield chunk
+
+
+def run_samtools(bam, bed, chunksize=CHUNKSIZE):
     print("# Running samtools for collecting coverage stats")
     # Bedcov reports the total read base count (i.e. the sum of per base read depths)
     # for each genomic region specified in the supplied BED file.
@@ -52,65 +90,284 @@ def run_samtools(bam, bed):
         input = subprocess.Popen(["samtools", "bedcov", bed, bam], stdout=subprocess.PIPE)
     except OSError as e:
         print("# Could not run samtools, try to use: module load samtools/1.9 and/or check path")
-    print("# Decoding bedcov output ... ")
-    decoding = StringIO(input.communicate()[0].decode('utf-8'))
-    data = pd.read_csv(decoding, dtype={0: str}, sep='\t', header=None)
-    data.columns = ['chromosome', 'start', 'end', 'gene', 'exon', 'strand', 'coverage']
-    data.drop(columns=['strand'], inplace=True)
+        raise
+    print("# Streaming bedcov output ... ")
+    # the pipe is consumed chunk by chunk instead of collecting everything with communicate()
+    with input.stdout:
+        yield from read_bedcov(input.stdout, chunksize)
+    if input.wait() != 0:
+        raise subprocess.CalledProcessError(input.returncode, input.args)
+
+
+def shard_bed(bed, shards, directory):
+    """
+    Split a bed-file in shards with about the same number of bases. Intervals are ordered by chromosome and start
+    before splitting, so each shard covers few neighbouring regions.
+    :param bed: bed-file
+    :param shards: number of shards
+    :param directory: directory to write the shards to
+    :return: list of tuples (shard filename, array with the line numbers in the original bed-file), empty if the
+    bed-file has no intervals
+    """
+    import numpy as np
+    with open(bed) as handle:
+        # every line gets a newline, so a last line without one is not glued to the next line of its shard
+        lines = [line.rstrip('\n') + '\n' for line in handle if line.strip() and not line.startswith('#')]
+    if not lines:
+        return []
+    fields = [line.split('\t', 3) for line in lines]
+    chromosome_rank = {}
+    for f in fields:
+        chromosome_rank.setdefault(f[0], len(chromosome_rank))
+    starts = np.array([int(f[1]) for f in fields], dtype=np.int64)
+    lengths = np.array([int(f[2]) for f in fields], dtype=np.int64) - starts
+    order = np.lexsort((starts, [chromosome_rank[f[0]] for f in fields]))
+    load = np.cumsum(lengths[order])
+    bounds = np.searchsorted(load, load[-1] * np.arange(1, shards) / shards) if len(load) else []
+    sharded = []
+    for i, idx in enumerate(np.split(order, bounds)):
+        if len(idx) == 0:
+            continue
+        filename = os.path.join(directory, f"shard_{i}.bed")
+        with open(filename, 'w') as handle:
+            handle.writelines(lines[j] for j in idx)
+        sharded.append((filename, idx))
+    return sharded
+
+
+def run_shards(bam, shards, workers):
+    """
+    Run samtools bedcov on each shard as concurrent processes.
+    :param shards: list of shards as returned by shard_bed
+    :return: list of bedcov output files, one pr. shard
+    """
+    def run_shard(filename):
+        outfile = filename.replace('.bed', '.cov')
+        with open(outfile, 'w') as handle:
+            subprocess.run(["samtools", "bedcov", filename, bam], stdout=handle, check=True)
+        return outfile
+
+    with ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(run_shard, [filename for filename, _ in shards]))
+
+
+def run_samtools_sharded(bam, bed, workers, chunksize=CHUNKSIZE):
+    """
+    Run samtools bedcov on shards of the bed-file as concurrent processes and merge the results in bed order.
+    """
+    import pandas as pd
+    print(f"# Running samtools for collecting coverage stats on {workers} shards of {bed}")
+    assert os.path.exists(bam), "does not exist"
+    assert os.path.exists(bed), "does not exist"
+    with tempfile.TemporaryDirectory() as directory:
+        shards = shard_bed(bed, workers, directory)
+        outfiles = run_shards(bam, shards, workers)
+        print("# Merging bedcov output of shards ... ")
+        parts = []
+        for (_, idx), outfile in zip(shards, outfiles):
+            part = pd.concat(read_bedcov(outfile, chunksize), ignore_index=True)
+            part.index = idx
+            parts.append(part)
+    if not parts:
+        return pd.DataFrame({c: pd.Series(dtype=BEDCOV_DTYPES[c]) for c in BEDCOV_COLUMNS if c != 'strand'})
+    categories = {c: 'category' for c in ['chromosome', 'gene', 'exon']}
+    # shards have their own categories, so the columns are converted back to categoricals after merging
+    return pd.concat(parts).sort_index().reset_index(drop=True).astype(categories)
+
+
+def read_coverage_column(lines):
+    """
+    Only the coverage of bedcov output (the last column), the bed columns are not parsed.
+    :param lines: iterable of bytes or str lines
+    :return: int64 array with the coverage pr. line
+    """
+    import numpy as np
+    return np.array([int(line.rsplit(None, 1)[-1]) for line in lines if line.strip()], dtype=np.int64)
+
+
+def run_samtools_coverage(bam, bed, processes=1):
+    """
+    Coverage pr. interval of a bed-file from samtools bedcov, for intervals that are already loaded (e.g. with
+    read_bed). With more than one process samtools runs on shards of the bed-file.
+    :return: int64 array with the coverage pr. interval in bed order
+    """
+    import numpy as np
+    print(f"# Running samtools for collecting coverage of {bed} using {processes} processes")
+    assert os.path.exists(bam), "does not exist"
+    assert os.path.exists(bed), "does not exist"
+    if processes <= 1:
+        input = subprocess.Popen(["samtools", "bedcov", bed, bam], stdout=subprocess.PIPE)
+        with input.stdout:
+            coverage = read_coverage_column(input.stdout)
+        if input.wait() != 0:
+            raise subprocess.CalledProcessError(input.returncode, input.args)
+        return coverage
+    with tempfile.TemporaryDirectory() as directory:
+        shards = shard_bed(bed, processes, directory)
+        outfiles = run_shards(bam, shards, processes)
+        coverage = np.zeros(sum(len(idx) for _, idx in shards), dtype=np.int64)
+        for (_, idx), outfile in zip(shards, outfiles):
+            with open(outfile, 'rb') as handle:
+                coverage[idx] = read_coverage_column(handle)
+    return coverage
+
+
+def read_bed(bed):
+    import pandas as pd
+    columns = [c for c in BEDCOV_COLUMNS if c != 'coverage']
+    return pd.read_csv(bed, sep='\t', header=None, names=columns, usecols=[c for c in columns if c != 'strand'],
+                       dtype={c: BEDCOV_DTYPES[c] for c in columns if c != 'strand'})
+
+
+def cache_coverage(data, key, cache_dir, cache_size):
+    """
+    Save the coverage column to the cache once all data has been seen. Chunks are passed on as they come.
+    """
+    import pandas as pd
+    import numpy as np
+    if isinstance(data, pd.DataFrame):
+        coverage_cache.store(key, np.asarray(data['coverage']), cache_dir, cache_size)
+        return data
+    return _cache_chunks(data, key, cache_dir, cache_size)
+
+
+def _cache_chunks(chunks, key, cache_dir, cache_size):
+    import numpy as np
+    coverage = []
+    for chunk in chunks:
+        coverage.append(np.asarray(chunk['coverage']))
+        yield chunk
+    coverage_cache.store(key, np.concatenate(coverage) if coverage else np.zeros(0, dtype=np.int64), cache_dir,
+                         cache_size)
+
+
+def get_bam_coverage(bam, bed, processes=1, chunksize=CHUNKSIZE, cache_dir=None,
+                     cache_size=coverage_cache.CACHE_SIZE_GB):
+    """
+    Coverage pr. bed interval from a bam-file, taken from the cache if the same bam and bed-file were run before.
+    :param bam: bam-file
+    :param bed: bed-file with intervals
+    :param processes: number of concurrent samtools processes
+    :param chunksize: number of lines parsed at a time from samtools
+    :param cache_dir: cache folder, no caching if None
+    :param cache_size: maximum cache size in gb
+    :return: DataFrame or iterable of DataFrames (chunks) with bedcov output
+    """
+    if cache_dir:
+        key = coverage_cache.cache_key(bam, bed)
+        coverage = coverage_cache.load(key, cache_dir)
+        if coverage is not None:
+            data = read_bed(bed)
+            if len(data) == len(coverage):
+                data['coverage'] = coverage
+                return data
+            print("# Cached coverage does not match the bed-file, collecting coverage again")
+    if processes > 1:
+        data = run_samtools_sharded(bam, bed, processes, chunksize)
+    else:
+        data = run_samtools(bam, bed, chunksize)
+    if cache_dir:
+        return cache_coverage(data, key, cache_dir, cache_size)
     return data
 
 
-def load_data(infile):
+def load_data(infile, chunksize=CHUNKSIZE):
     print(f"# Loading data from {infile}")
-    data = pd.read_csv(infile, dtype={0: str}, sep='\t', header=None)
-    data.columns = ['chromosome', 'start', 'end', 'gene', 'exon', 'strand', 'coverage']
-    data.drop(columns=['strand'], inplace=True)
-    return data
+    return read_bedcov(infile, chunksize)
 
 
-def calculate_coverage_stats(data, panel, intron_mode=False):
+def calculate_panel_stats(data, panels, intron_mode=False):
+    """
+    Calculate mean coverage and fraction of exons above 20x pr. chromosome and pr. gene for several gene panels in
+    one pass over the data. Statistics are aggregated chunk by chunk for all genes, only the low coverage exons of
+    panel genes are kept row-wise. The gene statistics are then sliced pr. panel.
+    :param data: DataFrame or iterable of DataFrames (chunks) with bedcov output
+    :param panels: list of gene panels (lists of genes of interest)
+    :param intron_mode: do not report missing panel genes
+    :return: chromosome coverage and a list with a tuple (gene coverage, low coverage exons) pr. panel
+    """
+    import pandas as pd
+    import numpy as np
+    from natsort import natsorted
     print("# Calculating coverage stats ... ")
-    data['mean_cov'] = data['coverage'] / (data['end'] - data['start'])
-    data['exons_above20x_frac'] = data['mean_cov'].apply(lambda x: int(x > 20.0))
-    coverage_chromosomes = data.groupby('chromosome').mean()
-    # filter gene coverage data
-    data_interest = data[data['gene'].isin(panel)]
-    coverage_genes = data_interest.groupby('gene').mean()
-    low_coverage_exons = data_interest[data_interest['mean_cov'] < 20.0]
+    if isinstance(data, pd.DataFrame):
+        data = [data]
+    stat_columns = ['mean_cov', 'above20x']
+    genes_of_interest = set().union(*map(set, panels))
+    chromosome_sums, gene_sums = None, None
+    low_coverage_exons = []
+    features = set()
+    for chunk in data:
+        chunk = exon_statistics(chunk, thresholds=(20,))
+        features.update(chunk['gene'].unique())
+        chromosome_sums = add_group_sums(chromosome_sums, group_sums(chunk, 'chromosome', stat_columns))
+        gene_sums = add_group_sums(gene_sums, group_sums(chunk, 'gene', stat_columns))
+        low_coverage_exons.append(chunk.loc[chunk['gene'].isin(genes_of_interest) & (chunk['below20x'] == 1),
+                                            ['chromosome', 'gene', 'exon', 'mean_cov']])
+    # without any intervals the tables are empty, with the columns they would have had
+    if gene_sums is None:
+        chromosome_sums, gene_sums = [pd.DataFrame(columns=stat_columns + ['n'], dtype=float,
+                                                   index=pd.Index([], dtype=object, name=key))
+                                      for key in ['chromosome', 'gene']]
+    names = {'above20x': 'exons_above20x_frac'}
+    coverage_genes = gene_sums[stat_columns].div(gene_sums['n'], axis=0).sort_index().rename(columns=names)
+    coverage_chromosomes = chromosome_sums[stat_columns].div(chromosome_sums['n'], axis=0).rename(columns=names)
     coverage_chromosomes = coverage_chromosomes.reindex(index=natsorted(coverage_chromosomes.index))
-    
-    print("# Number of unique genes/features found:", len(data['gene'].unique()))
-    print("# Found", data_interest['gene'].nunique(), "out of", len(np.unique(panel)))
-    if data_interest['gene'].nunique() < len(panel) and not intron_mode:
-        print("# Following genes were not found:", set(panel) - set(data['gene'].unique()))
-    return coverage_genes.loc[:, ['mean_cov', 'exons_above20x_frac']], \
-           low_coverage_exons.loc[:, ['chromosome', 'gene', 'exon', 'mean_cov']], \
-           coverage_chromosomes.loc[:, ['mean_cov', 'exons_above20x_frac']]
+    # chunks have their own categories, so the concatenated columns are converted back to strings
+    if low_coverage_exons:
+        low_coverage_exons = pd.concat(low_coverage_exons, ignore_index=True).astype({'chromosome': str, 'gene': str,
+                                                                                     'exon': str})
+    else:
+        low_coverage_exons = pd.DataFrame(columns=['chromosome', 'gene', 'exon', 'mean_cov'])
+    print("# Number of unique genes/features found:", len(features))
 
+    results = []
+    for panel in panels:
+        panel_genes = coverage_genes[coverage_genes.index.isin(panel)]
+        panel_low_coverage_exons = low_coverage_exons[low_coverage_exons['gene'].isin(panel)].reset_index(drop=True)
+        print("# Found", len(panel_genes), "out of", len(np.unique(panel)))
+        if len(panel_genes) < len(panel) and not intron_mode:
+            print("# Following genes were not found:", set(panel) - features)
+        results.append((panel_genes, panel_low_coverage_exons))
+    return coverage_chromosomes, results
 
-def plot_distribution(genes, name, plots=4, sort='value'):
+
+def calculate_coverage_stats(data, panel, intron_mode=False):
+    """
+    Calculate mean coverage and fraction of exons above 20x pr. gene in the panel and pr. chromosome.
+    :param data: DataFrame or iterable of DataFrames (chunks) with bedcov output
+    :param panel: list of genes of interest
+    :param intron_mode: do not report missing panel genes
+    :return: gene coverage, low coverage exons and chromosome coverage
+    """
+    coverage_chromosomes, [(coverage_genes, low_coverage_exons)] = calculate_panel_stats(data, [panel], intron_mode)
+    return coverage_genes, low_coverage_exons, coverage_chromosomes
+
+
+def distribution_job(genes, name, plots=4, sort='value'):
+    """
+    Arrays to draw the coverage pr. gene plot from, see quality.plotting.render_gene_distribution.
+    :param genes: gene coverage indexed by gene
+    :param sort: order of the genes, by 'value', 'alphabet' or as given
+    """
+    import numpy as np
     if sort == 'value':
         data = genes.sort_values(by='mean_cov')
     elif sort == 'alphabet':
-        data = genes.sort_values(by='gene')
+        data = genes.sort_index()
     else:
         data = genes
-    rows = int(np.ceil(len(data)/plots))
-    fig, axes = plt.subplots(plots, 1, figsize=(10, plots*3))
-    cmap = sns.color_palette("GnBu")
-    for i, ax in enumerate(fig.axes):
-        sns.barplot(x=data[i*rows:(i+1)*rows].index, ax=ax, y='mean_cov', palette=cmap, data=data[i*rows:(i+1)*rows])
-        ax.set_title('Coverage pr. target gene')
-        ax.set_ylabel('Mean coverage')
-        ax.set_xlabel('Gene name')
-        ax.set_xticklabels(ax.get_xticklabels(), rotation=90, verticalalignment='top', fontweight='light')
-    fig.tight_layout()
-    plotname = name + '_coverage_pr_gene.png'
-    print("# Saving to", plotname)
-    plt.savefig(plotname)
+    return {'names': np.asarray(data.index), 'values': np.asarray(data['mean_cov']),
+            'plotname': name + '_coverage_pr_gene.png', 'plots': plots}
+
+
+def plot_distribution(genes, name, plots=4, sort='value'):
+    from quality.plotting import render_gene_distribution
+    render_gene_distribution(**distribution_job(genes, name, plots, sort))
 
 
 def write_excel(output, coverage_genes, coverage_chrom, low_cov_exons):
+    import pandas as pd
     print("# Writing tsv files ... ")
     coverage_genes.to_csv(output + '_genes.tsv', sep='\t')
     coverage_chrom.to_csv(output + '_chromosomes.tsv', sep='\t')
@@ -123,42 +380,63 @@ def write_excel(output, coverage_genes, coverage_chrom, low_cov_exons):
         low_cov_exons.to_excel(excel_obj, sheet_name='Low coverage exons', index=False)
 
 
-def main(infile, bed, panel_file, intron_mode=False, outname=None):
-    # pdb.set_trace()
-    gene_panel = list(np.unique(pd.read_csv(panel_file, usecols=[0]).values.flatten()))
+def get_output_prefixes(infile, suffix, panel_files, outnames=None):
+    """
+    Output prefix pr. panel. Without given names the prefix is the sample name, with the panel name added for all
+    but the first panel.
+    """
+    if outnames:
+        return [os.path.join(os.getcwd(), outname) for outname in outnames]
+    output = os.path.join(os.path.dirname(infile), os.path.basename(infile).replace(suffix, ''))
+    return [output] + [output + '.' + os.path.splitext(os.path.basename(p))[0] for p in panel_files[1:]]
+
+
+def main(infile, bed, panel_files, intron_mode=False, outnames=None, chunksize=CHUNKSIZE, processes=1, cache_dir=None,
+         cache_size=coverage_cache.CACHE_SIZE_GB):
+    import pandas as pd
+    import numpy as np
+    if isinstance(panel_files, str):
+        panel_files = [panel_files]
+    if isinstance(outnames, str):
+        outnames = [outnames]
+    if outnames and len(outnames) != len(panel_files):
+        print("# Give one output name pr. gene panel, exiting ... ")
+        exit(1)
+    gene_panels = [list(np.unique(pd.read_csv(panel_file, usecols=[0]).values.flatten())) for panel_file in panel_files]
     if infile.endswith('.bam'):
         suffix = '.bam'
-        coverage_genes, low_cov_exons, coverage_chrom = calculate_coverage_stats(run_samtools(infile, bed), gene_panel, intron_mode)
+        coverage = get_bam_coverage(infile, bed, processes, chunksize, cache_dir, cache_size)
     elif infile.endswith('.bed'):
         suffix = '.bed'
-        coverage_genes, low_cov_exons, coverage_chrom = calculate_coverage_stats(load_data(infile), gene_panel, intron_mode)
+        coverage = load_data(infile, chunksize)
     else:
         print("# File format not recognized, exiting ... ")
         exit(1)
+    coverage_chrom, panel_stats = calculate_panel_stats(coverage, gene_panels, intron_mode)
 
-    if outname:
-        sample = outname
-        output = os.path.join(os.getcwd(), sample)
-    else:
-        sample = os.path.basename(infile).replace(suffix, '')
-        path = os.path.dirname(infile)
-        output = os.path.join(path, sample)
-    print(f"# Writing output with prefix {output}")
-    if intron_mode:
-        coverage_chrom.to_csv(output + '_chromosomes.tsv', sep='\t')
-    else:
-        write_excel(output, coverage_genes, coverage_chrom, low_cov_exons)
-        plot_distribution(coverage_genes, output)
+    plots = []
+    for output, (coverage_genes, low_cov_exons) in zip(get_output_prefixes(infile, suffix, panel_files, outnames),
+                                                       panel_stats):
+        print(f"# Writing output with prefix {output}")
+        if intron_mode:
+            coverage_chrom.to_csv(output + '_chromosomes.tsv', sep='\t')
+        else:
+            write_excel(output, coverage_genes, coverage_chrom, low_cov_exons)
+            plots.append(distribution_job(coverage_genes, output))
+    if plots:
+        # the plots of all panels are drawn at the same time, matplotlib is only loaded when plotting
+        from quality.plotting import render_gene_distributions
+        render_gene_distributions(plots, processes)
 
 
 if __name__ == "__main__":
     start_time = datetime.now()
     args = get_args()
     print("# args:", args)
-    global_modules = globals()
-    modules = imports(global_modules)
-    print_modules(list(modules))
-    main(args.infile, args.bed, args.panel, args.intron, args.out)
+    # module versions are only collected when printed, see utils_py.version
+    print_modules(imports(globals()))
+    main(args.infile, args.bed, args.panel, args.intron, args.out, args.chunksize, args.processes,
+         args.cache_dir, args.cache_size)
     end_time = datetime.now()
     print("# Done!")
     print('# Duration: {}'.format(end_time - start_time))
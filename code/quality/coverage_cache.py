@@ -0,0 +1,84 @@
+#! /usr/bin/env python3
+
+import os
+import hashlib
+
+from utils_py.files import atomic_write, remove_stale_tmp, SHARED_FILE_MODE
+
+# caching is off unless a folder is given with -cache or ICOPE_BEDCOV_CACHE, which can be shared by several users
+CACHE_DIR = os.environ.get('ICOPE_BEDCOV_CACHE')
+CACHE_SIZE_GB = 5
+CACHE_SUFFIX = '.npy'
+
+
+def file_hash(filename, blocksize=1 << 20):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as handle:
+        for block in iter(lambda: handle.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(bam, bed):
+    """
+    Key for the coverage of a bed-file on a bam-file. The bam is identified by path, size and modification time so a
+    rewritten bam gets a new key, the bed-file by its content.
+    """
+    stat = os.stat(bam)
+    identity = f"{os.path.abspath(bam)}\t{stat.st_size}\t{stat.st_mtime_ns}\t{file_hash(bed)}"
+    return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+
+def load(key, cache_dir=CACHE_DIR):
+    """
+    Get cached coverage pr. interval, or None if it is not in the cache. A hit marks the entry as recently used.
+    :return: int64 array with summed depth pr. bed interval
+    """
+    import numpy as np
+    filename = os.path.join(cache_dir, key + CACHE_SUFFIX)
+    try:
+        coverage = np.load(filename)
+    except (OSError, ValueError):
+        return None
+    # the modification time is used for LRU eviction, access time is not reliable on network filesystems. The entry
+    # may have been evicted since or belong to another user of a shared cache
+    try:
+        os.utime(filename)
+    except OSError:
+        pass
+    print(f"# Using cached coverage from {filename}")
+    return coverage
+
+
+def store(key, coverage, cache_dir=CACHE_DIR, max_gb=CACHE_SIZE_GB):
+    """
+    Save coverage pr. interval in the cache and evict the least recently used entries if the cache is too big.
+    """
+    import numpy as np
+    os.makedirs(cache_dir, exist_ok=True)
+    filename = os.path.join(cache_dir, key + CACHE_SUFFIX)
+    atomic_write(filename, lambda outfile: np.save(outfile, np.asarray(coverage, dtype=np.int64)), SHARED_FILE_MODE)
+    print(f"# Saved coverage to cache {filename}")
+    evict(cache_dir, max_gb)
+
+
+def evict(cache_dir=CACHE_DIR, max_gb=CACHE_SIZE_GB):
+    remove_stale_tmp(cache_dir)
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(CACHE_SUFFIX):
+            # another process may have evicted the entry since the scan
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_gb * 1024 ** 3:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
@@ -0,0 +1,61 @@
+#! /usr/bin/env python3
+
+
+# depth histograms are stored as a contig x depth count matrix with the contig names and lengths
+HISTOGRAM_SUFFIX = '.genomecov.npz'
+
+
+def parse_genomecov(lines, max_depth=150):
+    """
+    Parse bedtools genomecov histogram lines as they arrive into one count array pr. contig.
+    :param lines: iterable of lines (str or bytes) with contig, depth, number of bases, contig length and fraction
+    :param max_depth: expected maximum depth (-max given to bedtools), arrays grow if a higher depth is seen
+    :return: tuple (list of contigs, array of contig lengths, count matrix with a row pr. contig and column pr. depth)
+    """
+    import numpy as np
+    contigs, totals, rows = [], [], []
+    index = {}
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        contig, depth, obs_bases, total = line.split('\t')[:4]
+        i = index.get(contig)
+        if i is None:
+            i = index[contig] = len(contigs)
+            contigs.append(contig)
+            totals.append(int(total))
+            rows.append(np.zeros(max_depth + 1, dtype=np.int64))
+        depth = int(depth)
+        if depth >= len(rows[i]):
+            rows[i] = np.concatenate([rows[i], np.zeros(depth + 1 - len(rows[i]), dtype=np.int64)])
+        rows[i][depth] = int(obs_bases)
+    counts = np.zeros((len(rows), max([len(r) for r in rows], default=max_depth + 1)), dtype=np.int64)
+    for i, row in enumerate(rows):
+        counts[i, :len(row)] = row
+    return contigs, np.array(totals, dtype=np.int64), counts
+
+
+def histogram_table(contigs, totals, counts):
+    """
+    Convert a depth histogram to the bedtools genomecov table layout, only depths with any bases are included.
+    :return: DataFrame with columns chr, cov, obs_bases, total and frac
+    """
+    import pandas as pd
+    import numpy as np
+    rows, depths = np.nonzero(counts)
+    cov = pd.DataFrame({'chr': np.asarray(contigs, dtype=object)[rows], 'cov': depths,
+                        'obs_bases': counts[rows, depths], 'total': np.asarray(totals)[rows]})
+    cov['frac'] = cov['obs_bases'] / cov['total']
+    return cov
+
+
+def save_histogram(filename, contigs, totals, counts):
+    import numpy as np
+    np.savez_compressed(filename, contigs=np.asarray(contigs, dtype=str), totals=totals, counts=counts)
+    print(f"# Saved coverage histogram to {filename}")
+
+
+def load_histogram(filename):
+    import numpy as np
+    with np.load(filename) as data:
+        return list(data['contigs']), data['totals'], data['counts']
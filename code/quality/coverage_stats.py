@@ -0,0 +1,97 @@
+#! /usr/bin/env python3
+
+
+# depth thresholds used for flagging exons, e.g. above20x/below20x
+THRESHOLDS = (10, 20)
+
+
+def flag_columns(thresholds=THRESHOLDS):
+    """
+    Names of the flag columns added by exon_statistics, e.g. ['above10x', 'below10x', 'above20x', 'below20x']
+    """
+    columns = []
+    for threshold in thresholds:
+        columns += [f'above{threshold:g}x', f'below{threshold:g}x']
+    return columns
+
+
+def exon_statistics(data, thresholds=THRESHOLDS):
+    """
+    Add mean coverage and a flag (0/1) for being above and below each depth threshold to every exon (interval).
+    All flags are computed in one vectorized comparison.
+    :param data: DataFrame with columns start, end and coverage (summed depth as reported by samtools bedcov)
+    :param thresholds: depth thresholds
+    :return: data with the new columns mean_cov, above<t>x and below<t>x
+    """
+    import numpy as np
+    mean_cov = np.asarray(data['coverage']) / (np.asarray(data['end']) - np.asarray(data['start']))
+    limits = np.asarray(thresholds, dtype=float)
+    above = (mean_cov[:, None] > limits).astype(np.int8)
+    below = (mean_cov[:, None] < limits).astype(np.int8)
+    data['mean_cov'] = mean_cov
+    for i, threshold in enumerate(thresholds):
+        data[f'above{threshold:g}x'] = above[:, i]
+        data[f'below{threshold:g}x'] = below[:, i]
+    return data
+
+
+def group_sums(data, key, columns):
+    """
+    Sum of the columns and number of rows pr. group. The groups are converted to integer codes once and all columns
+    are reduced in a single bincount.
+    :param data: DataFrame
+    :param key: column to group by (e.g. gene or chromosome)
+    :param columns: numeric columns to sum
+    :return: DataFrame indexed by group with the summed columns and the number of rows in 'n'
+    """
+    import pandas as pd
+    import numpy as np
+    codes, groups = pd.factorize(data[key], sort=True)
+    observed = codes >= 0
+    codes = codes[observed]
+    values = np.asarray(data.loc[observed, columns], dtype=float)
+    n_columns = len(columns)
+    flat = (codes[:, None] * n_columns + np.arange(n_columns)).ravel()
+    sums = np.bincount(flat, weights=values.ravel(), minlength=len(groups) * n_columns).reshape(-1, n_columns)
+    result = pd.DataFrame(sums, columns=columns, index=pd.Index(np.asarray(groups).astype(str), name=key))
+    result['n'] = np.bincount(codes, minlength=len(groups))
+    return result
+
+
+def add_group_sums(total, partial):
+    """
+    Add group sums of a chunk to running totals (None for the first chunk).
+    """
+    if total is None:
+        return partial
+    return total.add(partial, fill_value=0)
+
+
+def group_summary(sums, thresholds=THRESHOLDS):
+    """
+    Mean of each summed column (for flags this is the fraction of exons), number of exons and number of exons below
+    each threshold pr. group.
+    :param sums: DataFrame from group_sums
+    :param thresholds: thresholds to count exons below
+    :return: DataFrame indexed by group
+    """
+    columns = [c for c in sums.columns if c != 'n']
+    summary = sums[columns].div(sums['n'], axis=0)
+    summary['nr_exons'] = sums['n'].astype(int)
+    for threshold in thresholds:
+        if f'below{threshold:g}x' in sums:
+            summary[f'below{threshold:g}_count'] = sums[f'below{threshold:g}x'].astype(int)
+    return summary
+
+
+def coverage_summary(data, key='gene', thresholds=THRESHOLDS):
+    """
+    Exon statistics aggregated pr. gene or chromosome in one pass.
+    :param data: DataFrame with bedcov output (columns chromosome, start, end, gene, exon and coverage)
+    :param key: column to group by
+    :param thresholds: depth thresholds
+    :return: DataFrame indexed by key with mean_cov, fraction of exons above/below each threshold, nr_exons and
+    number of exons below each threshold
+    """
+    data = exon_statistics(data, thresholds)
+    return group_summary(group_sums(data, key, ['mean_cov'] + flag_columns(thresholds)), thresholds)
@@ -1,39 +1,45 @@
 #! /usr/bin/env python3
 
-import seaborn as sns
-import pandas as pd
-import sys
-import re
-import matplotlib.pyplot as plt
-import pdb
-import numpy as np
+import argparse
 from utils_py.version import print_modules, imports
+from quality.coverage_stats import coverage_summary
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Coverage statistics pr. gene of the exons in bedcov output, written to <sample>.summary.xlsx "
+                    "with the genes of the panel marked")
+    parser.add_argument('infile', help="Output of samtools bedcov on the canonical exons (.bed)")
+    parser.add_argument('panel', help="Gene panel, a gene pr. line after a header line")
+    return parser
+
+
+def get_args(args=None):
+    parser = get_parser()
+    return parser.parse_args(args)
+
+
+def read_panel(gene_file):
+    import pandas as pd
+    return list(pd.read_csv(gene_file).values.flatten())
+
 
 def read_input(filename):
+    import pandas as pd
     data = pd.read_csv(filename, sep='\t')
     data.columns = ['chromosome', 'start', 'end', 'gene', 'exon', 'strand', 'coverage']
-    data.drop(columns=['strand'], inplace=True)
+    data.drop(['strand'], axis=1, inplace=True)
     return data
 
 
 def calculate_statistics(data):
-    data['mean_cov'] = data['coverage'] / (data['end'] - data['start'])
-    data['above20x'] = data['mean_cov'].apply(lambda x: int(x > 20.0))
-    data['above10x'] = data['mean_cov'].apply(lambda x: int(x > 10.0))
-    data['below20x'] = data['mean_cov'].apply(lambda x: int(x < 20.0))
-    data['below10x'] = data['mean_cov'].apply(lambda x: int(x < 10.0))
-    transcript_coverage = data.groupby('gene')
-
-    # get size of each group:
-    t_mean = transcript_coverage.mean()
-    t_mean['nr_exons'] = transcript_coverage.size()
-    t_mean['below10_count'] = transcript_coverage.sum().loc[:, 'below10x']
-    t_mean['below20_count'] = transcript_coverage.sum().loc[:, 'below20x']
-
+    # mean coverage, fraction of exons above/below 10x and 20x and counts of exons below 10x and 20x pr. gene
+    t_mean = coverage_summary(data, 'gene', thresholds=(10, 20))
     return data, t_mean
 
 
 def aggregate_results(t_mean, gene_panel, name):
+    import pandas as pd
     columns = ['mean_cov', 'above20x', 'above10x', 'below20x', 'below10x', 'nr_exons', 
                'below20_count', 'below10_count']
     t_mean['Gene of interest'] = t_mean.index.isin(gene_panel).astype(int)
@@ -48,12 +54,11 @@ def aggregate_results(t_mean, gene_panel, name):
 
 if __name__ == '__main__':
     print("# Running exon coverage function")
-    global_modules = globals()
-    modules = imports(global_modules)
-    print_modules(list(modules))
-    filename = sys.argv[1]
-    gene_file = sys.argv[2]
-    gene_panel = list(pd.read_csv(gene_file).values.flatten())
+    # module versions are only collected when printed, see utils_py.version
+    print_modules(imports(globals()))
+    args = get_args()
+    filename = args.infile
+    gene_panel = read_panel(args.panel)
     sample = filename.replace('.bed', '')
     data = read_input(filename)
     data, t_mean = calculate_statistics(data)
@@ -1,68 +1,83 @@
 #! /usr/bin/env python3
 
-import seaborn as sns
-import pandas as pd
-import sys
-import re
-import pdb
-import numpy as np
-import matplotlib
-matplotlib.use('Agg')
-
-import matplotlib.pyplot as plt
+import argparse
+
 from utils_py.version import print_modules, imports
+from quality.coverage_stats import coverage_summary
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Plot the mean coverage of the genes of a panel from bedcov output, sorted by coverage and by "
+                    "name")
+    parser.add_argument('infile', help="Output of samtools bedcov on the canonical exons (.bed)")
+    parser.add_argument('panel', help="Gene panel, a gene pr. line after a header line")
+    return parser
+
+
+def get_args(args=None):
+    parser = get_parser()
+    return parser.parse_args(args)
+
+
+def read_panel(gene_file):
+    import pandas as pd
+    return list(pd.read_csv(gene_file).values.flatten())
+
 
 def read_input(filename):
+    import pandas as pd
     data = pd.read_csv(filename, sep='\t')
     data.columns = ['chromosome', 'start', 'end', 'gene', 'exon', 'strand', 'coverage']
-    data.drop(columns=['strand'], inplace=True)
+    data.drop(['strand'], axis=1, inplace=True)
     return data
 
 
 def calculate_statistics(data, panel):
-    data['mean_cov'] = data['coverage'] / (data['end'] - data['start'])
-    genes = data.groupby('gene')['mean_cov'].mean().to_frame().reset_index()
+    genes = coverage_summary(data, 'gene', thresholds=())[['mean_cov']].reset_index()
     genes = genes[genes['gene'].isin(panel)].reset_index()
     return genes
 
 
-def plot_distribution(genes, name, plots=4, sort='value'):
+def distribution_job(genes, name, plots=4, sort='value'):
+    """
+    Arrays to draw the coverage pr. gene plot from, see quality.plotting.render_gene_distribution.
+    :param genes: DataFrame with 'gene' and 'mean_cov' columns
+    :param sort: order of the genes, by 'value', 'alphabet' or as given
+    """
+    import numpy as np
     if sort == 'value':
         data = genes.sort_values(by='mean_cov')
     elif sort == 'alphabet':
         data = genes.sort_values(by='gene')
     else:
         data = genes
-    rows = int(np.ceil(len(data)/plots))
-    fig, axes = plt.subplots(plots, 1, figsize=(10, plots*3))
-    cmap = sns.color_palette("GnBu")
-    for i, ax in enumerate(fig.axes):
-        sns.barplot(x='gene', ax=ax, y='mean_cov', palette=cmap, data=data[i*rows:(i+1)*rows])
-        ax.set_title('Coverage pr. target gene')
-        ax.set_ylabel('Mean coverage')
-        ax.set_xlabel('Gene name')
-        ax.set_xticklabels(ax.get_xticklabels(), rotation=90, verticalalignment='top', fontweight='light')
-    fig.tight_layout()
     plotname = name + "_" + sort[0] + "sort_" + 'coverage_pr_gene.png'
-    print("# Saving to", plotname)
-    plt.savefig(plotname)
+    return {'names': np.asarray(data['gene']), 'values': np.asarray(data['mean_cov']), 'plotname': plotname,
+            'plots': plots}
+
+
+def plot_distribution(genes, name, plots=4, sort='value'):
+    from quality.plotting import render_gene_distribution
+    render_gene_distribution(**distribution_job(genes, name, plots, sort))
 
 
 if __name__ == '__main__':
     print("# Running gene coverage function")
-    global_modules = globals()
-    modules = imports(global_modules)
-    print_modules(list(modules))
-    filename = sys.argv[1]
-    gene_file = sys.argv[2]
-    gene_panel = list(pd.read_csv(gene_file).values.flatten())
+    # module versions are only collected when printed, see utils_py.version
+    print_modules(imports(globals()))
+    args = get_args()
+    filename = args.infile
+    gene_panel = read_panel(args.panel)
     print("# plotting data from", filename)
     data = read_input(filename)
     genes = calculate_statistics(data, panel=gene_panel)
     print("# Number of unique genes plotted:", len(genes['gene'].unique()))
     samplename = filename.replace('.bed', '')
-    for sorting in ['value', 'alphabet']:
-        plot_distribution(genes, name=samplename, plots=4, sort=sorting)
+    # the two sortings are drawn at the same time
+    from quality.plotting import render_gene_distributions
+    render_gene_distributions([distribution_job(genes, samplename, plots=4, sort=sorting)
+                               for sorting in ['value', 'alphabet']], processes=2)
 
 
 
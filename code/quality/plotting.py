@@ -0,0 +1,165 @@
+#! /usr/bin/env python3
+
+from multiprocessing import Pool
+import numpy as np
+from matplotlib import cm
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.image import imsave
+
+# figures are drawn from plain arrays with the Agg canvas, without pyplot state, so they can be made in any process
+
+# more genes than this are aggregated to groups of neighbouring genes, one bar pr. group
+MAX_GENE_BARS = 400
+# rows of the coverage pr. chromosome figure drawn pr. process, the parts are stacked to one image
+PANEL_ROWS = 3
+PANEL_HEIGHT = 3
+DPI = 100
+
+
+def pyplot():
+    """
+    matplotlib.pyplot with the Agg backend, for scripts drawing with pyplot. It is imported on first use, so the scripts
+    only load it on the code paths that plot.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def palette(n_colors=6, name='GnBu'):
+    """
+    Colors of a matplotlib colormap without its lightest and darkest end, like seaborn.color_palette(name).
+    """
+    return getattr(cm, name)(np.linspace(0, 1, n_colors + 2)[1:-1])
+
+
+def new_figure(width, height, rows, columns):
+    """
+    Figure with an Agg canvas and a grid of axes.
+    :return: tuple (figure, list of axes row by row)
+    """
+    fig = Figure(figsize=(width, height), dpi=DPI)
+    FigureCanvasAgg(fig)
+    return fig, [fig.add_subplot(rows, columns, i + 1) for i in range(rows * columns)]
+
+
+def bar_plot(ax, labels, heights, colors=None, label_step=1, rotation=0):
+    """
+    Bars at positions 0..n-1 labelled by category, as a categorical seaborn barplot.
+    :param labels: array of tick labels pr. bar
+    :param heights: array of bar heights
+    :param colors: list of colors, cycled over the bars (Default: first color of the color cycle)
+    :param label_step: only label every label_step'th bar
+    """
+    positions = np.arange(len(heights))
+    if colors is not None:
+        colors = [colors[i % len(colors)] for i in positions]
+    ax.bar(positions, heights, width=0.8, color=colors if colors is not None else 'C0')
+    ax.set_xlim(-0.5, len(heights) - 0.5)
+    ax.set_xticks(positions[::label_step])
+    ax.set_xticklabels(np.asarray(labels)[::label_step], rotation=rotation, verticalalignment='top',
+                       fontweight='light')
+
+
+def aggregate_genes(names, values, max_bars=MAX_GENE_BARS):
+    """
+    Groups of neighbouring genes for gene sets too large for one bar pr. gene.
+    :param names: array of gene names in plotting order
+    :param values: array of values pr. gene
+    :param max_bars: maximum number of bars
+    :return: tuple (labels, mean pr. group, minimum pr. group or None if the genes are not grouped)
+    """
+    names, values = np.asarray(names).astype(str), np.asarray(values, dtype=float)
+    if len(values) <= max_bars:
+        return names, values, None
+    starts = np.linspace(0, len(values), max_bars + 1).astype(np.int64)[:-1]
+    sizes = np.diff(np.append(starts, len(values)))
+    means = np.add.reduceat(values, starts) / sizes
+    minima = np.minimum.reduceat(values, starts)
+    labels = np.array([f"{names[s]} (+{n - 1})" for s, n in zip(starts, sizes)])
+    return labels, means, minima
+
+
+def render_gene_distribution(names, values, plotname, plots=4, max_bars=MAX_GENE_BARS):
+    """
+    Save bar plots of the mean coverage pr. gene, split over several rows. Large gene sets are aggregated to at most
+    max_bars bars of neighbouring genes with a step line showing the lowest gene of each group.
+    :param names: array of gene names, sorted as they should be plotted
+    :param values: array of mean coverage pr. gene
+    :param plotname: png-file
+    """
+    labels, heights, minima = aggregate_genes(names, values, max_bars)
+    rows = int(np.ceil(len(heights) / plots))
+    fig, axes = new_figure(10, plots * 3, plots, 1)
+    colors = palette()
+    for i, ax in enumerate(axes):
+        part = slice(i * rows, (i + 1) * rows)
+        label_step = max(1, int(np.ceil(len(heights[part]) / 100)))
+        bar_plot(ax, labels[part], heights[part], colors, label_step, rotation=90)
+        if minima is not None:
+            ax.step(np.arange(len(minima[part])), minima[part], where='mid', color='darkred', linewidth=0.8,
+                    label='Lowest gene in group')
+            ax.legend(loc='upper left')
+        ax.set_title('Coverage pr. target gene' + (f" ({len(names)} genes in groups)" if minima is not None else ''))
+        ax.set_ylabel('Mean coverage')
+        ax.set_xlabel('Gene name')
+    fig.tight_layout()
+    print("# Saving to", plotname)
+    fig.savefig(plotname)
+
+
+def _render_gene_distribution(job):
+    render_gene_distribution(**job)
+
+
+def render_gene_distributions(jobs, processes=1):
+    """
+    Save several gene coverage plots, each file is drawn in its own process.
+    :param jobs: list of dicts with the arguments of render_gene_distribution
+    """
+    if processes > 1 and len(jobs) > 1:
+        with Pool(min(processes, len(jobs))) as pool:
+            pool.map(_render_gene_distribution, jobs)
+    else:
+        for job in jobs:
+            render_gene_distribution(**job)
+
+
+def render_histogram_panels(panels, columns=3, panel_height=PANEL_HEIGHT):
+    """
+    Draw rows of histogram panels to an image.
+    :param panels: list of dicts with 'title', 'bins' (tick labels), 'heights' and 'label_step'
+    :return: RGBA image as uint8 array
+    """
+    rows = int(np.ceil(len(panels) / columns))
+    fig, axes = new_figure(10 * columns, rows * panel_height, rows, columns)
+    for panel, ax in zip(panels, axes):
+        bar_plot(ax, panel['bins'], panel['heights'], label_step=panel['label_step'])
+        ax.set_title(panel['title'])
+    # empty axes of the last row are kept, as in a figure with all panels
+    fig.tight_layout()
+    fig.canvas.draw()
+    width, height = fig.canvas.get_width_height()
+    return np.frombuffer(fig.canvas.buffer_rgba(), dtype=np.uint8).reshape(height, width, 4).copy()
+
+
+def render_panel_figure(panels, plotname, columns=3, processes=1, rows_per_process=PANEL_ROWS):
+    """
+    Save many histogram panels as one png-file. Blocks of rows are drawn in parallel and stacked.
+    :param panels: list of dicts as used by render_histogram_panels
+    """
+    if not panels:
+        # an empty figure of one row, as when there is nothing to plot in a figure with all panels
+        fig, _ = new_figure(10 * columns, PANEL_HEIGHT, 0, columns)
+        fig.savefig(plotname, dpi=DPI)
+        return
+    size = rows_per_process * columns
+    blocks = [panels[i:i + size] for i in range(0, len(panels), size)]
+    if processes > 1 and len(blocks) > 1:
+        with Pool(min(processes, len(blocks))) as pool:
+            images = pool.starmap(render_histogram_panels, [(block, columns) for block in blocks])
+    else:
+        images = [render_histogram_panels(block, columns) for block in blocks]
+    imsave(plotname, np.concatenate(images, axis=0), format='png', dpi=DPI)
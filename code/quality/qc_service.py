@@ -0,0 +1,409 @@
+#! /usr/bin/env python3
+
+import os
+import sys
+import time
+import json
+import uuid
+import socket
+import argparse
+import traceback
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# imports from own repo's
+from quality.combined_coverage import read_bed, calculate_panel_stats, write_excel, distribution_job, \
+    run_samtools_coverage
+from quality import chr_coverage
+
+REFERENCES = '/home/projects/HT2_leukngs/data/references'
+EXON_BED = REFERENCES + '/hg37/USCS.hg37.canonical.exons.bed'
+INTRON_BED = REFERENCES + '/hg37/UCSC_introns_hg37.bed'
+GENE_PANELS = [REFERENCES + '/general/315_genes_of_interest.txt',
+               REFERENCES + '/general/DNA_repair_genes_core.txt']
+REPORTS = ['exons', 'introns', 'chromosomes']
+# coverage limit of the coverage pr. chromosome plot, as in bam_statistics.sh
+CHR_LIMIT = 150
+# jobs are json-files moved between the folders of the spool, a move (rename) is atomic so each job is claimed once
+SPOOL_DIRS = ['tmp', 'queue', 'running', 'done']
+STOP_FILE = 'stop'
+POLL_SECONDS = 2.0
+# the service touches the heartbeat file on every poll, clients give up on jobs if it is older than the timeout
+HEARTBEAT_FILE = 'heartbeat'
+HEARTBEAT_TIMEOUT = 60.0
+# exit code of submit -wait when jobs were not run because no service is running or the wait timed out, so
+# bam_statistics.sh can run the reports itself
+NOT_RUN = 3
+
+# references loaded once by the service, the worker processes get them when they are forked. ProcessPoolExecutor of
+# python 3.6 has no initializer to pass them to workers started otherwise, so serve requires the fork start method
+_references = None
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Resident QC service for bam-files. 'serve' loads the exon and intron bed-files and the gene panels "
+                    "once and runs the QC of bam_statistics.sh (exon coverage pr. gene panel, intronic coverage pr. "
+                    "chromosome and coverage pr. chromosome) for the jobs put in a spool folder, in a pool of worker "
+                    "processes. 'submit' puts jobs in the spool (and waits for them with -wait), 'stop' makes the "
+                    "service exit when the running jobs are done.")
+    parser.add_argument('function', choices=['serve', 'submit', 'stop'])
+    parser.add_argument('-spool', '--spool', dest='spool', required=True,
+                        help="Spool folder shared by the service and clients, e.g. on the scratch of the node")
+    parser.add_argument('-in', dest='bams', nargs='+', help="Bam-files to run the QC on (submit)")
+    parser.add_argument('-reports', '--reports', dest='reports', nargs='+', choices=REPORTS, default=REPORTS,
+                        help="Reports to make (submit, Default: all)")
+    parser.add_argument('-out', dest='destination',
+                        help="Output folder (submit, Default: <sample>.quality_reports pr. bam-file)")
+    parser.add_argument('-wait', '--wait', dest='wait', action='store_true',
+                        help="Wait for the jobs to finish, the exit code is 1 if any failed and {} if jobs were not "
+                             "run because no service is running or the wait timed out (submit)".format(NOT_RUN))
+    parser.add_argument('-timeout', '--timeout', dest='timeout', type=float,
+                        help="Seconds to wait for the jobs, jobs not started by then are withdrawn (submit, Default: "
+                             "wait as long as the service is running)")
+    parser.add_argument('-np', '--processes', dest='processes', type=int, default=1,
+                        help="Number of processes pr. job for reading a bam-file (submit, Default: 1)")
+    parser.add_argument('-jobs', '--jobs', dest='jobs', type=int, default=1,
+                        help="Number of jobs run at the same time (serve, Default: 1)")
+    parser.add_argument('-bed', '--bedfile', dest='bed', default=EXON_BED,
+                        help="Bed-file with exons (serve, Default: {})".format(EXON_BED))
+    parser.add_argument('-intronbed', dest='intron_bed', default=INTRON_BED,
+                        help="Bed-file with introns (serve, Default: {})".format(INTRON_BED))
+    parser.add_argument('-panel', '--gene-panel', dest='panels', nargs='+', default=GENE_PANELS,
+                        help="Gene panels (serve, Default: {})".format(' '.join(GENE_PANELS)))
+    parser.add_argument('-panel-suffix', dest='panel_suffixes', nargs='+',
+                        help="Output suffix for each panel after the first, the first panel is named after the sample "
+                             "(serve, Default: panel file names, bam_statistics.sh uses 'repair')")
+    parser.add_argument('-idle', '--idle-timeout', dest='idle_timeout', type=float,
+                        help="Exit after this many seconds without jobs (serve, Default: run until stopped)")
+    return parser
+
+
+def get_args(args=None):
+    parser = get_parser()
+    args = parser.parse_args(args)
+    if args.function == 'submit' and not args.bams:
+        parser.error("submit needs bam-files given with -in")
+    if args.panel_suffixes and len(args.panel_suffixes) != len(args.panels) - 1:
+        parser.error("give one -panel-suffix pr. gene panel after the first")
+    return args
+
+
+def spool_path(spool, folder, name=''):
+    return os.path.join(spool, folder, name)
+
+
+def make_spool(spool):
+    for folder in SPOOL_DIRS:
+        os.makedirs(spool_path(spool, folder), exist_ok=True)
+
+
+def write_json(spool, folder, name, data):
+    # written to tmp first, so a job or result is never seen half written
+    tmp_filename = spool_path(spool, 'tmp', f"{name}.{os.getpid()}")
+    with open(tmp_filename, 'w') as handle:
+        json.dump(data, handle)
+    os.replace(tmp_filename, spool_path(spool, folder, name))
+
+
+def load_references(bed, intron_bed, panel_files, panel_suffixes=None):
+    """
+    Read the bed-files and gene panels used by all jobs.
+    :return: dict with 'exons' and 'introns' (intervals as read by combined_coverage.read_bed), 'exon_bed' and
+    'intron_bed' (the bed-files given to samtools), 'panels' (list of gene lists) and 'suffixes' (output name suffix
+    pr. panel)
+    """
+    import pandas as pd
+    print(f"# Loading references {bed}, {intron_bed} and {len(panel_files)} gene panels")
+    if panel_suffixes is None:
+        panel_suffixes = [os.path.splitext(os.path.basename(p))[0] for p in panel_files[1:]]
+    return {'exons': read_bed(bed), 'introns': read_bed(intron_bed), 'exon_bed': bed, 'intron_bed': intron_bed,
+            'panels': [list(pd.read_csv(p, usecols=[0]).iloc[:, 0].unique()) for p in panel_files],
+            'suffixes': [''] + ['.' + suffix for suffix in panel_suffixes]}
+
+
+def interval_coverage(bam, intervals, bed, processes=1):
+    """
+    Bedcov output of a bam-file for the preloaded intervals of a bed-file. Only the coverage column of samtools bedcov
+    is read, the intervals are not changed.
+    :return: DataFrame with bedcov output
+    """
+    coverage = run_samtools_coverage(bam, bed, processes)
+    if len(coverage) != len(intervals):
+        raise ValueError(f"samtools bedcov gave {len(coverage)} lines for the {len(intervals)} intervals of {bed}")
+    return intervals.assign(coverage=coverage)
+
+
+def run_job(job, references=None):
+    """
+    Run the QC reports of one bam-file, as bam_statistics.sh does.
+    :param job: dict with 'bam', 'sample', 'destination', 'reports', and 'processes'
+    :return: dict with the job, 'status' ('done' or 'failed'), 'error' and 'duration' in seconds
+    """
+    references = references or _references
+    start = time.time()
+    result = dict(job, status='done', error=None, host=socket.gethostname())
+    try:
+        if references is None:
+            raise RuntimeError("no references loaded, the worker was not forked from a running service")
+        bam, processes = job['bam'], job.get('processes', 1)
+        output = os.path.join(job['destination'], job['sample'])
+        os.makedirs(job['destination'], exist_ok=True)
+        print(f"# Running {', '.join(job['reports'])} for {bam}")
+        if 'exons' in job['reports']:
+            data = interval_coverage(bam, references['exons'], references['exon_bed'], processes)
+            coverage_chrom, panel_stats = calculate_panel_stats(data, references['panels'])
+            plots = []
+            for suffix, (coverage_genes, low_cov_exons) in zip(references['suffixes'], panel_stats):
+                write_excel(output + suffix, coverage_genes, coverage_chrom, low_cov_exons)
+                plots.append(distribution_job(coverage_genes, output + suffix))
+            from quality.plotting import render_gene_distributions
+            render_gene_distributions(plots, processes)
+        if 'introns' in job['reports']:
+            data = interval_coverage(bam, references['introns'], references['intron_bed'], processes)
+            coverage_chrom, _ = calculate_panel_stats(data, references['panels'][:1], intron_mode=True)
+            coverage_chrom.to_csv(output + '.intronic_chromosomes.tsv', sep='\t')
+        if 'chromosomes' in job['reports']:
+            chr_coverage.main(bam, CHR_LIMIT, output + '.coverage', processes=processes)
+    except Exception as e:
+        traceback.print_exc()
+        result.update(status='failed', error=f"{type(e).__name__}: {e}")
+    result['duration'] = time.time() - start
+    print(f"# Job {job['id']} {result['status']} in {result['duration']:.1f} seconds")
+    return result
+
+
+def claim_jobs(spool, n):
+    """
+    Move up to n queued jobs to running, oldest first. A job another service claimed first is skipped.
+    :return: list of tuples (running filename, job)
+    """
+    claimed = []
+    for name in sorted(os.listdir(spool_path(spool, 'queue')))[:n]:
+        # the claiming service is recorded in the name, see requeue_stale
+        running = spool_path(spool, 'running', f"{name[:-len('.json')]}@{socket.gethostname()}@{os.getpid()}.json")
+        try:
+            os.rename(spool_path(spool, 'queue', name), running)
+        except FileNotFoundError:
+            continue
+        with open(running) as handle:
+            claimed.append((running, json.load(handle)))
+    return claimed
+
+
+def beat(spool):
+    """
+    Touch the heartbeat file, to tell clients the service is running.
+    """
+    write_json(spool, '.', HEARTBEAT_FILE, {'host': socket.gethostname(), 'pid': os.getpid(),
+                                             'time': datetime.now().isoformat()})
+
+
+def is_serving(spool, heartbeat_timeout=HEARTBEAT_TIMEOUT):
+    try:
+        return time.time() - os.path.getmtime(spool_path(spool, '.', HEARTBEAT_FILE)) < heartbeat_timeout
+    except OSError:
+        return False
+
+
+def withdraw(spool, job_id, running=False):
+    """
+    Remove a job from the queue, and with running=True also from running (if the service running it stopped).
+    :return: True if the job was removed
+    """
+    for folder in ['queue', 'running'] if running else ['queue']:
+        for name in os.listdir(spool_path(spool, folder)):
+            if name[:-len('.json')].split('@')[0] == job_id:
+                try:
+                    os.remove(spool_path(spool, folder, name))
+                    return True
+                except FileNotFoundError:
+                    pass
+    return False
+
+
+def requeue_stale(spool):
+    """
+    Put jobs back in the queue that were claimed by a service on this host that is no longer running.
+    """
+    host = socket.gethostname()
+    for name in os.listdir(spool_path(spool, 'running')):
+        job_id, job_host, pid = name[:-len('.json')].split('@')
+        if job_host != host:
+            continue
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            print(f"# Requeuing job {job_id} of stopped service {pid}")
+            os.replace(spool_path(spool, 'running', name), spool_path(spool, 'queue', job_id + '.json'))
+        except PermissionError:
+            pass
+
+
+def serve(spool, references, jobs=1, idle_timeout=None, poll=POLL_SECONDS):
+    """
+    Run jobs from the spool until the stop file is created or no jobs came for idle_timeout seconds.
+    :return: number of jobs run
+    """
+    global _references
+    if multiprocessing.get_start_method() != 'fork':
+        raise RuntimeError("the QC service needs the fork start method to share the references with its workers, "
+                           "not " + multiprocessing.get_start_method())
+    make_spool(spool)
+    beat(spool)
+    if os.path.exists(spool_path(spool, '.', STOP_FILE)):
+        os.remove(spool_path(spool, '.', STOP_FILE))
+    requeue_stale(spool)
+    # set before the worker processes are forked, so the references are not sent with every job
+    _references = references
+    n_jobs = 0
+    last_job = time.time()
+    running = {}
+    print(f"# Serving {spool} with {jobs} job(s) at a time")
+    executor = ProcessPoolExecutor(jobs)
+    try:
+        while True:
+            beat(spool)
+            for filename, job in claim_jobs(spool, jobs - len(running)):
+                try:
+                    future = executor.submit(run_job, job)
+                except BrokenProcessPool:
+                    # an idle worker was killed
+                    print("# Restarting the worker processes")
+                    executor.shutdown(wait=False)
+                    executor = ProcessPoolExecutor(jobs)
+                    future = executor.submit(run_job, job)
+                running[future] = (filename, job)
+            broken = False
+            for future in [f for f in running if f.done()]:
+                filename, job = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # e.g. a worker killed for using too much memory, which breaks the pool for all running jobs
+                    broken = broken or isinstance(e, BrokenProcessPool)
+                    result = dict(job, status='failed', error=f"{type(e).__name__}: {e}", host=socket.gethostname(),
+                                  duration=None)
+                    print(f"# Job {job['id']} failed: {result['error']}")
+                write_json(spool, 'done', result['id'] + '.json', result)
+                # a client may have withdrawn the job if the heartbeat was late
+                if os.path.exists(filename):
+                    os.remove(filename)
+                n_jobs += 1
+            if broken:
+                print("# Restarting the worker processes")
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(jobs)
+            if running:
+                last_job = time.time()
+            elif os.path.exists(spool_path(spool, '.', STOP_FILE)):
+                print("# Stop file found")
+                break
+            elif idle_timeout is not None and time.time() - last_job > idle_timeout:
+                print(f"# No jobs for {idle_timeout} seconds")
+                break
+            time.sleep(poll)
+    finally:
+        executor.shutdown()
+        try:
+            os.remove(spool_path(spool, '.', HEARTBEAT_FILE))
+        except FileNotFoundError:
+            pass
+    print(f"# Ran {n_jobs} jobs")
+    return n_jobs
+
+
+def submit(spool, bam, reports=REPORTS, destination=None, processes=1):
+    """
+    Put a QC job in the spool.
+    :param destination: output folder (Default: <sample>.quality_reports in the current folder, as bam_statistics.sh)
+    :return: job id
+    """
+    make_spool(spool)
+    sample = os.path.basename(bam).split('.bam')[0]
+    # ids sort by submission time, so jobs are run in order
+    job_id = f"{time.time():.6f}_{uuid.uuid4().hex[:8]}"
+    job = {'id': job_id, 'bam': os.path.abspath(bam), 'sample': sample, 'reports': list(reports),
+           'destination': os.path.abspath(destination or sample + '.quality_reports'), 'processes': processes,
+           'submitted': datetime.now().isoformat()}
+    write_json(spool, 'queue', job_id + '.json', job)
+    print(f"# Submitted job {job_id} for {bam}")
+    return job_id
+
+
+def read_results(spool, job_ids, results):
+    """
+    Add the results of finished jobs to results.
+    """
+    for job_id in job_ids:
+        filename = spool_path(spool, 'done', job_id + '.json')
+        if job_id not in results and os.path.exists(filename):
+            with open(filename) as handle:
+                results[job_id] = json.load(handle)
+            print(f"# Job {job_id} for {results[job_id]['bam']} {results[job_id]['status']}" +
+                  (f": {results[job_id]['error']}" if results[job_id]['error'] else ''))
+
+
+def wait(spool, job_ids, poll=POLL_SECONDS, timeout=None, heartbeat_timeout=HEARTBEAT_TIMEOUT):
+    """
+    Wait for jobs to finish. If no service is running (the heartbeat is older than heartbeat_timeout) or the jobs did
+    not finish within timeout seconds, the jobs left are withdrawn and get the status 'not run'. Jobs still running
+    on a service get the status 'failed'.
+    :return: list of result dicts as returned by run_job
+    """
+    results = {}
+    start = time.time()
+    while True:
+        read_results(spool, job_ids, results)
+        if len(results) == len(job_ids):
+            break
+        serving = is_serving(spool, heartbeat_timeout)
+        if serving and (timeout is None or time.time() - start < timeout):
+            time.sleep(poll)
+            continue
+        error = f"no QC service running on {spool}" if not serving else f"not done within {timeout} seconds"
+        # the jobs of a service that stopped are also taken back from running
+        withdrawn = [job_id for job_id in job_ids if job_id not in results and
+                     withdraw(spool, job_id, running=not serving)]
+        # jobs may have finished before they could be withdrawn
+        read_results(spool, job_ids, results)
+        for job_id in job_ids:
+            if job_id not in results:
+                status = 'not run' if job_id in withdrawn else 'failed'
+                results[job_id] = {'id': job_id, 'status': status, 'error': error}
+                print(f"# Job {job_id} {status}: {error}")
+        break
+    return [results[job_id] for job_id in job_ids]
+
+
+def stop(spool):
+    make_spool(spool)
+    open(spool_path(spool, '.', STOP_FILE), 'w').close()
+
+
+if __name__ == '__main__':
+    start_time = datetime.now()
+    args = get_args()
+    print("# args:", args)
+    if args.function == 'serve':
+        # not the default on all platforms and python versions, see _references
+        multiprocessing.set_start_method('fork', force=True)
+        # clients see the service as running while it loads the references
+        make_spool(args.spool)
+        beat(args.spool)
+        serve(args.spool, load_references(args.bed, args.intron_bed, args.panels, args.panel_suffixes), args.jobs,
+              args.idle_timeout)
+    elif args.function == 'submit':
+        job_ids = [submit(args.spool, bam, args.reports, args.destination, args.processes) for bam in args.bams]
+        if args.wait:
+            statuses = [result['status'] for result in wait(args.spool, job_ids, timeout=args.timeout)]
+            if 'failed' in statuses:
+                sys.exit(1)
+            if 'not run' in statuses:
+                sys.exit(NOT_RUN)
+    else:
+        stop(args.spool)
+        print(f"# Asked the service on {args.spool} to stop")
+    print('# Duration: {}'.format(datetime.now() - start_time))
@@ -0,0 +1,295 @@
+#! /usr/bin/env python3
+
+import os
+import sys
+import argparse
+from io import StringIO
+from multiprocessing import Pool
+from datetime import datetime
+
+# imports from own repo's
+from utils_py.vcf import read_vcf, count_records, BATCH_SIZE
+
+# depth histogram range as used by bcftools stats: depths 0-500 with deeper sites in a '>500' bin
+DP_MAX = 500
+# qualities are counted in steps of 0.1, missing qualities in their own bin
+QUAL_MISSING = -1
+TRANSITIONS = ['AG', 'GA', 'CT', 'TC']
+# allele types, a record gets the types of all its alleles
+SNP, MNP, INDEL, OTHER = 1, 2, 4, 8
+# exit code of stats when the vcf-file has fewer records than -min-records, so shell scripts can stop
+TOO_FEW_RECORDS = 3
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Statistics on vcf-files. 'stats' reads a vcf-file once and writes the number of records, summary "
+                    "numbers (SNPs, MNPs, indels, multiallelic sites), Ts/Tv and the quality and depth distributions "
+                    "in the layout of bcftools stats, together with the excel sheet and plots of "
+                    "visualize_vcf_stats.py. 'count' prints the number of records. 'cohort' combines the summary "
+                    "numbers (SN) of many stats files (e.g. *vcf_summary.txt) to one excel sheet with a column pr. "
+                    "file")
+    parser.add_argument('function', choices=['stats', 'count', 'cohort'])
+    parser.add_argument('-in', dest='infiles', nargs='+', required=True,
+                        help="vcf-file (stats, count) or stats files (cohort)")
+    parser.add_argument('-out', dest='outfile',
+                        help="Output stats file (stats, e.g. vcf_summary.txt) or excel-file (cohort)")
+    parser.add_argument('-no-plot', '--no-plot', dest='plot', action='store_false',
+                        help="Only write the stats file (stats)")
+    parser.add_argument('-min-records', '--min-records', dest='min_records', type=int, default=0,
+                        help="Write nothing and exit with code {} if the vcf-file has fewer records than this "
+                             "(stats, Default: 0)".format(TOO_FEW_RECORDS))
+    parser.add_argument('-np', '--processes', dest='processes', type=int, default=1,
+                        help="Number of files parsed at the same time (cohort, Default: 1)")
+    return parser
+
+
+def get_args(args=None):
+    parser = get_parser()
+    args = parser.parse_args(args)
+    if args.function != 'count' and not args.outfile:
+        parser.error(f"{args.function} needs an output file given with -out")
+    if args.function != 'cohort' and len(args.infiles) != 1:
+        parser.error(f"{args.function} takes one vcf-file")
+    if args.function == 'cohort' and not args.outfile.endswith('.xlsx'):
+        args.outfile += '.xlsx'
+    return args
+
+
+def allele_types(refs, alts):
+    """
+    Type of each ALT allele as in bcftools: SNP, MNP (same length, more than one base differs), INDEL or OTHER
+    (symbolic alleles and breakends). Missing alleles ('.' and '*') get type 0.
+    :param refs: array of REF alleles pr. ALT allele
+    :param alts: array of ALT alleles
+    :return: tuple (int array of types, array of first ref and alt base for SNPs (e.g. 'AG'), '' for other types)
+    """
+    import pandas as pd
+    import numpy as np
+    refs = pd.Series(refs, dtype=object).str.upper()
+    alts = pd.Series(alts, dtype=object).str.upper()
+    ref_len, alt_len = np.asarray(refs.str.len()), np.asarray(alts.str.len())
+    missing = np.asarray(alts.isin(['.', '*']))
+    other = np.asarray(alts.str.contains(r'[<\[\]]', regex=True)) & ~missing
+    types = np.zeros(len(alts), dtype=np.int64)
+    types[~missing & ~other & (ref_len != alt_len)] = INDEL
+    types[other] = OTHER
+    single = ~missing & ~other & (ref_len == 1) & (alt_len == 1) & np.asarray(refs != alts)
+    types[single] = SNP
+    bases = np.where(single, np.asarray(refs + alts, dtype=object), '')
+    # alleles of the same length > 1 are SNPs if one base differs, MNPs if more do. Like bcftools, Ts/Tv is only
+    # counted from the first bases, so SNPs not at the first base count as neither
+    for i in np.flatnonzero(~missing & ~other & (ref_len == alt_len) & (ref_len > 1)):
+        differs = sum(r != a for r, a in zip(refs.iat[i], alts.iat[i]))
+        if differs == 1:
+            types[i] = SNP
+            if refs.iat[i][0] != alts.iat[i][0]:
+                bases[i] = refs.iat[i][0] + alts.iat[i][0]
+        elif differs:
+            types[i] = MNP
+    return types, bases
+
+
+def new_stats(n_samples):
+    import numpy as np
+    return {'samples': n_samples, 'records': 0, 'no_alts': 0, 'snps': 0, 'mnps': 0, 'indels': 0, 'others': 0,
+            'multiallelic': 0, 'multiallelic_snps': 0, 'ts': 0, 'tv': 0, 'ts_1st': 0, 'tv_1st': 0,
+            'qual': {}, 'dp_sites': np.zeros(DP_MAX + 2, dtype=np.int64)}
+
+
+def add_batch(stats, data):
+    """
+    Add the counts of a batch of records to the running stats.
+    """
+    import pandas as pd
+    import numpy as np
+    n = len(data)
+    stats['records'] += n
+    alts = data['ALT'].astype(str).str.split(',')
+    n_alts = np.asarray(alts.str.len())
+    record = np.repeat(np.arange(n), n_alts)
+    alleles = np.concatenate(list(alts)) if n else np.zeros(0, dtype=object)
+    types, bases = allele_types(np.asarray(data['REF'].astype(str))[record], alleles)
+    record_types = np.zeros(n, dtype=np.int64)
+    np.bitwise_or.at(record_types, record, types)
+
+    stats['no_alts'] += int(np.sum(record_types == 0))
+    for name, flag in [('snps', SNP), ('mnps', MNP), ('indels', INDEL), ('others', OTHER)]:
+        stats[name] += int(np.sum((record_types & flag) > 0))
+    multiallelic = (n_alts > 1) & (record_types > 0)
+    stats['multiallelic'] += int(np.sum(multiallelic))
+    stats['multiallelic_snps'] += int(np.sum(multiallelic & (record_types == SNP)))
+
+    is_snp = types == SNP
+    transition = np.logical_or.reduce([bases == pair for pair in TRANSITIONS]) & is_snp
+    transversion = (bases != '') & is_snp & ~transition
+    first = np.concatenate([[True], record[1:] != record[:-1]]) if len(record) else np.zeros(0, dtype=bool)
+    stats['ts'] += int(np.sum(transition))
+    stats['tv'] += int(np.sum(transversion))
+    stats['ts_1st'] += int(np.sum(transition & first))
+    stats['tv_1st'] += int(np.sum(transversion & first))
+
+    # quality bins with counts of SNP records, transitions and transversions of the first ALT and indel records
+    qual = np.asarray(pd.to_numeric(data['QUAL'], errors='coerce'), dtype=float)
+    # bcftools truncates the single precision qualities to the bin
+    qual_bin = np.where(np.isnan(qual), QUAL_MISSING,
+                        np.floor(np.nan_to_num(qual).astype(np.float32) * np.float32(10))).astype(np.int64)
+    bins, qual_index = np.unique(qual_bin, return_inverse=True)
+    counts = np.zeros((len(bins), 4), dtype=np.int64)
+    first_ts = np.zeros(n, dtype=bool)
+    first_tv = np.zeros(n, dtype=bool)
+    first_ts[record[first & transition]] = True
+    first_tv[record[first & transversion]] = True
+    # as by bcftools, SNPs are the records with a transition or transversion as 1st ALT
+    for column, selected in enumerate([first_ts | first_tv, first_ts, first_tv, (record_types & INDEL) > 0]):
+        counts[:, column] = np.bincount(qual_index[selected], minlength=len(bins))
+    for quality, count in zip(bins.tolist(), counts):
+        stats['qual'][quality] = stats['qual'].get(quality, 0) + count
+
+    site_dp = np.asarray(pd.to_numeric(data['INFO'].astype(str).str.extract(r'(?:^|;)DP=(\d+)', expand=False),
+                                       errors='coerce').dropna(), dtype=np.int64)
+    stats['dp_sites'] += np.bincount(np.minimum(site_dp, DP_MAX + 1), minlength=DP_MAX + 2)
+
+
+def compute_stats(filename, batch_size=BATCH_SIZE):
+    """
+    Statistics of a vcf-file in one streaming pass.
+    :return: dict with counters, the quality histogram and the depth histograms
+    """
+    header, batches = read_vcf(filename, batch_size)
+    stats = new_stats(len(header['samples']))
+    for data in batches:
+        add_batch(stats, data)
+    return stats
+
+
+def write_stats(stats, filename, out):
+    """
+    Write stats in the layout of bcftools stats (sections ID, SN, TSTV, QUAL and DP).
+    """
+    import numpy as np
+    def ratio(ts, tv):
+        return ts / tv if tv else 0
+
+    out.write("# This file was produced by vcf_stats.py and follows the layout of bcftools stats\n")
+    out.write("# Definition of sets:\n# ID\t[2]id\t[3]tab-separated file names\n")
+    out.write(f"ID\t0\t{filename}\n")
+    out.write("# SN, Summary numbers:\n# SN\t[2]id\t[3]key\t[4]value\n")
+    for key, name in [('samples', 'number of samples:'), ('records', 'number of records:'),
+                      ('no_alts', 'number of no-ALTs:'), ('snps', 'number of SNPs:'), ('mnps', 'number of MNPs:'),
+                      ('indels', 'number of indels:'), ('others', 'number of others:'),
+                      ('multiallelic', 'number of multiallelic sites:'),
+                      ('multiallelic_snps', 'number of multiallelic SNP sites:')]:
+        out.write(f"SN\t0\t{name}\t{stats[key]}\n")
+    out.write("# TSTV, transitions/transversions:\n# TSTV\t[2]id\t[3]ts\t[4]tv\t[5]ts/tv\t[6]ts (1st ALT)\t"
+              "[7]tv (1st ALT)\t[8]ts/tv (1st ALT)\n")
+    out.write(f"TSTV\t0\t{stats['ts']}\t{stats['tv']}\t{ratio(stats['ts'], stats['tv']):.2f}\t{stats['ts_1st']}\t"
+              f"{stats['tv_1st']}\t{ratio(stats['ts_1st'], stats['tv_1st']):.2f}\n")
+    out.write("# QUAL, Stats by quality:\n# QUAL\t[2]id\t[3]Quality\t[4]number of SNPs\t"
+              "[5]number of transitions (1st ALT)\t[6]number of transversions (1st ALT)\t[7]number of indels\n")
+    for quality in sorted(stats['qual']):
+        snps, ts, tv, indels = stats['qual'][quality]
+        if snps or ts or tv or indels:
+            label = '.' if quality == QUAL_MISSING else f"{quality / 10:.1f}"
+            out.write(f"QUAL\t0\t{label}\t{snps}\t{ts}\t{tv}\t{indels}\n")
+    out.write("# DP, Depth distribution\n# DP\t[2]id\t[3]bin\t[4]number of genotypes\t[5]fraction of genotypes (%)\t"
+              "[6]number of sites\t[7]fraction of sites (%)\n")
+    # only site depths (INFO/DP) are counted, genotype depths are left at 0 as by bcftools stats without -s
+    sites = stats['dp_sites']
+    for depth in np.flatnonzero(sites):
+        label = depth if depth <= DP_MAX else f">{DP_MAX}"
+        out.write(f"DP\t0\t{label}\t0\t{0:f}\t{sites[depth]}\t{100 * sites[depth] / sites.sum():f}\n")
+
+
+def read_stats(filename):
+    """
+    Read all sections (SN, TSTV, SiS, AF, QUAL, IDD, ST, DP, ...) of a bcftools stats file in one pass. The columns of
+    a section are named as in the comment line before it, e.g. '# SN', '[2]id', '[3]key' and '[4]value'.
+    :param filename: output of bcftools stats (or a file with only some of the sections)
+    :return: dict of section name to DataFrame, sections without rows are left out
+    """
+    import pandas as pd
+    assert os.path.exists(filename), filename + "does not exist"
+    lines = {}
+    previous = None
+    with open(filename) as handle:
+        for line in handle:
+            if not line.startswith('#'):
+                section = line.split('\t', 1)[0]
+                if section not in lines:
+                    lines[section] = [previous] if previous is not None else []
+                lines[section].append(line)
+            previous = line
+    return {section: pd.read_csv(StringIO(''.join(section_lines)), sep='\t')
+            for section, section_lines in lines.items()}
+
+
+def sample_name(filename):
+    return filename.split('.')[0]
+
+
+def summary_numbers(stats, name):
+    """
+    The summary numbers of one file as a column named after the file, indexed by key (e.g. 'number of SNPs:')
+    """
+    sn = stats['SN'].set_index('[3]key')['[4]value']
+    sn.name = name
+    return sn
+
+
+def _read_summary_numbers(filename):
+    return summary_numbers(read_stats(filename), sample_name(filename))
+
+
+def cohort_summary_numbers(filenames, processes=1):
+    """
+    Summary numbers of many bcftools stats files, parsed in a process pool and combined once.
+    :return: DataFrame indexed by key with a column pr. file
+    """
+    import pandas as pd
+    if processes > 1 and len(filenames) > 1:
+        with Pool(min(processes, len(filenames))) as pool:
+            columns = pool.map(_read_summary_numbers, filenames, chunksize=max(1, len(filenames) // (4 * processes)))
+    else:
+        columns = [_read_summary_numbers(filename) for filename in filenames]
+    # keys in order of appearance, pd.concat sorts the keys of files that differ
+    keys = list(dict.fromkeys(key for column in columns for key in column.index))
+    return pd.concat([column.reindex(keys) for column in columns], axis=1)
+
+
+def vcf_stats(vcf, outfile, plot=True, min_records=0):
+    """
+    Write the stats file of a vcf-file and make the excel sheet and plots from it.
+    :param min_records: nothing is written if the vcf-file has fewer records than this
+    :return: number of records
+    """
+    stats = compute_stats(vcf)
+    if stats['records'] < min_records:
+        print(f"# Only {stats['records']} records, less than {min_records}, no stats written")
+        return stats['records']
+    with open(outfile, 'w') as out:
+        write_stats(stats, vcf, out)
+    print(f"# Saved stats on {stats['records']} records to {outfile}")
+    if plot:
+        # plotting libraries are only loaded when plots are made
+        from quality.visualize_vcf_stats import visualize
+        visualize(outfile)
+    return stats['records']
+
+
+if __name__ == '__main__':
+    start_time = datetime.now()
+    args = get_args()
+    if args.function == 'count':
+        # only the number is printed, so it can be used in shell scripts
+        print(count_records(args.infiles[0]))
+        sys.exit()
+    print("# args:", args)
+    if args.function == 'stats':
+        if vcf_stats(args.infiles[0], args.outfile, args.plot, args.min_records) < args.min_records:
+            sys.exit(TOO_FEW_RECORDS)
+    else:
+        summary = cohort_summary_numbers(args.infiles, args.processes)
+        summary.to_excel(args.outfile)
+        print(f"# Saved excel with {summary.shape[1]} files to {args.outfile}")
+    print('# Duration: {}'.format(datetime.now() - start_time))
@@ -1,17 +1,33 @@
 #!/usr/bin/env python3
 
-import matplotlib.ticker as ticker
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pandas as pd
-import sys
-import pdb
-import matplotlib 
-matplotlib.use('Agg')
+import argparse
 # import from own repos
 from utils_py.version import print_modules, imports
+from quality.vcf_stats import cohort_summary_numbers
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Plot the quality (qual) or depth (dp) distribution of variants from bcftools stats sections, or "
+                    "make an excel-file with the summary numbers of several vcf-files (sn)")
+    parser.add_argument('function', type=str.lower, choices=['qual', 'dp', 'sn'])
+    parser.add_argument('filename', nargs='+', help="Stats file (qual, dp) or stats files (sn)")
+    parser.add_argument('-np', '--processes', dest='processes', type=int, default=1,
+                        help="Number of files parsed at the same time (sn, Default: 1)")
+    return parser
+
+
+def get_args(args=None):
+    parser = get_parser()
+    return parser.parse_args(args)
+
 
 def plot_qual(filename):
+    import pandas as pd
+    # matplotlib is only loaded by the plotting functions
+    from matplotlib import ticker
+    from quality.plotting import pyplot
+    plt = pyplot()
     qual = pd.read_csv(filename, sep='\t')
     cols = ['[4]number of SNPs', '[7]number of indels']
     pretty_names = {cols[0]: 'SNPs',
@@ -33,6 +49,10 @@ def plot_qual(filename):
 
 
 def plot_dp(filename):
+    import pandas as pd
+    from matplotlib import ticker
+    from quality.plotting import pyplot
+    plt = pyplot()
     dp = pd.read_csv(filename, sep='\t')
     cols = ['[6]number of sites']   
     pretty_names = {cols[0]: 'Number of sites'}
@@ -53,13 +73,9 @@ def plot_dp(filename):
         print(f"Saved plot to {plot_name}")
 
 
-def summarize_sn(filename):
-    # for SN
-    sn_all = pd.DataFrame()
-    for file in filename:
-        sn = pd.read_csv(file, sep='\t', index_col='[3]key').drop(columns=['# SN', '[2]id'])
-        sn.columns = [file.split('.')[0]]
-        sn_all = pd.concat([sn_all, sn], axis=1)
+def summarize_sn(filename, processes=1):
+    # for SN, the files are parsed in a process pool and combined once
+    sn_all = cohort_summary_numbers(filename, processes)
     file_name = filename[0].split('-')[0]+'.xlsx'
     sn_all.to_excel(file_name)
     print(f"Saved excel to {filename}")
@@ -69,11 +85,11 @@ def summarize_sn(filename):
 if __name__ == '__main__':
     """ Function for plotting either quality distribution or depth distribution for variants in true set. It can also 
     be used for making an excel-file containing information on several VCF-files"""
-    function = sys.argv[1].lower()
-    filename = sys.argv[2:]  # may be a list of files
-    global_modules = globals()
-    modules = imports(global_modules)
-    print_modules(list(modules))
+    args = get_args()
+    function = args.function
+    filename = args.filename  # may be a list of files
+    # module versions are only collected when printed, see utils_py.version
+    print_modules(imports(globals()))
     print("Input args: \n",
           "function:", function, "\n",
           "filename:", filename)
@@ -83,7 +99,7 @@ if __name__ == '__main__':
     elif function == 'dp':
         plot_dp(filename[0])
     elif function == 'sn':
-        summarize_sn(filename)
+        summarize_sn(filename, args.processes)
 
 
 
@@ -1,22 +1,29 @@
 #!/usr/bin/env python3
 
-import matplotlib.ticker as ticker
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pandas as pd
-import sys
-import pdb
-import matplotlib
-matplotlib.use('Agg')
-import subprocess
-import os
-from io import StringIO
+import argparse
 
 # import from own repos
 from utils_py.version import print_modules, imports
+from quality.vcf_stats import read_stats
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Save the summary numbers of a bcftools stats file as excel (<file>.xlsx) and plot its quality "
+                    "and depth distributions (<file>.pdf)")
+    parser.add_argument('infile', help="Output of bcftools stats or vcf_stats.py stats (.txt)")
+    return parser
+
+
+def get_args(args=None):
+    parser = get_parser()
+    return parser.parse_args(args)
 
 
 def plot_qual(data, axes):
+    from matplotlib import ticker
+    from quality.plotting import pyplot
+    plt = pyplot()
     cols = ['[4]number of SNPs', '[7]number of indels']
     pretty_names = {cols[0]: 'SNPs',
                     cols[1]: 'Indels'}
@@ -33,6 +40,9 @@ def plot_qual(data, axes):
 
 
 def plot_dp(data, ax):
+    from matplotlib import ticker
+    from quality.plotting import pyplot
+    plt = pyplot()
     if len(data) == 0:
         # some vcf files do not have this field, data will be empty
         ax.set_visible(False)
@@ -57,36 +67,35 @@ def plot_dp(data, ax):
 def summarize_sn(data, filename):
     # for SN
     data = data.set_index('[3]key')
-    data.drop(columns=['# SN', '[2]id'], inplace=True)
+    data.drop(['# SN', '[2]id'], axis=1, inplace=True)
     sheetname = filename.replace('txt', 'xlsx')
     data.to_excel(sheetname)
     print(f"Saved excel to {sheetname}")
 
 
 def open_vcf_stats(filename, function):
-    assert os.path.exists(filename), filename + "does not exist"
-    identifier = '^' + function
-    input = subprocess.Popen(["grep", identifier, "-B", "1"], stdin=open(filename), stdout=subprocess.PIPE)
-    decoding = StringIO(input.communicate()[0].decode('utf-8'))
-    try:
-        data = pd.read_csv(decoding, sep='\t')
-        return data
-    except pd.errors.EmptyDataError:
-       # return an empty dataframe 
-       return pd.DataFrame() 
+    """
+    Read one section of a bcftools stats file, an empty DataFrame if the file does not have the section
+    """
+    import pandas as pd
+    return read_stats(filename).get(function, pd.DataFrame())
 
 
-if __name__ == '__main__':
-    """ Function for plotting either quality distribution or depth distribution for variants in true set. It can also 
-    be used for making an excel-file containing information on several VCF-files"""
-    filename = sys.argv[1]
-    # to consider: subprocess.Popen("bcftools", "stats", filename, ">" ""$destination/"$opt"vcf_summary.txt)
-    global_modules = globals()
-    modules = imports(global_modules)
-    print_modules(list(modules))
+def visualize(filename, stats=None):
+    """
+    Save the summary numbers as excel and plot the quality and depth distributions of a bcftools stats file.
+    :param filename: bcftools stats file, the outputs are named after it
+    :param stats: sections of the file as returned by read_stats (Default: read from filename)
+    """
+    import pandas as pd
+    # matplotlib is only loaded when plotting
+    from quality.plotting import pyplot
+    plt = pyplot()
     print("# Gettings stats for", filename)
     field_names = ['SN', 'QUAL', 'DP']
-    data = map(lambda x: open_vcf_stats(filename,x), field_names)
+    if stats is None:
+        stats = read_stats(filename)
+    data = [stats.get(x, pd.DataFrame()) for x in field_names]
     fig, axes = plt.subplots(3, figsize=(8,15))
     fields_fun = [summarize_sn, plot_qual, plot_dp]
     fields_args = [filename, axes[0:2], axes[2]]
@@ -95,4 +104,14 @@ if __name__ == '__main__':
 
     plot_name = filename.replace('txt', 'pdf')
     plt.savefig(plot_name, dpi=150)
+    plt.close(fig)
     print(f"Saved plot to {plot_name}")
+
+
+if __name__ == '__main__':
+    """ Function for plotting either quality distribution or depth distribution for variants in true set. It can also 
+    be used for making an excel-file containing information on several VCF-files"""
+    filename = get_args().infile
+    # module versions are only collected when printed, see utils_py.version
+    print_modules(imports(globals()))
+    visualize(filename)
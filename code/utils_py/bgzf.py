@@ -0,0 +1,151 @@
+#! /usr/bin/env python3
+
+import struct
+import zlib
+
+# BGZF is a series of gzip members, each with a 'BC' extra field holding the compressed block size
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+BGZF_HEADER_SIZE = 12
+BGZF_TRAILER_SIZE = 8
+
+
+def make_virtual_offset(coffset, uoffset):
+    """
+    Combine a compressed (block) offset and an offset within the uncompressed block to a BGZF virtual offset.
+    :param coffset: file offset of the start of the block
+    :param uoffset: offset within the uncompressed block
+    :return: int virtual offset
+    """
+    return (coffset << 16) | uoffset
+
+
+def split_virtual_offset(voffset):
+    """
+    Split a BGZF virtual offset in the block offset and the offset within the uncompressed block.
+    :param voffset: int virtual offset
+    :return: tuple (coffset, uoffset)
+    """
+    return voffset >> 16, voffset & 0xFFFF
+
+
+def read_block(handle):
+    """
+    Read and decompress the BGZF block at the current position of the handle.
+    :param handle: binary file handle
+    :return: tuple (compressed block size, decompressed bytes) or None at end of file
+    """
+    header = handle.read(BGZF_HEADER_SIZE)
+    if len(header) < BGZF_HEADER_SIZE:
+        return None
+    if header[:4] != BGZF_MAGIC:
+        raise ValueError("Not a BGZF block, file is probably compressed with gzip instead of bgzip")
+    xlen = struct.unpack_from('<H', header, 10)[0]
+    extra = handle.read(xlen)
+    block_size = None
+    i = 0
+    while i < xlen:
+        si1, si2, slen = struct.unpack_from('<ccH', extra, i)
+        if si1 == b'B' and si2 == b'C':
+            block_size = struct.unpack_from('<H', extra, i + 4)[0] + 1
+        i += 4 + slen
+    if block_size is None:
+        raise ValueError("BGZF block is missing the BC field with the block size")
+    cdata = handle.read(block_size - BGZF_HEADER_SIZE - xlen - BGZF_TRAILER_SIZE)
+    handle.read(BGZF_TRAILER_SIZE)
+    return block_size, zlib.decompress(cdata, -15)
+
+
+class BgzfReader:
+    """
+    Reader for BGZF compressed files (bam, bgzipped vcf) that supports seeking to virtual offsets from an index.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.handle = open(filename, 'rb')
+        self._coffset = 0
+        self._next_coffset = 0
+        self._data = b''
+        self._within = 0
+        self._load_block(0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.handle.close()
+
+    def _load_block(self, coffset):
+        self.handle.seek(coffset)
+        block = read_block(self.handle)
+        self._coffset = coffset
+        self._within = 0
+        if block is None:
+            self._data = b''
+            self._next_coffset = coffset
+            return False
+        block_size, self._data = block
+        self._next_coffset = coffset + block_size
+        return True
+
+    def seek(self, voffset):
+        coffset, uoffset = split_virtual_offset(voffset)
+        if coffset != self._coffset or not self._data:
+            self._load_block(coffset)
+        self._within = uoffset
+
+    def tell(self):
+        # at the end of a block the position is the start of the next block, as virtual offsets in an index are
+        if self._data and self._within >= len(self._data):
+            self._load_block(self._next_coffset)
+        return make_virtual_offset(self._coffset, self._within)
+
+    def readline(self):
+        """
+        Read one line including the newline, crossing block boundaries if needed. Returns b'' at end of file.
+        """
+        chunks = []
+        while True:
+            if self._within >= len(self._data):
+                if not self._load_block(self._next_coffset):
+                    break
+                continue
+            newline = self._data.find(b'\n', self._within)
+            stop = len(self._data) if newline < 0 else newline + 1
+            chunks.append(self._data[self._within:stop])
+            self._within = stop
+            if newline >= 0:
+                break
+        return b''.join(chunks)
+
+    def read(self, size):
+        """
+        Read size uncompressed bytes, crossing block boundaries if needed. Returns fewer bytes at end of file.
+        """
+        chunks = []
+        while size > 0:
+            if self._within >= len(self._data):
+                # empty blocks (e.g. the end of file marker) are skipped
+                if not self._load_block(self._next_coffset):
+                    break
+                continue
+            chunk = self._data[self._within:self._within + size]
+            self._within += len(chunk)
+            size -= len(chunk)
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def blocks(self):
+        """
+        Generator of the remaining uncompressed data block by block, starting at the current position.
+        """
+        while True:
+            if self._within < len(self._data):
+                data = self._data[self._within:]
+                self._within = len(self._data)
+                yield data
+            if not self._load_block(self._next_coffset):
+                return
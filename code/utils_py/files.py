@@ -0,0 +1,52 @@
+#! /usr/bin/env python3
+
+import os
+import time
+import tempfile
+
+# cache files are shared by several users of the same folder, so they are readable by all (mkstemp makes them private)
+SHARED_FILE_MODE = 0o644
+# temporary files are hidden and end with this suffix, so they are never taken for cache entries
+TMP_SUFFIX = '.tmp'
+# temporary files older than this are left by writers that were killed
+STALE_TMP_SECONDS = 3600
+
+
+def atomic_write(filename, write, mode, binary=True):
+    """
+    Write a file through a temporary file in the same folder that is renamed to the filename, so concurrent readers
+    never see a partial file. The temporary file is removed if writing fails.
+    :param filename: file to write
+    :param write: function writing the content to an open file handle
+    :param mode: permissions of the file, e.g. SHARED_FILE_MODE
+    :param binary: open the temporary file in binary mode
+    """
+    handle, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename) or '.', prefix='.', suffix=TMP_SUFFIX)
+    try:
+        with os.fdopen(handle, 'wb' if binary else 'w') as outfile:
+            write(outfile)
+        os.chmod(tmp_filename, mode)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        try:
+            os.remove(tmp_filename)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def remove_stale_tmp(directory, max_age=STALE_TMP_SECONDS):
+    """
+    Remove temporary files of atomic_write left in a folder by writers that were killed.
+    :param max_age: only files not modified for this many seconds are removed, younger ones may still be written
+    """
+    now = time.time()
+    for entry in os.scandir(directory):
+        if not (entry.name.startswith('.') and entry.name.endswith(TMP_SUFFIX)):
+            continue
+        # files of other users of a shared folder may be gone or not removable
+        try:
+            if now - entry.stat().st_mtime > max_age:
+                os.remove(entry.path)
+        except OSError:
+            pass
@@ -0,0 +1,183 @@
+#! /usr/bin/env python3
+
+import os
+import hashlib
+
+from utils_py.files import atomic_write, remove_stale_tmp, SHARED_FILE_MODE
+
+# built indexes of reference bed-files are kept in the folder given with ICOPE_INTERVAL_CACHE (or -cache), which can be
+# shared by several users. Indexes are not cached if it is not set
+CACHE_DIR = os.environ.get('ICOPE_INTERVAL_CACHE')
+# chromosome codes are added above the positions when finding the running maximum of the ends of all chromosomes at once
+CHROM_SHIFT = 1 << 40
+
+
+def nesting_levels(codes, ends):
+    """
+    Split intervals sorted by chromosome and start in levels where the ends are sorted too. Level 0 has the intervals
+    ending at or after all earlier intervals of their chromosome, the rest are split the same way in the next levels.
+    :param codes: integer chromosome code pr. interval
+    :param ends: array of ends
+    :return: int64 array with the level pr. interval
+    """
+    import numpy as np
+    levels = np.zeros(len(ends), dtype=np.int64)
+    remaining = np.arange(len(ends))
+    level = 0
+    while len(remaining):
+        keys = codes[remaining] * CHROM_SHIFT + ends[remaining]
+        top = keys == np.maximum.accumulate(keys)
+        levels[remaining[top]] = level
+        remaining = remaining[~top]
+        level += 1
+    return levels
+
+
+class IntervalIndex:
+    """
+    Index of 0-based half-open intervals (as in bed-files) for answering many point or interval overlap queries at
+    once. Pr. chromosome the intervals are split in levels where no interval is inside an earlier one, and kept sorted
+    by start in NumPy arrays. Within a level the ends are sorted as well, so the intervals overlapping a query are
+    found exactly with two binary searches pr. level. Intervals inside other intervals go to the next level, so the
+    number of levels is the deepest nesting of the intervals, which is low for bed-files of genes or exons.
+    """
+
+    def __init__(self, chroms, starts, ends):
+        """
+        :param chroms: array of chromosome names pr. interval
+        :param starts: array of 0-based starts
+        :param ends: array of ends (exclusive)
+        """
+        import numpy as np
+        chroms = np.asarray(chroms).astype(str)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        order = np.lexsort((starts, chroms))
+        codes = np.unique(chroms[order], return_inverse=True)[1].reshape(-1)
+        levels = nesting_levels(codes, ends[order])
+        # the sort is stable, so the intervals of a chromosome and level stay sorted by start
+        by_level = np.lexsort((levels, codes))
+        order, codes, levels = order[by_level], codes[by_level], levels[by_level]
+        self.chroms, self.starts, self.ends, self.ids = chroms[order], starts[order], ends[order], order
+        # slices of the sorted arrays pr. chromosome and level
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (codes[1:] != codes[:-1]) | (levels[1:] != levels[:-1])
+        first = np.flatnonzero(first)
+        last = np.append(first[1:], len(order))
+        self.offsets = {}
+        for f, l in zip(first, last):
+            self.offsets.setdefault(str(self.chroms[f]), []).append((int(f), int(l)))
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def from_bed(cls, bed, cache_dir=None):
+        """
+        Build the index of a bed-file, or load it from the cache if it was built before for the same file.
+        :param bed: path to bed-file (chromosome, start and end in the first 3 columns)
+        :param cache_dir: folder with built indexes (Default: no caching)
+        """
+        import pandas as pd
+        import numpy as np
+        cache_file = None
+        if cache_dir is not None:
+            stat = os.stat(bed)
+            identity = f"{os.path.abspath(bed)}\t{stat.st_size}\t{stat.st_mtime_ns}"
+            cache_file = os.path.join(cache_dir, hashlib.sha1(identity.encode('utf-8')).hexdigest() + '.npz')
+            if os.path.exists(cache_file):
+                return cls.load(cache_file)
+        data = pd.read_csv(bed, sep='\t', header=None, usecols=[0, 1, 2], names=['chrom', 'start', 'end'],
+                           dtype={'chrom': str}, comment='#')
+        index = cls(np.asarray(data['chrom']), np.asarray(data['start']), np.asarray(data['end']))
+        if cache_file is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            remove_stale_tmp(cache_dir)
+            atomic_write(cache_file, index.save, SHARED_FILE_MODE)
+        return index
+
+    @classmethod
+    def union(cls, indexes):
+        """
+        Index of all intervals of several indexes, numbered in the order of the indexes.
+        """
+        import numpy as np
+        return cls(np.concatenate([index.chroms[np.argsort(index.ids)] for index in indexes]),
+                   np.concatenate([index.starts[np.argsort(index.ids)] for index in indexes]),
+                   np.concatenate([index.ends[np.argsort(index.ids)] for index in indexes]))
+
+    def save(self, filename):
+        import numpy as np
+        # the arrays are saved in input order, so the sorting is redone on load and the file format stays simple
+        inverse = np.argsort(self.ids)
+        np.savez(filename, chroms=self.chroms[inverse], starts=self.starts[inverse], ends=self.ends[inverse])
+
+    @classmethod
+    def load(cls, filename):
+        import numpy as np
+        with np.load(filename) as data:
+            return cls(data['chroms'], data['starts'], data['ends'])
+
+    def _ranges(self, chroms, starts, ends):
+        """
+        Pr. level the range [lo, hi) of sorted intervals overlapping each query: the first interval ending after the
+        query start up to the first starting at or after the query end.
+        :return: tuple (starts, ends, list with a tuple of arrays (lo, hi) pr. level)
+        """
+        import numpy as np
+        chroms = np.asarray(chroms).astype(str)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        ranges = []
+        for chrom in np.unique(chroms):
+            if chrom not in self.offsets:
+                continue
+            rows = np.flatnonzero(chroms == chrom)
+            for level, (f, l) in enumerate(self.offsets[chrom]):
+                if level == len(ranges):
+                    ranges.append((np.zeros(len(starts), dtype=np.int64), np.zeros(len(starts), dtype=np.int64)))
+                lo, hi = ranges[level]
+                lo[rows] = f + np.searchsorted(self.ends[f:l], starts[rows], side='right')
+                hi[rows] = np.maximum(f + np.searchsorted(self.starts[f:l], ends[rows], side='left'), lo[rows])
+        return starts, ends, ranges
+
+    def overlap_pairs(self, chroms, starts, ends):
+        """
+        All pairs of overlapping queries and intervals.
+        :param chroms: array of chromosome names pr. query
+        :param starts: array of 0-based query starts
+        :param ends: array of query ends (exclusive)
+        :return: tuple of arrays (query number, interval number) where interval numbers refer to the input order,
+        sorted by query
+        """
+        import numpy as np
+        starts, ends, ranges = self._ranges(chroms, starts, ends)
+        queries, candidates = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        # the ranges hold only overlapping intervals, so the memory use is bound by the number of pairs
+        for lo, hi in ranges:
+            n = hi - lo
+            queries.append(np.repeat(np.arange(len(starts)), n))
+            candidates.append(np.repeat(lo, n) + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n))
+        queries, candidates = np.concatenate(queries), np.concatenate(candidates)
+        order = np.lexsort((candidates, queries))
+        return queries[order], self.ids[candidates[order]]
+
+    def overlaps(self, chroms, starts, ends):
+        """
+        Check which queries overlap any interval.
+        :return: boolean array
+        """
+        import numpy as np
+        queries, _ = self.overlap_pairs(chroms, starts, ends)
+        found = np.zeros(len(np.atleast_1d(starts)), dtype=bool)
+        found[queries] = True
+        return found
+
+    def contains(self, chroms, positions):
+        """
+        Check which 0-based positions are inside any interval.
+        :return: boolean array
+        """
+        import numpy as np
+        positions = np.asarray(positions, dtype=np.int64)
+        return self.overlaps(chroms, positions, positions + 1)
@@ -0,0 +1,157 @@
+#! /usr/bin/env python3
+
+import os
+import struct
+
+from utils_py.bgzf import BgzfReader
+
+# tabix (.tbi) indexes use the bai binning scheme, csi indexes store min_shift and depth in the header
+TBI_MIN_SHIFT = 14
+TBI_DEPTH = 5
+
+
+def reg2bins(beg, end, min_shift=TBI_MIN_SHIFT, depth=TBI_DEPTH):
+    """
+    List the bins that may hold records overlapping the 0-based half-open region [beg, end), as in the SAM spec.
+    The defaults are the binning scheme of bai/tbi indexes, csi indexes give their own min_shift and depth.
+    """
+    end -= 1
+    bins = []
+    first = 0
+    for level in range(depth + 1):
+        shift = min_shift + 3 * (depth - level)
+        bins.extend(range(first + (beg >> shift), first + (end >> shift) + 1))
+        first += 1 << (3 * level)
+    return bins
+
+
+def find_index(filename):
+    """
+    Find the index of a bgzipped file, either <file>.csi (bcftools index) or <file>.tbi (tabix)
+    """
+    for index in [filename + '.csi', filename + '.tbi']:
+        if os.path.exists(index):
+            return index
+    raise FileNotFoundError("Could not find csi/tbi index for " + filename + ", try: bcftools index " + filename)
+
+
+def _read_names(data, offset):
+    # the tabix header (format, columns, meta char and skipped lines) followed by the sequence names
+    l_nm = struct.unpack_from('<i', data, offset + 24)[0]
+    names = data[offset + 28:offset + 28 + l_nm].rstrip(b'\x00').split(b'\x00')
+    return [name.decode('utf-8') for name in names], offset + 28 + l_nm
+
+
+def read_index(filename):
+    """
+    Read a tbi or csi index. Both are BGZF compressed.
+    :param filename: path to the .tbi or .csi file
+    :return: dict with 'names' (sequence names, empty if not stored in the index), 'min_shift', 'depth' and 'refs',
+    a list with one tuple (bins, linear index) pr. sequence. bins maps bin number to a tuple (lowest virtual offset
+    of the bin or None, array of (start, end) virtual offset chunks) and the linear index is an array of virtual
+    offsets pr. 16 kb window (tbi only, None for csi)
+    """
+    import numpy as np
+    with BgzfReader(filename) as reader:
+        data = b''.join(reader.blocks())
+    magic = data[:4]
+    if magic == b'TBI\x01':
+        min_shift, depth = TBI_MIN_SHIFT, TBI_DEPTH
+        n_ref = struct.unpack_from('<i', data, 4)[0]
+        names, offset = _read_names(data, 8)
+    elif magic == b'CSI\x01':
+        min_shift, depth, l_aux = struct.unpack_from('<iii', data, 4)
+        offset = 16
+        names = _read_names(data, offset)[0] if l_aux >= 28 else []
+        offset += l_aux
+        n_ref = struct.unpack_from('<i', data, offset)[0]
+        offset += 4
+    else:
+        raise ValueError(filename + " is not a tbi or csi index")
+    # the pseudo-bin holds meta data and no records, its number depends on the depth
+    pseudo_bin = ((1 << (3 * (depth + 1))) - 1) // 7 + 1
+    refs = []
+    for _ in range(n_ref):
+        n_bin = struct.unpack_from('<i', data, offset)[0]
+        offset += 4
+        bins = {}
+        for _ in range(n_bin):
+            if magic == b'CSI\x01':
+                bin_number, loffset, n_chunk = struct.unpack_from('<IQi', data, offset)
+                offset += 16
+            else:
+                bin_number, n_chunk = struct.unpack_from('<Ii', data, offset)
+                loffset = None
+                offset += 8
+            chunks = np.frombuffer(data, dtype='<u8', count=2 * n_chunk, offset=offset).reshape(-1, 2)
+            offset += 16 * n_chunk
+            if bin_number != pseudo_bin:
+                bins[bin_number] = (loffset, chunks)
+        linear = None
+        if magic == b'TBI\x01':
+            n_intv = struct.unpack_from('<i', data, offset)[0]
+            offset += 4
+            linear = np.frombuffer(data, dtype='<u8', count=n_intv, offset=offset)
+            offset += 8 * n_intv
+        refs.append((bins, linear))
+    return {'names': names, 'min_shift': min_shift, 'depth': depth, 'refs': refs}
+
+
+def min_offset(index, tid, beg):
+    """
+    Lowest virtual offset a record overlapping a region starting at beg can have.
+    """
+    bins, linear = index['refs'][tid]
+    if linear is not None:
+        if not len(linear):
+            return 0
+        return int(linear[min(beg >> index['min_shift'], len(linear) - 1)])
+    # csi: the lowest offset of the smallest bin holding beg, or of the closest parent bin in the index
+    depth = index['depth']
+    bin_number = ((1 << (3 * depth)) - 1) // 7 + (beg >> index['min_shift'])
+    while bin_number > 0 and bin_number not in bins:
+        bin_number = (bin_number - 1) >> 3
+    return bins[bin_number][0] if bin_number in bins else 0
+
+
+def query_chunks(index, tid, beg, end):
+    """
+    Chunks of the file that hold all records overlapping the 0-based half-open region [beg, end).
+    :return: list of (start, end) virtual offsets, sorted and merged
+    """
+    import numpy as np
+    bins = index['refs'][tid][0]
+    lowest = min_offset(index, tid, beg)
+    chunks = [bins[b][1] for b in reg2bins(beg, end, index['min_shift'], index['depth']) if b in bins]
+    if not chunks:
+        return []
+    chunks = np.concatenate(chunks)
+    chunks = chunks[chunks[:, 1] > lowest]
+    merged = []
+    for start, stop in sorted(map(tuple, chunks.tolist())):
+        start = max(start, lowest)
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return [tuple(chunk) for chunk in merged]
+
+
+def fetch_lines(reader, index, tid, beg, end):
+    """
+    Read the lines of the chunks that may hold records overlapping a region. The lines still have to be checked for
+    overlap, as the index only narrows the part of the file to read.
+    :param reader: BgzfReader of the bgzipped file
+    :param index: index as returned by read_index
+    :return: generator of tuples (virtual offset, line)
+    """
+    for start, stop in query_chunks(index, tid, beg, end):
+        reader.seek(start)
+        while True:
+            voffset = reader.tell()
+            if voffset >= stop:
+                break
+            line = reader.readline()
+            if not line:
+                break
+            yield voffset, line
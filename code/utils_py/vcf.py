@@ -0,0 +1,172 @@
+#! /usr/bin/env python3
+
+import io
+import re
+import gzip
+from itertools import islice
+
+from utils_py.bgzf import BgzfReader
+from utils_py.tabix import find_index, read_index, fetch_lines
+
+GZIP_MAGIC = b'\x1f\x8b'
+VCF_COLUMNS = ['CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT']
+# number of records pr. batch, memory use scales with this and not the size of the file
+BATCH_SIZE = 100000
+# structured meta lines, e.g. ##INFO=<ID=DP,Number=1,Type=Integer,Description="Total Depth">
+STRUCTURED_META = re.compile(r'^##(\w+)=<(.*)>$')
+META_FIELD = re.compile(r'(\w+)=("(?:[^"\\]|\\.)*"|[^,]*)')
+
+
+def open_vcf(filename):
+    """
+    Open a plain, gzip or BGZF compressed vcf-file for reading in binary mode. Decompression is done in-process.
+    """
+    with open(filename, 'rb') as handle:
+        magic = handle.read(2)
+    if magic == GZIP_MAGIC:
+        # BGZF is a series of gzip members, which gzip reads as one stream
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def parse_meta_line(line):
+    """
+    Parse a structured meta line to its key and fields.
+    :param line: str, e.g. '##INFO=<ID=DP,Number=1,Type=Integer,Description="Total Depth">'
+    :return: tuple (key, dict of fields) e.g. ('INFO', {'ID': 'DP', 'Number': '1', ...}) or None for other lines
+    """
+    match = STRUCTURED_META.match(line)
+    if match is None:
+        return None
+    fields = {name: value[1:-1] if value.startswith('"') else value
+              for name, value in META_FIELD.findall(match.group(2))}
+    return match.group(1), fields
+
+
+def read_header(handle):
+    """
+    Read the header of a vcf-file up to and including the #CHROM line.
+    :param handle: binary handle as returned by open_vcf, positioned at the start of the file
+    :return: dict with 'meta' (list of all ## lines), one dict pr. structured key (e.g. 'INFO', 'FORMAT', 'FILTER',
+    'contig') mapping ID to fields, 'columns' (names of the record columns) and 'samples'
+    """
+    header = {'meta': [], 'INFO': {}, 'FORMAT': {}, 'FILTER': {}, 'contig': {}, 'columns': None, 'samples': []}
+    for line in handle:
+        line = line.decode('utf-8').rstrip('\n')
+        if line.startswith('##'):
+            header['meta'].append(line)
+            parsed = parse_meta_line(line)
+            if parsed is not None and 'ID' in parsed[1]:
+                header.setdefault(parsed[0], {})[parsed[1]['ID']] = parsed[1]
+        elif line.startswith('#'):
+            header['columns'] = line[1:].split('\t')
+            header['samples'] = header['columns'][len(VCF_COLUMNS):]
+            return header
+        else:
+            raise ValueError("vcf header is missing the #CHROM line")
+    return header
+
+
+def info_subfields(header, key):
+    """
+    Names of the subfields of an INFO field with a 'Format: a|b|c' description, e.g. the CSQ field added by VEP.
+    :param header: header as returned by read_header
+    :param key: INFO ID
+    :return: list of subfield names or None if the field or its format is not in the header
+    """
+    description = header['INFO'].get(key, {}).get('Description', '')
+    if 'Format: ' not in description:
+        return None
+    return description.split('Format: ', 1)[1].strip().split('|')
+
+
+def read_batches(lines, columns=None, batch_size=BATCH_SIZE, frame=True):
+    """
+    Generator of record batches from an iterator of record lines.
+    :param lines: iterator of bytes lines (e.g. an open vcf after read_header)
+    :param columns: column names, None for integer column names
+    :param batch_size: number of records pr. batch
+    :param frame: yield DataFrames if True, else lists of split records. The columns of the DataFrames are strings
+    with the text of the file, except POS (the second column) which is int64
+    """
+    if frame:
+        import pandas as pd
+        import numpy as np
+    lines = iter(lines)
+    while True:
+        batch = list(islice(lines, batch_size))
+        if not batch:
+            return
+        if frame:
+            # the types are fixed, as pandas infers them pr. batch (e.g. CHROM is int in a batch of chromosome 1)
+            data = pd.read_csv(io.BytesIO(b''.join(batch)), sep='\t', header=None, names=columns, dtype=object)
+            data[data.columns[1]] = data[data.columns[1]].astype(np.int64)
+            yield data
+        else:
+            yield [line.decode('utf-8').rstrip('\n').split('\t') for line in batch]
+
+
+def count_records(filename):
+    """
+    Number of records in a vcf-file, without parsing them.
+    """
+    with open_vcf(filename) as handle:
+        read_header(handle)
+        return sum(1 for line in handle if line.strip())
+
+
+def overlaps(line, chrom, beg, end):
+    """
+    Check if a vcf record overlaps the 0-based half-open region [beg, end), the record spans the REF allele.
+    """
+    fields = line.split(b'\t', 4)
+    pos = int(fields[1]) - 1
+    return fields[0].decode('utf-8') == chrom and pos < end and pos + len(fields[3]) > beg
+
+
+def region_lines(filename, regions, names=None):
+    """
+    Generator of the record lines overlapping any of the regions, read with the csi/tbi index so only the BGZF blocks
+    of the regions are decompressed. Each record is given once, in file order.
+    :param filename: BGZF compressed and indexed vcf-file
+    :param regions: iterable of (chromosome, 0-based start, end)
+    :param names: sequence names in index order, used if the index does not store them (e.g. the contigs in the
+    header)
+    """
+    index = read_index(find_index(filename))
+    tids = {name: tid for tid, name in enumerate(index['names'] or names or [])}
+    regions = sorted((tids[chrom], int(beg), int(end), chrom) for chrom, beg, end in regions if chrom in tids)
+    last = -1
+    with BgzfReader(filename) as reader:
+        for tid, beg, end, chrom in regions:
+            if tid >= len(index['refs']):
+                continue
+            for voffset, line in fetch_lines(reader, index, tid, beg, end):
+                # regions are sorted, so records already given for an earlier region come before the last one
+                if voffset > last and overlaps(line, chrom, beg, end):
+                    last = voffset
+                    yield line
+
+
+def read_vcf(filename, batch_size=BATCH_SIZE, frame=True, regions=None):
+    """
+    Read a vcf-file in batches.
+    :param filename: plain, gzip or BGZF compressed vcf-file
+    :param batch_size: number of records pr. batch
+    :param frame: yield DataFrames if True, else lists of split records
+    :param regions: only read records overlapping these (chromosome, 0-based start, end) regions using the csi/tbi
+    index of the file (Default: read all records)
+    :return: tuple (header as returned by read_header, generator of record batches)
+    """
+    handle = open_vcf(filename)
+    header = read_header(handle)
+    if regions is not None:
+        handle.close()
+        lines = region_lines(filename, regions, list(header['contig']))
+        return header, read_batches(lines, header['columns'], batch_size, frame)
+
+    def batches():
+        with handle:
+            yield from read_batches(handle, header['columns'], batch_size, frame)
+
+    return header, batches()
@@ -1,6 +1,14 @@
 #! /usr/bin/env python
 
+import os
+import sys
 import types
+import atexit
+
+# the scripts only print module versions when this is set (e.g. ICOPE_PRINT_MODULES=1), icope_ngs.py --print-modules
+# prints the modules loaded by a command when it is done
+PRINT_MODULES = 'ICOPE_PRINT_MODULES'
+
 
 def imports(global_modules):
     for name, val in global_modules.items():
@@ -8,11 +16,25 @@ def imports(global_modules):
             yield val
 
 
-def print_modules(modules):
+def loaded_modules():
+    """
+    Installed top level packages loaded so far, also the ones imported lazily inside functions
+    """
+    return [module for name, module in sorted(sys.modules.items())
+            if '.' not in name and isinstance(module, types.ModuleType) and hasattr(module, '__version__')
+            and 'site-packages' in (getattr(module, '__file__', None) or '')]
+
+
+def print_modules(modules, force=False):
+    if not force:
+        # pandas, numpy and matplotlib are imported inside the functions using them, so with PRINT_MODULES set the
+        # modules are printed when the script is done
+        if os.environ.get(PRINT_MODULES, '0') not in ('', '0'):
+            atexit.register(lambda: print_modules(loaded_modules(), force=True))
+        return
     print("# Loaded modules:\nModule \tVersion")
-    for x in modules: 
+    for x in modules:
         try:
           print(x.__name__, "\t", x.__version__)
-        except: 
+        except:
            print(x.__name__)
-